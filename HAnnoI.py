@@ -1,27 +1,42 @@
 import sys
 import os
 from pathlib import Path
+from contextlib import contextmanager
 
 import pandas as pd
+import numpy as np
 import fitz
 
-from PyQt6.QtCore import Qt, QSize, QPointF, QPoint, QRectF, QRect, pyqtSignal
+from PyQt6.QtCore import Qt, QSize, QPointF, QPoint, QRectF, QRect, QTimer, pyqtSignal
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QPushButton, QLabel, QFileDialog, QVBoxLayout, QHBoxLayout,
                              QWidget, QSpinBox, QGraphicsItem, QGraphicsScene, QGraphicsWidget, QToolBar, QGraphicsView,
                              QGraphicsRectItem, QStatusBar, QMenu, QDialog, QLineEdit, QInputDialog, QGridLayout,
-                             QFrame, QGraphicsLineItem, QTabWidget, QSpacerItem, QComboBox)
-from PyQt6.QtGui import QAction, QIcon, QPixmap, QPen, QPainter, QColor, QPolygonF, QMouseEvent, QCursor
+                             QFrame, QGraphicsLineItem, QTabWidget, QSpacerItem, QComboBox, QProgressDialog,
+                             QListWidget, QListWidgetItem, QAbstractItemView, QCheckBox)
+from PyQt6.QtGui import QAction, QActionGroup, QIcon, QPixmap, QPen, QPainter, QColor, QPolygonF, QMouseEvent, QCursor
+
+from instrumentation import Instrumentation, instrumented
+from journal import Journal, readJournal, pendingJournals
+from project_store import ProjectStore, EXTENSION
+from jobs import (ExportJob, RenderJob, ProposalJob, DescriptorJob, MatchJob, IndexJob, DetectionJob, FilterJob,
+                  writeCsv)
+from page_analysis import (proposePage, newBoxes, loadGray, textLines, snapAnchors, readingOrder,
+                           overlappingPairs, pageDescriptors, nearest, matchTemplate, FILTERS, filteredName)
+from batch_render import cropName, cropBox
+from corpus_index import CorpusIndex, INDEX_PATH as CORPUS_INDEX
 
 '''
 ((1)) Custom GraphicsView to integrate into main window
 '''
 class GraphicsView(QGraphicsView):
     mouse_pressed_signal = pyqtSignal(QPoint)  # <- this enables sending the cursor position to the main window
+    mouse_released_signal = pyqtSignal(bool)  # <- True if the mouse button released ends a rubber band selection
 
     def __init__(self, scene):
         super().__init__(scene)
 
         self.is_pressed = False
+        self.selecting = False  # <- True while a rubber band selection is dragged
         self.setDragMode(QGraphicsView.DragMode.ScrollHandDrag)
         self.setFocusPolicy(
             Qt.FocusPolicy.NoFocus)  # <- this is needed so that rectangle positions may be adjusted via arrow keys
@@ -49,6 +64,11 @@ class GraphicsView(QGraphicsView):
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
             self.is_pressed = True
+
+            # Shift + drag selects all items within a rectangle (Shift + Ctrl + drag adds them to the selection)
+            if event.modifiers() & Qt.KeyboardModifier.ShiftModifier:
+                self.selecting = True
+                self.setDragMode(QGraphicsView.DragMode.RubberBandDrag)
             self.mouse_pressed_signal.emit(event.pos())
 
         if event.button() == Qt.MouseButton.RightButton:
@@ -68,6 +88,13 @@ class GraphicsView(QGraphicsView):
             self.mouse_pressed_signal.emit(event.pos())
         super().mouseReleaseEvent(event)
 
+        if event.button() == Qt.MouseButton.LeftButton:
+            selecting = self.selecting
+            if selecting:
+                self.selecting = False
+                self.setDragMode(QGraphicsView.DragMode.ScrollHandDrag)
+            self.mouse_released_signal.emit(selecting)
+
 '''
 ((2)) Main Window
 '''
@@ -82,6 +109,9 @@ class MainWindow(QMainWindow):
         '''
         ((2.0)) Data storage and stuff
         '''
+        ## Latency histograms of the main actions (see ((3.7)))
+        self.instrumentation = Instrumentation(item_count=lambda: len(self.item_index))
+
         ## Dictionaries that store all items within the scene
         self.item_dict = dict()  # <- for annotations
         self.item_coords = dict()  # <- for coordinates and shape of items
@@ -102,12 +132,54 @@ class MainWindow(QMainWindow):
         self.current_color = None
         self.current_layer = None
 
-        self.layer_levels = dict()
+        self.layer_levels = dict()  # <- levels of categorical layers; items store the position (code) of their level
+        self.level_codes = dict()  # <- the codes of the levels of each categorical layer (see ((3.19)))
 
         # dictionary that - for each page - stores all items placed on the page
         self.page_items = dict()
         self.page_items[1] = []
 
+        ## Edit journal for crash recovery (see ((3.9)))
+        self.document_path = None  # <- path of the loaded PDF or image
+        self.journal = None
+        self.replaying = False  # <- no edits are journaled while a journal is replayed
+        self.snapshot_every = 2000  # <- the journal is compacted after this many edits
+        self.edit_batch = None  # <- edits of one operation on several items, saved together (see ((3.18)))
+
+        ## SQLite project (see ((3.10))); while a project is open, edits are saved to it instead of the journal
+        self.project = None
+        self.project_document = None  # <- id of the loaded document within the project
+
+        ## Export and render jobs that run in the background (see ((3.11)))
+        self.jobs = []
+
+        ## Proposed letter boxes (see ((3.12))); dictionary of page numbers and lists of (not yet accepted) items
+        self.proposals = dict()
+        self.proposal_values = dict()  # <- proposal: annotation values it gets when accepted (see ((3.17)))
+
+        ## Text lines of each page (see ((3.13))); computed when they are needed first
+        self.page_lines = dict()
+
+        ## Glyph descriptors for the similarity search (see ((3.16)))
+        self.glyphs = dict()  # <- item: (page, coordinates the descriptor was computed for, descriptor)
+        self.glyph_matrix = None  # <- (items, pages, descriptor matrix), rebuilt from glyphs after changes
+        self.similar_dialog = None
+        self.similar_count = 20  # <- similar items listed
+        self.glyph_job_size = 500  # <- more items than this are described in the background
+
+        ## Template matching (see ((3.17)))
+        self.match_threshold = 80  # <- minimum normalized cross-correlation (in percent) of an occurrence
+
+        ## Corpus search (see ((3.20))); the index is opened when it is searched first
+        self.corpus_index = None
+        self.corpus_dialog = None
+        self.corpus_results = []
+        self.corpus_limit = 1000  # <- results listed (all are counted)
+
+        ## Display filters (see ((3.21))); the filtered images of the pages are cached in the temp folder
+        self.page_filter = None  # <- filter the pages are shown with (None for the page images themselves)
+        self.filter_job = None  # <- job that computes the filters of the pages that are not cached yet
+
         '''
         ((2.1)) Layout
         '''
@@ -159,6 +231,7 @@ class MainWindow(QMainWindow):
         self.scene = QGraphicsScene(0, 0, 0, 0)
         self.view = GraphicsView(self.scene)
         self.view.mouse_pressed_signal.connect(self.mouseTracker)
+        self.view.mouse_released_signal.connect(self.mouseReleased)
 
         # per default one tab; additional tabs are added to match page count of loaded document
         self.view_tabs = QTabWidget()
@@ -279,10 +352,141 @@ class MainWindow(QMainWindow):
         import_menu.addAction(csv_action)
         import_menu.addAction(scheme_action)
 
-        export_action = QAction('Export', self)
+        export_action = QAction('Export CSV', self)
         export_action.setStatusTip('Export all annotations to CSV file')
         export_action.triggered.connect(self.exportAnnotations)
-        menu.addAction(export_action)
+
+        detection_action = QAction('Export Detection Dataset', self)
+        detection_action.setStatusTip('Export the boxes as a COCO, YOLO or Pascal VOC dataset, with the values of one '
+                                      'layer as categories')
+        detection_action.triggered.connect(self.exportDetection)
+
+        export_menu = menu.addMenu('Export')
+        export_menu.addAction(export_action)
+        export_menu.addAction(detection_action)
+
+        open_project_action = QAction('Open Project', self)
+        open_project_action.setStatusTip('Open a document of a project file')
+        open_project_action.triggered.connect(self.openProject)
+
+        save_project_action = QAction('Save to Project', self)
+        save_project_action.setStatusTip('Save the current document to a project file; later edits are saved right away')
+        save_project_action.triggered.connect(self.saveProject)
+
+        project_menu = menu.addMenu('Project')
+        project_menu.addAction(open_project_action)
+        project_menu.addAction(save_project_action)
+
+        propose_page_action = QAction('Propose Boxes (Current Page)', self)
+        propose_page_action.setStatusTip('Propose boxes for all letters (connected ink components) of the current page')
+        propose_page_action.triggered.connect(self.proposeCurrentPage)
+
+        propose_document_action = QAction('Propose Boxes (All Pages)', self)
+        propose_document_action.setStatusTip('Propose boxes for all letters of all pages (in the background)')
+        propose_document_action.triggered.connect(self.proposeAllPages)
+
+        accept_action = QAction('Accept Proposals', self)
+        accept_action.setStatusTip('Turn all proposed boxes of the current page into items')
+        accept_action.triggered.connect(self.acceptProposals)
+
+        reject_action = QAction('Reject Proposals', self)
+        reject_action.setStatusTip('Remove all proposed boxes of the current page')
+        reject_action.triggered.connect(self.rejectProposals)
+
+        match_page_action = QAction('Find Occurrences (Current Page)', self)
+        match_page_action.setStatusTip('Propose boxes for all occurrences of the selected item on the current page')
+        match_page_action.triggered.connect(self.matchCurrentPage)
+
+        match_document_action = QAction('Find Occurrences (All Pages)', self)
+        match_document_action.setStatusTip('Propose boxes for all occurrences of the selected item on all pages '
+                                           '(in the background)')
+        match_document_action.triggered.connect(self.matchAllPages)
+
+        propose_menu = menu.addMenu('Propose')
+        propose_menu.addAction(propose_page_action)
+        propose_menu.addAction(propose_document_action)
+        propose_menu.addAction(match_page_action)
+        propose_menu.addAction(match_document_action)
+        propose_menu.addAction(accept_action)
+        propose_menu.addAction(reject_action)
+
+        snap_selected_action = QAction('Snap Anchors (Selected Items)', self)
+        snap_selected_action.setStatusTip('Set the anchors of the selected items to the baseline of their text line')
+        snap_selected_action.triggered.connect(self.snapSelectedAnchors)
+
+        snap_page_action = QAction('Snap Anchors (Current Page)', self)
+        snap_page_action.setStatusTip('Set the anchors of all items of the current page to the baseline of their line')
+        snap_page_action.triggered.connect(self.snapPageAnchors)
+
+        anchor_menu = menu.addMenu('Anchors')
+        anchor_menu.addAction(snap_selected_action)
+        anchor_menu.addAction(snap_page_action)
+
+        renumber_page_action = QAction('Renumber Page by Reading Order', self)
+        renumber_page_action.setStatusTip('Give the items of the current page their indices in reading order')
+        renumber_page_action.triggered.connect(self.renumberPage)
+
+        renumber_document_action = QAction('Renumber Document by Reading Order', self)
+        renumber_document_action.setStatusTip('Give all items their indices in reading order (page by page)')
+        renumber_document_action.triggered.connect(self.renumberDocument)
+
+        order_menu = menu.addMenu('Order')
+        order_menu.addAction(renumber_page_action)
+        order_menu.addAction(renumber_document_action)
+
+        overlap_action = QAction('Find Overlapping Items', self)
+        overlap_action.setStatusTip('List pairs of items that overlap (e.g. boxes that were added twice)')
+        overlap_action.triggered.connect(self.findOverlaps)
+
+        similar_action = QAction('Find Similar Items', self)
+        similar_action.setShortcut('Ctrl+F')
+        similar_action.setStatusTip('List the items that look most like the selected item (on all pages)')
+        similar_action.triggered.connect(self.findSimilar)
+
+        level_count_action = QAction('Count Levels', self)
+        level_count_action.setStatusTip('Show how many items have each level of the categorical layers')
+        level_count_action.triggered.connect(self.showLevelCounts)
+
+        corpus_action = QAction('Search Corpus', self)
+        corpus_action.setShortcut('Ctrl+Shift+F')
+        corpus_action.setStatusTip('Find items by their values in all exported CSV files (e.g. Letter=s Word=w*)')
+        corpus_action.triggered.connect(self.showCorpusSearch)
+
+        check_menu = menu.addMenu('Check')
+        check_menu.addAction(overlap_action)
+        check_menu.addAction(similar_action)
+        check_menu.addAction(level_count_action)
+        check_menu.addAction(corpus_action)
+
+        select_page_action = QAction('Select All Items (Current Page)', self)
+        select_page_action.setShortcut('Ctrl+Shift+A')
+        select_page_action.setStatusTip('Select all items of the current page (Shift + drag selects the items within '
+                                        'a rectangle, Ctrl + click adds an item to the selection)')
+        select_page_action.triggered.connect(self.selectPage)
+
+        recolor_selection_action = QAction('Recolor Selected Items', self)
+        recolor_selection_action.setStatusTip('Give all selected items the current item color')
+        recolor_selection_action.triggered.connect(self.recolorSelection)
+
+        selection_menu = menu.addMenu('Selection')
+        selection_menu.addAction(select_page_action)
+        selection_menu.addAction(recolor_selection_action)
+
+        # the display filters exclude each other; the pages are filtered in the background when a filter is chosen
+        view_menu = menu.addMenu('View')
+        self.filter_group = QActionGroup(self)
+        for name, label, tip in [(None, 'Original Page', 'Show the page images as they are'),
+                                 ('contrast', 'Contrast Stretch', 'Stretch the gray levels of faint pages'),
+                                 ('binary', 'Adaptive Binarization', 'Show ink black and paper white (local threshold)'),
+                                 ('flat', 'Flatten Background', 'Remove stains, shadows and uneven lighting'),
+                                 ('ink', 'Ink Only', 'Show only the ink of the page (on white)')]:
+            filter_action = QAction(label, self)
+            filter_action.setStatusTip(tip)
+            filter_action.setCheckable(True)
+            filter_action.setChecked(name is None)
+            filter_action.triggered.connect(lambda checked, name=name: self.setPageFilter(name))
+            self.filter_group.addAction(filter_action)
+            view_menu.addAction(filter_action)
 
         screenshot_action = QAction('Render', self)
         screenshot_action.setStatusTip('Render screenshots')
@@ -321,6 +525,11 @@ class MainWindow(QMainWindow):
         self.scene.selectionChanged.connect(self.changeKey)
         self.anchorStatus = False
 
+        # these scene items are created once and reused (see ((3.8))); scene.clear() deletes them
+        self.page_pixmap = None
+        self.anchor = None
+        self.sizer = None
+
         self.annotation_mode = False
         self.level_index = 0
         self.level_text = None
@@ -335,6 +544,46 @@ class MainWindow(QMainWindow):
         view_layout.addWidget(self.annotation_text,     0, 0, 1, 1)
         view_layout.addWidget(self.annotation_level,    0, 1, 1, 1)
 
+        # Diagnostics (latency overlay in the status bar, profiling of a chosen action)
+        self.overlay_action = QAction('Latency Overlay', self)
+        self.overlay_action.setStatusTip('Show latencies of the main actions, item count and memory in the status bar')
+        self.overlay_action.setCheckable(True)
+        self.overlay_action.triggered.connect(self.toggleOverlay)
+
+        self.profile_action = QAction('Profile Action', self)
+        self.profile_action.setStatusTip('Profile every call of a chosen action until toggled off')
+        self.profile_action.setCheckable(True)
+        self.profile_action.triggered.connect(self.toggleProfiling)
+
+        summary_action = QAction('Write Latency Summary', self)
+        summary_action.setStatusTip('Write latency histograms, item count and memory to Diagnostics/latency.log')
+        summary_action.triggered.connect(self.writeLatencySummary)
+
+        diagnostics_menu = menu.addMenu('Diagnostics')
+        diagnostics_menu.addAction(self.overlay_action)
+        diagnostics_menu.addAction(self.profile_action)
+        diagnostics_menu.addAction(summary_action)
+
+        self.overlay_label = QLabel()
+        self.overlay_label.hide()
+        self.status_bar.addPermanentWidget(self.overlay_label)
+
+        self.overlay_timer = QTimer(self)
+        self.overlay_timer.timeout.connect(self.updateOverlay)
+
+        # a summary of all histograms is written to the log every five minutes
+        self.summary_timer = QTimer(self)
+        self.summary_timer.timeout.connect(self.instrumentation.logSummary)
+        self.summary_timer.start(300000)
+
+        # the edit journal is compacted every five minutes (if there were any edits)
+        self.journal_timer = QTimer(self)
+        self.journal_timer.timeout.connect(self.compactJournal)
+        self.journal_timer.start(300000)
+
+        # offer to replay edits that were not exported before the app was closed or crashed
+        QTimer.singleShot(0, self.offerRecovery)
+
     '''
     ((3)) CUSTOM FUNCTIONS
     '''
@@ -353,32 +602,26 @@ class MainWindow(QMainWindow):
         self.anno_pageTxt.setText('No document/image loaded')
 
         if len(fname[0]) > 0:
-            self.scene.clear()
-            self.clearDictionaries()
-            self.clearAnnotationTab()
+            self.loadImage(fname[0])
 
-            # remove all view tabs but the first one:
-            for i in reversed(range(list(self.page_items.keys())[-1])):
-                if i == 0: break
-                else: self.view_tabs.removeTab(i)
+    # this does the actual work of imgImport; it is also used to load images without a file dialog
+    def loadImage(self, path):
+        self.clearScene()
+        self.clearDictionaries()
+        self.clearAnnotationTab()
+        self.clearPages()
 
-            self.page_index = dict()
-            self.page_items = dict()
-
-            # clear temp folder to avoid conflicts
-            temp_path = Path('./temp')
-            for temp_file in temp_path.iterdir():
-                if temp_file.is_file(): temp_file.unlink()
+        file = path.split('/')
+        self.anno_sheetTxt.setText(file[-1])  # <- adds name of current work sheet to program
+        self.anno_pageTxt.setText(str(1))
 
-            file = fname[0].split('/')
-            self.anno_sheetTxt.setText(file[-1])  # <- adds name of current work sheet to program
-            self.anno_pageTxt.setText(str(1))
+        self.showPage(path)
 
-            self.scene.addPixmap(QPixmap(fname[0]))
-            self.scene.items()[0].setZValue(1)
+        self.page_index[path] = 1
+        self.page_items[1] = []
 
-            self.page_index[fname[0]] = 1
-            self.page_items[1] = []
+        self.document_path = path
+        self.startJournal()
 
     # load in PDF file to annotate all pages
     def pdfImport(self):
@@ -388,31 +631,31 @@ class MainWindow(QMainWindow):
         fname = QFileDialog.getOpenFileName(self, 'Open Image', './', '(*.pdf)',)
 
         if len(fname[0]) > 0:
-            # STEP 1: CLEAR EVERYTHING
-            self.scene.clear()
-            self.clearDictionaries()
-            self.clearAnnotationTab()
-        else: return
-
-        # remove all view tabs but the first one:
-        for i in reversed(range(list(self.page_items.keys())[-1])):
-            if i == 0: break
-            else: self.view_tabs.removeTab(i)
+            self.loadPdf(fname[0])
 
-        self.page_index = dict()
-        self.page_items = dict()
+    # this does the actual work of pdfImport; it is also used to load PDF files without a file dialog (e.g. benchmarks)
+    @instrumented('pdfImport')
+    def loadPdf(self, path):
+        self.scene.clearSelection()
+        self.view_tabs.setCurrentIndex(0)
 
-        # clear temp folder to avoid conflicts
-        temp_path = Path('./temp')
-        for temp_file in temp_path.iterdir():
-            if temp_file.is_file(): temp_file.unlink()
+        # STEP 1: CLEAR EVERYTHING
+        self.clearScene()
+        self.clearDictionaries()
+        self.clearAnnotationTab()
+        self.clearPages()
 
         # STEP 2: PROCESS PDF FILE
-        file = fname[0].split('/')
+        file = path.split('/')
         self.anno_sheetTxt.setText(file[-1])  # <- adds name of current work sheet to program
 
-        pdf_file = fitz.open(fname[0])
+        self.extractPages(fitz.open(path), file[-1])
+
+        self.document_path = path
+        self.startJournal()
 
+    # writes the image of each page of a PDF file to the temp folder and adds one tab per page
+    def extractPages(self, pdf_file, file_name):
         for i in range(len(pdf_file)):
             page = pdf_file.load_page(i)  # load the page
             image = page.get_images(full=True)  # get images on the page
@@ -423,7 +666,7 @@ class MainWindow(QMainWindow):
             image_bytes = base_image['image']
             image_ext = base_image['ext']
 
-            image_name = file[-1] + '_page_' + str(i + 1) + '.' + image_ext
+            image_name = file_name + '_page_' + str(i + 1) + '.' + image_ext
 
             self.page_index[image_name] = i + 1
 
@@ -431,8 +674,7 @@ class MainWindow(QMainWindow):
                 image_file.write(image_bytes)
 
         current_page = list(self.page_index.keys())[0]
-        self.scene.addPixmap(QPixmap('temp/' + current_page))
-        self.scene.items()[0].setZValue(1)
+        self.showPage('temp/' + current_page)
 
         self.anno_pageTxt.setText(str(self.page_index[current_page]))
 
@@ -441,6 +683,7 @@ class MainWindow(QMainWindow):
         for i in range(len(self.page_index) - 1):
             new_view = GraphicsView(self.scene)
             new_view.mouse_pressed_signal.connect(self.mouseTracker)
+            new_view.mouse_released_signal.connect(self.mouseReleased)
             self.view_tabs.addTab(new_view, 'Page ' + str(i + 2))
 
             self.page_items[i + 2] = []
@@ -456,78 +699,51 @@ class MainWindow(QMainWindow):
             'Open CSV File', './', '(*.csv)', )
 
         if len(fname[0]) > 0:
-            # load in data frame
-            df = pd.read_csv(fname[0])
+            self.loadCsv(fname[0])
+
+    # this does the actual work of csvImport; it is also used to load CSV files without a file dialog (e.g. benchmarks);
+    # if document is given, it is used instead of looking for the PDF/image next to the CSV file
+    @instrumented('csvImport')
+    def loadCsv(self, path, document=None):
+        # load in data frame
+        self.loadFrame(pd.read_csv(path), path, document)
+
+    # loads items and annotations from a data frame in the CSV export format; path is the CSV file the data frame was
+    # read from (None for projects, which always give the document)
+    def loadFrame(self, df, path, document=None):
+        self.scene.clearSelection()
+        self.view_tabs.setCurrentIndex(0)
 
-            # get some file and path info
-            file_csv = fname[0].split('/')[-1]  # name of csv file
-            file_doc = df['Source'][0]  # name of image file
-            file_path = fname[0].replace(file_csv, '')
-        else: return
+        # get some file and path info
+        file_doc = df['Source'][0] if document is None else os.path.basename(document)  # name of image file
 
         # STEP 2: CLEAN UP EVERYTHING CURRENTLY LOADED
         # this branch is for importing a single image
         if file_doc.split('.')[-1] != 'pdf':
-            self.findFile('Single Image')
-            self.imgImport()
+            if document is not None: self.loadImage(document)
+            else:
+                self.findFile('Single Image')
+                self.imgImport()
 
         # this branch is for importing multiple images from a pdf file; the code will skip to STEP 4 otherwise
         else:
-            self.scene.clear()
+            self.clearScene()
             self.clearDictionaries()
             self.clearAnnotationTab()
-
-            # remove all view tabs but the first one:
-            for i in reversed(range(list(self.page_items.keys())[-1])):
-                if i == 0: break
-                else: self.view_tabs.removeTab(i)
-
-            self.page_index = dict()
-            self.page_items = dict()
-
-            # clear temp folder to avoid conflicts
-            temp_path = Path('./temp')
-            for temp_file in temp_path.iterdir():
-                if temp_file.is_file(): temp_file.unlink()
+            self.clearPages()
 
             # STEP 3: IMPORT CSV AND IMPORT PICTURE(S) INTO SCENE (AND ADD ONE TAB PER PICTURE)
             self.anno_sheetTxt.setText(file_doc)
 
-            try: fitz.open(file_path + '/' + file_doc)
-            except: pdf_file = self.findFile(file_path) # <- opens new window to select PDF if not in folder of CSV file
-            else: pdf_file = fitz.open(file_path + '/' + file_doc)
-
-            for i in range(len(pdf_file)):
-                page = pdf_file.load_page(i)  # load the page
-                image = page.get_images(full=True)  # get images on the page
-
-                xref = image[0][0]
-
-                base_image = pdf_file.extract_image(xref)
-                image_bytes = base_image['image']
-                image_ext = base_image['ext']
-
-                image_name = file_doc + '_page_' + str(i + 1) + '.' + image_ext
-
-                self.page_index[image_name] = i + 1
-
-                with open('temp/' + image_name, 'wb') as image_file:
-                    image_file.write(image_bytes)
-
-            current_page = list(self.page_index.keys())[0]
-            self.scene.addPixmap(QPixmap('temp/' + current_page))
-            self.scene.items()[0].setZValue(1)
-
-            self.anno_pageTxt.setText(str(self.page_index[current_page]))
-
-            # this adds one GraphicsView tab for each page beyond the first
-            self.page_items[1] = []
-            for i in range(len(self.page_index) - 1):
-                new_view = GraphicsView(self.scene)
-                new_view.mouse_pressed_signal.connect(self.mouseTracker)
-                self.view_tabs.addTab(new_view, 'Page ' + str(i + 2))
+            if document is not None: pdf_file = fitz.open(document)
+            else:
+                file_path = path.replace(path.split('/')[-1], '')  # <- folder of the CSV file
+                try: fitz.open(file_path + '/' + file_doc)
+                except: pdf_file = self.findFile(file_path) # <- opens new window to select PDF if not in folder of CSV
+                else: pdf_file = fitz.open(file_path + '/' + file_doc)
 
-                self.page_items[i + 2] = []
+            self.extractPages(pdf_file, file_doc)
+            self.document_path = pdf_file.name
 
         # STEP 4: LOAD IN ANNOTATION WIDGET (if a single image was selected, the code immediately continues here)
         for col in df.columns[6:]:
@@ -549,54 +765,33 @@ class MainWindow(QMainWindow):
             self.dim_counter += 1
 
         # # STEP 5: LOAD IN RECTANGLES AND ANNOTATIONS
-        pen = QPen(Qt.GlobalColor.red)
-        pen.setWidth(1)
-
         for i in df['Index']:
 
-            # 5.1: coordinates + rectangles
+            # 5.1: coordinates
             current_coords = df.loc[df['Index'].isin([i]), 'Coordinates'].tolist()[0][1:-1].split(', ')
-            x, y = float(current_coords[0]), float(current_coords[1])
-            width, height = float(current_coords[2]), float(current_coords[3])
-
-            rect = QGraphicsRectItem(0, 0, width, height)
-            rect.setPos(x, y)
-            rect.setPen(pen)
-
-            self.scene.addItem(rect)
-
-            self.item_dict[rect] = []
-            self.item_coords[rect] = [round(rect.x(), 2),
-                                      round(rect.y(), 2),
-                                      rect.rect().width(),
-                                      rect.rect().height()]
-
-            # 5.2: item index and page
-            self.item_index[rect] = i
+            current_coords = [float(current_coords[0]), float(current_coords[1]),
+                              float(current_coords[2]), float(current_coords[3])]
 
+            # 5.2: page
             current_page = df.loc[df['Index'].isin([i]), 'Page'].tolist()[0]
-            self.page_items[current_page].append(rect)
 
             # 5.3: item color
             current_color = df.loc[df['Index'].isin([i]), 'Color'].tolist()[0]
-            self.item_colors[rect] = current_color
-            if current_color == 'red': rect.setPen(QPen(Qt.GlobalColor.red))
-            elif current_color == 'green': rect.setPen(QPen(Qt.GlobalColor.green))
-            elif current_color == 'blue': rect.setPen(QPen(Qt.GlobalColor.blue))
 
             # 5.4: anchors
             current_anchor = df.loc[df['Index'].isin([i]), 'Anchor'].tolist()[0]
-            if pd.isna(current_anchor): self.item_anchors[rect] = None
+            if pd.isna(current_anchor): current_anchor = None
             else:
                 x, y = current_anchor[1:-1].split(', ')
-                self.item_anchors[rect] = [float(x), float(y)]
+                current_anchor = [float(x), float(y)]
 
             # 5.5: annotations
             vals = df.loc[df['Index'].isin([i]), df.columns[6:]].values.flatten().tolist()
 
             for v in range(len(vals)):
                 if pd.isna(vals[v]): vals[v] = ''
-            self.item_dict[rect] = vals
+
+            self.createItem(current_coords, current_page, i, current_color, current_anchor, vals)
 
             self.item_counter = i
 
@@ -604,13 +799,14 @@ class MainWindow(QMainWindow):
 
         if file_doc.split('.')[-1] == 'pdf': self.changePage()
         else:
-            self.scene.items()[0].setZValue(1)
             for item in self.page_items[1]:
                 item.setZValue(2)
                 item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable, True)
                 item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, True)
             self.toggleItems()
 
+        self.startJournal(path)
+
     # opens a dialog that tells the user to select an image or PDF corresponding to the to be imported CSV file
     def findFile(self, path):
         if path == 'Single Image':
@@ -623,6 +819,7 @@ class MainWindow(QMainWindow):
             layout.addWidget(confirm_button)
             alert.setLayout(layout)
             alert.exec()
+            alert.deleteLater()
         else:
             alert = QDialog(self)
             alert.setWindowTitle('Select PDF File')
@@ -633,6 +830,7 @@ class MainWindow(QMainWindow):
             layout.addWidget(confirm_button)
             alert.setLayout(layout)
             alert.exec()
+            alert.deleteLater()
 
             alt = QFileDialog.getOpenFileName(self, 'Select Corresponding PDF File', path, '(*.pdf)', )
             return fitz.open(alt[0])
@@ -650,44 +848,29 @@ class MainWindow(QMainWindow):
         else: return
 
         for col in df.columns[6:]:
-            new_dim = col
-            self.annotation_layers['Dims'].append(new_dim)
-
-            for key in self.item_dict.keys():
-                self.item_dict[key].append("")
-
-            self.anno_bot_widgetLabs.addWidget(QPushButton(new_dim))
-            self.anno_bot_widgetLabs.itemAt(self.dim_counter - 1).widget().setFixedHeight(30)
-            self.anno_bot_widgetLabs.itemAt(self.dim_counter - 1).widget().pressed.connect(self.editLayer)
-
-            self.anno_bot_widgetTxts.addWidget(QLineEdit(new_dim))
-            self.anno_bot_widgetTxts.itemAt(self.dim_counter - 1).widget().setFixedHeight(30)
-            self.anno_bot_widgetTxts.itemAt(self.dim_counter - 1).widget().setPlaceholderText('NA')
-            self.anno_bot_widgetTxts.itemAt(self.dim_counter - 1).widget().textChanged.connect(self.updateAnnotations)
-
-            self.dim_counter += 1
+            self.addLayer(col)
 
     '''
     ((3.2)) Functions for actions within the scene
     '''
     # loads in a new page if the corresponding tab is selected
+    @instrumented('changePage')
     def changePage(self):
         self.scene.clearSelection()
 
         current_index = self.view_tabs.currentIndex()
 
-        for item in self.scene.items():
-            if item.zValue() == 1:
-                self.scene.removeItem(item)
-            else:
-                item.setZValue(0)
-                item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable, False)
-                item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, False)
+        # items of all other pages are hidden behind the page image and cannot be selected or moved
+        for page, items in self.page_items.items():
+            if page != current_index + 1:
+                for item in items:
+                    item.setZValue(0)
+                    item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable, False)
+                    item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, False)
 
         current_page = list(self.page_index.keys())[current_index]
 
-        self.scene.addPixmap(QPixmap('temp/' + current_page))
-        self.scene.items()[0].setZValue(1)
+        self.showPage('temp/' + current_page)
 
         self.anno_pageTxt.setText(str(self.page_index[current_page]))
 
@@ -696,29 +879,29 @@ class MainWindow(QMainWindow):
             item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable, True)
             item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, True)
 
+        # proposed boxes are only shown on their page
+        for page, proposals in self.proposals.items():
+            for proposal in proposals:
+                proposal.setZValue(2 if page == current_index + 1 else 0)
+
         self.toggleItems()
 
     # this function triggers whenever an item in the scene is selected/deselected and does several things:
     # 1) loads and displays annotations of selected item
     # 2) makes selected item transparent
     # 3) shows anchor of selected item
+    @instrumented('changeKey')
     def changeKey(self):
-        if self.anchorStatus == True:
-            self.scene.removeItem(self.anchor)
-            self.anchorStatus = False
+        # a rubber band selection changes the selection with every mouse move; the panel is only updated at its end
+        if self.view_tabs.currentWidget().selecting: return
+
+        self.hideAnchor()
 
         ## this triggers whenever a rectangle is selected:
         if len(self.scene.selectedItems()) == 1:
 
             if self.current_key != self.scene.selectedItems()[0] and self.current_key != 'Dims':
-                if not self.recolor_action.isChecked():
-                    if self.current_color == 'red': pen = QPen(Qt.GlobalColor.red)
-                    elif self.current_color == 'green': pen = QPen(Qt.GlobalColor.green)
-                    elif self.current_color == 'blue': pen = QPen(Qt.GlobalColor.blue)
-                    self.current_key.setPen(pen)
-                else:
-                    self.current_key.setPen(self.rect_pen)
-                    self.item_colors[self.current_key] = self.rect_col.currentText()
+                self.releaseKey()
 
             self.current_key = self.scene.selectedItems()[0]
             self.current_color = self.item_colors[self.current_key]
@@ -727,12 +910,10 @@ class MainWindow(QMainWindow):
             self.current_key.setPen(pen)
             self.current_key.setPos(self.current_key.pos())
 
-            widgets = self.anno_bot_widgetTxts.count()
-            for i in range(widgets):
-                self.anno_bot_widgetTxts.removeWidget(self.anno_bot_widgetTxts.itemAt(0).widget())
+            self.clearLayout(self.anno_bot_widgetTxts)
 
             for i in range(len(self.item_dict[self.current_key])):
-                self.anno_bot_widgetTxts.addWidget(QLineEdit(str(self.item_dict[self.current_key][i])))
+                self.anno_bot_widgetTxts.addWidget(QLineEdit(str(self.itemValue(self.current_key, i))))
                 self.anno_bot_widgetTxts.itemAt(i).widget().setPlaceholderText('NA')
                 self.anno_bot_widgetTxts.itemAt(i).widget().setFixedHeight(30)
                 self.anno_bot_widgetTxts.itemAt(i).widget().textChanged.connect(self.updateAnnotations)
@@ -742,43 +923,36 @@ class MainWindow(QMainWindow):
             self.anno_anchorTxt.setText(str(self.item_anchors[self.current_key]))
 
             if self.item_anchors[self.current_key] is not None:
-                self.anchor = QGraphicsLineItem(self.item_anchors[self.current_key][0] - 5,
-                                                self.item_anchors[self.current_key][1],
-                                                self.item_anchors[self.current_key][0] + 5,
-                                                self.item_anchors[self.current_key][1])
-
-                pen = QPen(Qt.GlobalColor.green)
-                pen.setWidth(1)
-                pen.setStyle(Qt.PenStyle.DashLine)
-                self.anchor.setPen(pen)
-                self.anchor.setZValue(3)
-
-                self.scene.addItem(self.anchor)
-
-                self.anchorStatus = True
+                self.showAnchor(self.item_anchors[self.current_key][0], self.item_anchors[self.current_key][1])
 
             if self.annotation_mode:
                 layer_index = self.annotation_layers['Dims'].index(self.current_layer)
                 self.anno_bot_widgetTxts.itemAt(layer_index).widget().setText(self.level_text)
-                self.item_dict[self.current_key][layer_index] = self.level_text
+                self.setItemValue(self.current_key, layer_index, self.level_text)
+
+        ## this triggers whenever several rectangles are selected (see ((3.18))):
+        elif len(self.scene.selectedItems()) > 1:
+            if self.current_key != 'Dims':
+                self.releaseKey()
+            self.current_key = 'Dims'
+
+            items = self.selectedItemList()
+            with self.editBatch():
+                if self.recolor_action.isChecked():
+                    self.recolorItems(items, self.rect_col.currentText())
+                if self.annotation_mode:
+                    self.annotateItems(items, self.annotation_layers['Dims'].index(self.current_layer),
+                                       self.level_text)
+            self.showSelection(items)
 
         ## this triggers whenever a rectangle is de-selected (i.e. nothing is selected):
         else:
             if self.current_key != 'Dims':
-                if not self.recolor_action.isChecked():
-                    if self.current_color == 'red': pen = QPen(Qt.GlobalColor.red)
-                    elif self.current_color == 'green': pen = QPen(Qt.GlobalColor.green)
-                    elif self.current_color == 'blue': pen = QPen(Qt.GlobalColor.blue)
-                    self.current_key.setPen(pen)
-                else:
-                    self.current_key.setPen(self.rect_pen)
-                    self.item_colors[self.current_key] = self.rect_col.currentText()
+                self.releaseKey()
 
             self.current_key = 'Dims'
 
-            widgets = self.anno_bot_widgetTxts.count()
-            for i in range(widgets):
-                self.anno_bot_widgetTxts.removeWidget(self.anno_bot_widgetTxts.itemAt(0).widget())
+            self.clearLayout(self.anno_bot_widgetTxts)
 
             for i in range(len(self.annotation_layers[self.current_key])):
                 self.anno_bot_widgetTxts.addWidget(QLineEdit(self.annotation_layers[self.current_key][i]))
@@ -788,6 +962,18 @@ class MainWindow(QMainWindow):
             self.anno_coordTxt.setText('No item selected')
             self.anno_anchorTxt.setText('No item selected')
 
+    # gives the previously selected item its pen back (or the current color in recolor mode)
+    def releaseKey(self):
+        if not self.recolor_action.isChecked():
+            if self.current_color == 'red': pen = QPen(Qt.GlobalColor.red)
+            elif self.current_color == 'green': pen = QPen(Qt.GlobalColor.green)
+            elif self.current_color == 'blue': pen = QPen(Qt.GlobalColor.blue)
+            self.current_key.setPen(pen)
+        else:
+            self.current_key.setPen(self.rect_pen)
+            self.item_colors[self.current_key] = self.rect_col.currentText()
+            self.journalEdit('color', self.current_key, color=self.item_colors[self.current_key])
+
     '''
     ((3.3)) Functions that handle items in the scene
     '''
@@ -798,6 +984,7 @@ class MainWindow(QMainWindow):
         elif pen == 2: self.rect_pen = QPen(Qt.GlobalColor.blue)
 
     # add item to scene and create corresponding entry in dictionary
+    @instrumented('addItem')
     def addItem(self):
         rect = QGraphicsRectItem(0, 0, int(self.rect_x.text()), int(self.rect_y.text()))
 
@@ -816,9 +1003,7 @@ class MainWindow(QMainWindow):
             self.scene.addItem(rect)
 
             # add new rectangle to dictionary
-            self.item_dict[rect] = []
-            for i in range(self.dim_counter - 1):
-                self.item_dict[rect].append('')
+            self.item_dict[rect] = self.blankValues()
 
             # add coordinates/size of new rectangle to corresponding dictionary
             self.item_coords[rect] = [round(rect.x(), 2), round(rect.y(), 2), rect.rect().width(), rect.rect().height()]
@@ -830,24 +1015,61 @@ class MainWindow(QMainWindow):
             # add rectangle to page dictionary
             self.page_items[self.view_tabs.currentIndex() + 1].append(rect)
 
+            self.journalEdit('add', rect, page=self.view_tabs.currentIndex() + 1, coords=self.item_coords[rect],
+                             color=self.item_colors[rect])
+
             # the part below ensures that the newly added rectangle gets selected right away (while other are not selected)
             # the keyPressEvent function below allows for immediate adjustments to newly added rectangle via arrow keys
             for item in self.scene.items():
                 item.setSelected(False)
             rect.setSelected(True)
 
-    # change size of rectangle
+    # returns the pen for one of the item colors ('red', 'green' or 'blue'), or for proposed boxes ('proposed')
+    def colorPen(self, color):
+        if color == 'green': return QPen(Qt.GlobalColor.green)
+        elif color == 'blue': return QPen(Qt.GlobalColor.blue)
+        elif color == 'proposed':
+            pen = QPen(Qt.GlobalColor.magenta)
+            pen.setStyle(Qt.PenStyle.DashLine)
+            return pen
+        return QPen(Qt.GlobalColor.red)
+
+    # creates an item from stored data (CSV import, journal replay) and adds it to the scene and all dictionaries
+    def createItem(self, coords, page, index, color, anchor, values):
+        rect = QGraphicsRectItem(0, 0, coords[2], coords[3])
+        rect.setPos(coords[0], coords[1])
+        rect.setPen(self.colorPen(color))
+
+        self.scene.addItem(rect)
+
+        self.item_dict[rect] = values
+        self.item_coords[rect] = [round(rect.x(), 2),
+                                  round(rect.y(), 2),
+                                  rect.rect().width(),
+                                  rect.rect().height()]
+        self.item_index[rect] = index
+        self.item_colors[rect] = color
+        self.item_anchors[rect] = anchor
+
+        self.page_items[page].append(rect)
+        return rect
+
+    # stores the current position and size of item (called whenever an item was moved or resized)
+    def updateCoords(self, item):
+        coords = [round(item.x(), 2), round(item.y(), 2), item.rect().width(), item.rect().height()]
+        if self.item_coords.get(item) != coords:
+            self.item_coords[item] = coords
+            if item in self.item_index: self.journalEdit('coords', item, coords=coords)
+        if self.current_key != 'Dims': self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+
+    # change size of the selected rectangles
     def adjustItem(self):
-        item = self.scene.selectedItems()
-        if len(item) > 0:
-            item[0].setRect(0, 0, int(self.rect_x.text()), int(self.rect_y.text()))
+        with self.editBatch():
+            for item in self.selectedItemList():
+                item.setRect(0, 0, int(self.rect_x.text()), int(self.rect_y.text()))
 
-            # update coordinates dictionary:
-            self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                         round(item[0].y(), 2),
-                                         item[0].rect().width(),
-                                         item[0].rect().height()]
-            self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                # update coordinates dictionary:
+                self.updateCoords(item)
 
     # this function is for resizing items with the mouse
     def resizeItem(self, x, y):
@@ -864,34 +1086,69 @@ class MainWindow(QMainWindow):
                 item[0].setRect(0, 0, int(new_width), int(new_height))
 
             # update coordinates dictionary:
-            self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                         round(item[0].y(), 2),
-                                         item[0].rect().width(),
-                                         item[0].rect().height()]
-            self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+            self.updateCoords(item[0])
 
     # delete currently selected item (and update dictionaries accordingly)
+    @instrumented('deleteItem')
     def deleteItem(self):
-        if self.current_key != 'Dims':
+        items = self.selectedItemList()
+        if len(items) > 1:
+            self.scene.clearSelection()
+            with self.editBatch():
+                self.discardItems(items)
+            self.status_bar.showMessage('%d items deleted' % len(items), 5000)
 
-            self.item_dict.pop(self.current_key)
-            self.item_coords.pop(self.current_key)
-            self.item_anchors.pop(self.current_key)
+        elif self.current_key != 'Dims':
+            self.discardItem(self.current_key)
+            self.scene.clearSelection()
 
-            current_index = self.item_index[self.current_key]
+    # removes item from the scene and all dictionaries; the indices of all following items are lowered by one
+    def discardItem(self, item):
+        self.journalEdit('delete', item)
 
-            self.item_index.pop(self.current_key)
-            self.item_counter -= 1
+        self.item_dict.pop(item)
+        self.item_coords.pop(item)
+        self.item_colors.pop(item)
+        self.item_anchors.pop(item)
 
-            for key in self.item_index.keys():
-                if self.item_index[key] > current_index:
-                    self.item_index[key] -= 1
+        current_index = self.item_index[item]
 
-            self.page_items[self.view_tabs.currentIndex() + 1].remove(self.current_key)
+        self.item_index.pop(item)
+        self.item_counter -= 1
 
-            self.scene.removeItem(self.current_key)
+        for key in self.item_index.keys():
+            if self.item_index[key] > current_index:
+                self.item_index[key] -= 1
 
-            self.scene.clearSelection()
+        for items in self.page_items.values():
+            if item in items:
+                items.remove(item)
+                break
+
+        self.scene.removeItem(item)
+
+    # removes several items at once; the remaining items are renumbered in one pass (instead of once per item)
+    def discardItems(self, items):
+        # the highest index is journaled first, so that the journaled indices of the other items stay valid
+        items = sorted(set(items), key=lambda item: -self.item_index[item])
+        for item in items:
+            self.journalEdit('delete', item)
+
+        for item in items:
+            self.item_dict.pop(item)
+            self.item_coords.pop(item)
+            self.item_colors.pop(item)
+            self.item_anchors.pop(item)
+            self.item_index.pop(item)
+            self.scene.removeItem(item)
+
+        removed = set(items)
+        for page in self.page_items.keys():
+            self.page_items[page] = [item for item in self.page_items[page] if item not in removed]
+
+        for new_index, item in enumerate(sorted(self.item_index, key=self.item_index.get), start=1):
+            self.item_index[item] = new_index
+        self.item_counter = len(self.item_index) + 1
 
     # changes movable status of items in the scene
     def toggleItems(self):
@@ -902,31 +1159,21 @@ class MainWindow(QMainWindow):
             for key in self.item_index.keys():
                 key.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, True)
 
-    # this functions marks the line on which the annotated letter is written
+    # this functions marks the line on which the annotated letter is written (for all selected items)
     def setAnchor(self):
-        item = self.scene.selectedItems()
-
-        if self.anchorStatus == True:
-            self.scene.removeItem(self.anchor)
-            self.anchorStatus = False
-
-        x = self.item_coords[item[0]][0] + self.item_coords[item[0]][2] / 2
-        y = self.item_coords[item[0]][1] + self.item_coords[item[0]][3]
-
-        self.anchor = QGraphicsLineItem(x - 5, y, x + 5, y)
+        items = self.selectedItemList()
 
-        self.item_anchors[item[0]] = [round(x, 2), round(y, 2)]
-        self.anno_anchorTxt.setText(str(self.item_anchors[item[0]]))
+        with self.editBatch():
+            for item in items:
+                x = self.item_coords[item][0] + self.item_coords[item][2] / 2
+                y = self.item_coords[item][1] + self.item_coords[item][3]
 
-        pen = QPen(Qt.GlobalColor.green)
-        pen.setWidth(1)
-        pen.setStyle(Qt.PenStyle.DashLine)
-        self.anchor.setPen(pen)
-        self.anchor.setZValue(3)
+                self.item_anchors[item] = [round(x, 2), round(y, 2)]
+                self.journalEdit('anchor', item, anchor=self.item_anchors[item])
 
-        self.scene.addItem(self.anchor)
-
-        self.anchorStatus = True
+        if len(items) == 1:
+            self.anno_anchorTxt.setText(str(self.item_anchors[items[0]]))
+            self.showAnchor(x, y)
 
     '''
     ((3.4)) Annotation functions
@@ -959,36 +1206,45 @@ class MainWindow(QMainWindow):
 
             index_dialog.setLayout(layout)
             index_dialog.exec()
+            index_dialog.deleteLater()
         else:
             print('No Item selected')
 
     # this adjusts all indices depending on the new index of the currently selected item
     def indexLoop(self):
-        current_index = self.item_index[self.current_key]
-
-        if current_index == self.new_index.value():
+        if self.item_index[self.current_key] == self.new_index.value():
             self.status_bar.showMessage('Nothing changed', 3000)
+        else:
+            self.moveIndex(self.current_key, self.new_index.value())
+
+        self.anno_indexTxt.setText(str(self.item_index[self.current_key]))
+
+    # gives item the index new_index and shifts the indices of all items in between by one
+    def moveIndex(self, item, new_index):
+        current_index = self.item_index[item]
+        self.journalEdit('reindex', item, new=new_index)
 
-        elif current_index > self.new_index.value():
+        if current_index > new_index:
             for key in self.item_index.keys():
-                if self.item_index[key] >= self.new_index.value() and self.item_index[key] < current_index:
+                if self.item_index[key] >= new_index and self.item_index[key] < current_index:
                     self.item_index[key] = self.item_index[key] + 1
 
-            self.item_index[self.current_key] = self.new_index.value()
+            self.item_index[item] = new_index
 
-        elif current_index < self.new_index.value():
+        elif current_index < new_index:
             for key in self.item_index.keys():
-                if self.item_index[key] <= self.new_index.value() and self.item_index[key] > current_index:
+                if self.item_index[key] <= new_index and self.item_index[key] > current_index:
                     self.item_index[key] = self.item_index[key] - 1
 
-            self.item_index[self.current_key] = self.new_index.value()
-
-        self.anno_indexTxt.setText(str(self.item_index[self.current_key]))
+            self.item_index[item] = new_index
 
     # add annotation layers
     def addAnnotationLayer(self):
         self.scene.clearSelection()
-        new_dim = self.anno_new_layer_title.text()
+        self.addLayer(self.anno_new_layer_title.text())
+
+    def addLayer(self, new_dim):
+        self.journalEdit('layer', name=new_dim)
 
         # add new layer to list of all annotation layers;
         # this is important as newly added rectangles are assigned with all previously added layers via this list
@@ -1036,14 +1292,16 @@ class MainWindow(QMainWindow):
 
         dialog.setLayout(layout)
         dialog.exec()
+        dialog.deleteLater()
 
     def setCategoricalLayer(self):
+        levels = [level.strip() for level in self.factor_levels.text().split(',') if level.strip() != '']
+        if not self.encodeLayer(self.current_layer, list(dict.fromkeys(levels))): return
+
         widgets = self.anno_bot_widgetLabs.count()
         for i in range(widgets):
             if self.anno_bot_widgetLabs.itemAt(i).widget().text() == self.current_layer:
 
-                self.layer_levels[self.current_layer] = self.factor_levels.text().split(',')
-
                 self.anno_bot_widgetLabs.itemAt(i).widget().pressed.disconnect(self.editLayer)
                 self.anno_bot_widgetLabs.itemAt(i).widget().pressed.connect(self.annotationModeToggle)
 
@@ -1097,9 +1355,16 @@ class MainWindow(QMainWindow):
         if len(item) == 1:
             layer_index = self.annotation_layers['Dims'].index(self.current_layer)
             self.anno_bot_widgetTxts.itemAt(layer_index).widget().setText(self.level_text)
-            self.item_dict[self.current_key][layer_index] = self.level_text
+            self.setItemValue(self.current_key, layer_index, self.level_text)
+
+        elif len(item) > 1:
+            items = self.selectedItemList()
+            with self.editBatch():
+                self.annotateItems(items, self.annotation_layers['Dims'].index(self.current_layer), self.level_text)
+            self.showSelection(items)
 
     # this function keeps the dictionary with the item specific annotations updated
+    @instrumented('updateAnnotations')
     def updateAnnotations(self):
         ## If a rectangle is in selection, edit annotations for that rectangle:
         if len(self.scene.selectedItems()) == 1:
@@ -1107,7 +1372,9 @@ class MainWindow(QMainWindow):
             for i in range(len(self.item_dict[self.current_key])):
                 if self.anno_bot_widgetTxts.itemAt(i).widget().hasFocus():
                     break
-            self.item_dict[self.current_key][i] = self.anno_bot_widgetTxts.itemAt(i).widget().text()
+            line = self.anno_bot_widgetTxts.itemAt(i).widget()
+            if self.setItemValue(self.current_key, i, line.text()): line.setStyleSheet('')
+            else: line.setStyleSheet('border: 1px solid red')  # <- not a level of the categorical layer
 
         ## If no rectangle is in selection, don't change anything:
         else:
@@ -1123,7 +1390,7 @@ class MainWindow(QMainWindow):
 
             for i in range(len(self.item_dict[self.current_key])):
                 if self.anno_bot_widgetTxts.itemAt(i).widget().hasFocus():
-                    prev_annotation = self.item_dict[prev_item][i]
+                    prev_annotation = self.itemValue(prev_item, i)
                     self.anno_bot_widgetTxts.itemAt(i).widget().setText(str(prev_annotation))
                     break
 
@@ -1140,14 +1407,39 @@ class MainWindow(QMainWindow):
         self.annotation_layers['Dims'] = []
         self.dim_counter = 1
 
+        self.layer_levels = dict()
+        self.level_codes = dict()
+
         self.current_key = 'Dims'
 
+    # call this function whenever the pages of the current document must be cleared
+    def clearPages(self):
+        self.stopJobs()  # <- render jobs read the page images in the temp folder
+
+        # remove all view tabs but the first one:
+        for i in reversed(range(self.view_tabs.count())):
+            if i == 0: break
+            else:
+                view = self.view_tabs.widget(i)
+                self.view_tabs.removeTab(i)
+                view.deleteLater()
+
+        self.page_index = dict()
+        self.page_items = dict()
+        self.page_lines = dict()
+        self.glyphs = dict()
+        self.glyph_matrix = None
+        self.filter_job = None  # <- it was cancelled above; the filters of the next document are computed anew
+
+        # clear temp folder to avoid conflicts (this also clears the cached display filters)
+        temp_path = Path('./temp')
+        for temp_file in temp_path.iterdir():
+            if temp_file.is_file(): temp_file.unlink()
+
     # call this function whenever the annotations tabs need to be cleared
     def clearAnnotationTab(self):
-        widgets = self.anno_bot_widgetLabs.count()
-        for i in range(widgets):
-            self.anno_bot_widgetLabs.removeWidget(self.anno_bot_widgetLabs.itemAt(0).widget())
-            self.anno_bot_widgetTxts.removeWidget(self.anno_bot_widgetTxts.itemAt(0).widget())
+        self.clearLayout(self.anno_bot_widgetLabs)
+        self.clearLayout(self.anno_bot_widgetTxts)
 
     '''
     ((3.5)) Export functions (annotations to CSV and rendering screenshots)
@@ -1162,6 +1454,8 @@ class MainWindow(QMainWindow):
         sign = QLineEdit()
         sign.setPlaceholderText('Your sign here')
         layout.addWidget(sign)
+        per_page = QCheckBox('One file per page')
+        layout.addWidget(per_page)
         confirm_button = QPushButton('Confirm')
         confirm_button.pressed.connect(dialog.accept)
         layout.addWidget(confirm_button)
@@ -1169,13 +1463,112 @@ class MainWindow(QMainWindow):
         dialog.setLayout(layout)
         dialog.exec()
 
+        self.writeAnnotations(sign.text(), per_page.isChecked())
+        dialog.deleteLater()
+
+    # this does the actual work of exportAnnotations; it is also used to export without a dialog (e.g. benchmarks);
+    # the CSV file is written in the background (see ((3.11))), the returned job can be waited for; with per_page,
+    # every page gets its own file (<document>_<sign>_page<page>.csv)
+    @instrumented('exportAnnotations')
+    def writeAnnotations(self, sign, per_page=False):
         file_name = self.anno_sheetTxt.text()[0:-4]
 
+        header, rows, levels = self.exportSnapshot()
+
+        if not os.path.exists('Annotated/' + file_name):
+            os.makedirs('Annotated/' + file_name)
+
+        export_path = 'Annotated/' + file_name + '/' + file_name + '_' + sign + '.csv'
+
+        if per_page:
+            page_path = export_path.replace('%', '%%')[0:-4] + '_page%d.csv'
+            return self.startJob(ExportJob(header, rows, levels, self.anno_sheetTxt.text(), page_path,
+                                           sorted(self.page_index.values())), 'Exporting annotations ...')
+
+        # all edits so far are in the exported snapshot, so the journal starts over with the exported file as its
+        # base; if the export does not finish, the journal is compacted instead (see restoreJournal)
+        if self.project is None: self.startJournal(export_path)
+
+        return self.startJob(ExportJob(header, rows, levels, self.anno_sheetTxt.text(), export_path),
+                             'Exporting annotations ...', self.restoreJournal)
+
+    # returns a snapshot of all items for the streaming CSV export (see jobs.py): the header, one tuple (index, page,
+    # coordinates, color, anchor, values) per item in index order and the levels of every layer (None if it is not
+    # categorical)
+    def exportSnapshot(self):
+        layers = self.annotation_layers['Dims']
+        rows = []
+        for page, items in self.page_items.items():
+            for item in items:
+                rows.append((self.item_index[item], page, self.item_coords[item], self.item_colors[item],
+                             self.item_anchors[item], tuple(self.item_dict[item])))
+        rows.sort(key=lambda row: row[0])
+        levels = [self.layer_levels.get(layer) for layer in layers]
+        return ['Index', 'Page', 'Coordinates', 'Color', 'Anchor', 'Source'] + layers, rows, levels
+
+    # writes the current state to a CSV file (on the GUI thread, e.g. the journal snapshots)
+    def writeSnapshot(self, path):
+        header, rows, levels = self.exportSnapshot()
+        writeCsv(path, header, rows, levels, self.anno_sheetTxt.text())
+
+    # dialog for exporting the boxes as a detection dataset (see detection_export.py)
+    def exportDetection(self):
+        if len(self.page_index) == 0 or len(self.annotation_layers['Dims']) == 0:
+            self.status_bar.showMessage('A detection dataset needs a document with an annotation layer', 5000)
+            return
+
+        dialog = QDialog(self)
+        dialog.setWindowTitle('Export Detection Dataset')
+
+        layout = QGridLayout()
+        file_format = QComboBox()
+        file_format.addItems(['COCO', 'YOLO', 'Pascal VOC'])
+        layer = QComboBox()
+        layer.addItems(self.annotation_layers['Dims'])
+        images = QComboBox()
+        images.addItems(['Page images', 'Crops', 'No images'])
+        layout.addWidget(QLabel('Format'), 0, 0)
+        layout.addWidget(file_format, 0, 1)
+        layout.addWidget(QLabel('Categories from layer'), 1, 0)
+        layout.addWidget(layer, 1, 1)
+        layout.addWidget(QLabel('Images'), 2, 0)
+        layout.addWidget(images, 2, 1)
+
+        confirm_button = QPushButton('Confirm')
+        confirm_button.pressed.connect(dialog.accept)
+        cancel_button = QPushButton('Cancel')
+        cancel_button.pressed.connect(dialog.reject)
+        layout.addWidget(confirm_button, 3, 0)
+        layout.addWidget(cancel_button, 3, 1)
+
+        dialog.setLayout(layout)
+        accepted = dialog.exec()
+        dialog.deleteLater()
+        if not accepted: return
+        self.writeDetection(['coco', 'yolo', 'voc'][file_format.currentIndex()], layer.currentText(),
+                            ['pages', 'crops', None][images.currentIndex()])
+
+    # writes the dataset to Annotated/<document>/<format> in the background; the returned job can be waited for
+    @instrumented('exportDetection')
+    def writeDetection(self, file_format, layer, images):
+        file_name = self.anno_sheetTxt.text()[0:-4]
+        header, rows, levels = self.exportSnapshot()
+        pages = {page: self.pageImage(page) for page in self.page_index.values()}
+        job = DetectionJob(rows, levels, self.annotation_layers['Dims'].index(layer), pages, file_name,
+                           'Annotated/' + file_name + '/' + file_format, file_format, images)
+        return self.startJob(job, 'Exporting detection dataset ...')
+
+    # returns all items and their annotations as a data frame (one row per item, in the export format)
+    def annotationFrame(self):
         # create data frame from dictionary containing all annotations
         df = pd.DataFrame.from_dict(self.item_dict,
                                     orient='index',
                                     columns=self.annotation_layers['Dims'])
 
+        # categorical layers are exported as pandas categoricals (codes and levels); empty values (code -1) become NaN
+        for layer, levels in self.layer_levels.items():
+            df[layer] = pd.Categorical.from_codes(np.asarray(df[layer], dtype=np.int64), categories=levels)
+
         custom_columns = df.columns.tolist()
 
         # this adds the coordinates and size of the rectangles to the data frame
@@ -1199,13 +1592,7 @@ class MainWindow(QMainWindow):
 
         # reorder columns:
         order = ['Index','Page','Coordinates','Color','Anchor','Source'] + custom_columns
-        final_df = df[order]
-
-        if not os.path.exists('Annotated/' + file_name):
-            os.makedirs('Annotated/' + file_name)
-
-        final_df.to_csv('Annotated/' + file_name + '/' + file_name + '_' + sign.text() + '.csv',
-                        index=False)
+        return df[order]
 
     # screenshotting function dialog
     def takeScreenshots(self):
@@ -1219,144 +1606,94 @@ class MainWindow(QMainWindow):
         document_button = QPushButton('For whole document')
         cancel_button = QPushButton('Cancel')
 
+        # the screenshots can be cut out of the filtered pages once all of them are cached (see ((3.21)))
+        filtered_box = QCheckBox('From filtered pages')
+        filtered_box.setEnabled(self.page_filter is not None and self.filter_job is None)
+
         layout.addWidget(current_button,    1, 0)
         layout.addWidget(document_button,   1, 1)
         layout.addWidget(cancel_button,     1, 2)
+        layout.addWidget(filtered_box,      2, 0, 1, 3)
 
         current_button.pressed.connect(dialog.accept)
-        current_button.pressed.connect(self.screenshotPage)
+        current_button.pressed.connect(lambda: self.screenshotPage(filtered_box.isChecked()))
 
         document_button.pressed.connect(dialog.accept)
-        document_button.pressed.connect(self.screenshotDocument)
+        document_button.pressed.connect(lambda: self.screenshotDocument(filtered_box.isChecked()))
 
         cancel_button.pressed.connect(dialog.accept)
 
         dialog.setLayout(layout)
         dialog.exec()
+        dialog.deleteLater()
 
     # make screenshots of items in current page only
-    def screenshotPage(self):
-        self.scene.clearSelection()
-
-        file_name = self.anno_sheetTxt.text()[0:-4]
-
-        if not os.path.exists('Annotated/' + file_name + '/Screenshots/'):
-            os.makedirs('Annotated/' + file_name + '/Screenshots/')
-
-        current_page = self.view_tabs.currentIndex() + 1
-        pen = QPen(Qt.GlobalColor.transparent)
-        pen.setWidth(1)
-
-        for key in self.item_dict.keys():
-            key.setPen(pen)
-
-        for key in self.item_dict.keys():
-            if key in self.page_items[current_page]:
-                current_index = self.item_index[key]
-                x, y = key.x(), key.y()
-                width, height = key.rect().width(), key.rect().height()
-
-                rect_source = QRectF(x, y, width, height)
-                rect_target = QRectF(0, 0, width, height)
-
-                pixmap = QPixmap(int(width), int(height))
-
-                painter = QPainter(pixmap)
-
-                self.scene.render(painter,
-                                  target=rect_target,
-                                  source=rect_source)
-
-                painter.end()
-
-                pixmap.save('Annotated/' + file_name + '/Screenshots/' +
-                            file_name + '_' + str(current_index) + '.png')
-
-        pen.setColor(Qt.GlobalColor.red)
-        for key in self.item_dict.keys():
-            key.setPen(pen)
+    @instrumented('screenshotPage')
+    def screenshotPage(self, filtered=False):
+        return self.renderPages([self.view_tabs.currentIndex() + 1], filtered)
 
     # make screenshots of all items (page by page)
-    def screenshotDocument(self):
-        self.scene.clearSelection()
+    @instrumented('screenshotDocument')
+    def screenshotDocument(self, filtered=False):
+        return self.renderPages(list(self.page_index.values()), filtered)
 
+    # the screenshots are cut out of the page images in the background (see ((3.11))), so the scene is not changed;
+    # with filtered, they are cut out of the pages as they are shown (with the current display filter)
+    def renderPages(self, pages, filtered=False):
         file_name = self.anno_sheetTxt.text()[0:-4]
 
-        if not os.path.exists('Annotated/' + file_name + '/Screenshots/'):
-            os.makedirs('Annotated/' + file_name + '/Screenshots/')
-
-        # make rectangles invisible
-        pen = QPen(Qt.GlobalColor.transparent)
-        pen.setWidth(1)
-        for key in self.item_dict.keys():
-            key.setPen(pen)
-
-        # go through all pages starting with the first
-        for page, val in self.page_index.items():
-            self.view_tabs.setCurrentIndex(val)
-
-            for item in self.scene.items():
-                if item.zValue() == 1:
-                    self.scene.removeItem(item)
-                else:
-                    item.setZValue(0)
-                    item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable, False)
-                    item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, False)
-
-            self.scene.addPixmap(QPixmap('temp/' + page))
-            self.scene.items()[0].setZValue(1)
+        crops = []
+        for page in pages:
+            image_path = self.pageImage(page)
+            if filtered: image_path = self.displayImage(image_path)
+            for key in self.page_items[page]:
+                crops.append((image_path, self.item_index[key], key.x(), key.y(),
+                              key.rect().width(), key.rect().height()))
 
-            for item in self.page_items[val]:
-                item.setZValue(2)
-                item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable, True)
-                item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, True)
+        return self.startJob(RenderJob(crops, 'Annotated/' + file_name + '/Screenshots/', file_name),
+                             'Rendering screenshots ...')
 
-            # make screenshots of items in current page
-            for key in self.item_dict.keys():
-                if key in self.page_items[val]:
-                    current_index = self.item_index[key]
-                    x, y = key.x(), key.y()
-                    width, height = key.rect().width(), key.rect().height()
-
-                    rect_source = QRectF(x, y, width, height)
-                    rect_target = QRectF(0, 0, width, height)
+    # path of the image of page (PDF pages are extracted to the temp folder)
+    def pageImage(self, page):
+        image_name = list(self.page_index.keys())[page - 1]
+        if os.path.exists('temp/' + image_name): return 'temp/' + image_name
+        return image_name
 
-                    pixmap = QPixmap(int(width), int(height))
+    '''
+    ((3.6)) MISC
+    '''
+    # switch to the item with the next index; if at last index, switch to item with index 1
+    def selectNextItem(self):
+        current_index = self.item_index[self.current_key]
+        current_page = self.view_tabs.currentIndex()
 
-                    painter = QPainter(pixmap)
-                    self.scene.render(painter,
-                                      target=rect_target,
-                                      source=rect_source)
-                    painter.end()
+        if current_index + 1 not in self.item_index.values():
+            current_index = 0
 
-                    pixmap.save('Annotated/' + file_name + '/Screenshots/' +
-                                file_name + '_' + str(current_index) + '.png')
+        next_item = [key for key, val in self.item_index.items() if val == current_index + 1]
+        self.scene.clearSelection()
+        next_item[0].setSelected(True)
+        self.view_tabs.widget(current_page).centerOn(next_item[0].pos())
 
-        # make rectangles visible again
-        pen.setColor(Qt.GlobalColor.red)
-        for key in self.item_dict.keys():
-            key.setPen(pen)
+        # the lines below make it so that after switching items, the first annotation layer is selected
+        if self.anno_bot_widgetTxts.count() > 0:
+            self.anno_bot_widgetTxts.itemAt(0).widget().setFocus()
+            self.anno_bot_widgetTxts.itemAt(0).widget().selectAll()
 
-    '''
-    ((3.6)) MISC
-    '''
     def contextMenuEvent(self, event):
         self.context_menu.exec(event.globalPos())
 
     # this function tracks the cursor position
+    @instrumented('mouseTracker')
     def mouseTracker(self, pos):
         current_index = self.view_tabs.currentIndex()
         self.last_pos = self.view_tabs.widget(current_index).mapToGlobal(pos)
         self.scene_pos = self.view_tabs.widget(current_index).mapToScene(pos)
 
-        # the code below updates item coordinates if an item is selected
+        # the code below updates item coordinates if an item is selected (several items: see mouseReleased)
         item = self.scene.selectedItems()
-        if len(item) > 0:
-            self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                         round(item[0].y(), 2),
-                                         item[0].rect().width(),
-                                         item[0].rect().height()]
-            self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+        if len(item) == 1:
+            self.updateCoords(item[0])
 
     # Various key bound actions
     def keyPressEvent(self, event):
@@ -1370,67 +1707,29 @@ class MainWindow(QMainWindow):
             if event.key() == Qt.Key.Key_F1:
                 self.setLevel()
 
-        # Below are KeyPressEvents that modify a selected rectangle
-        item = self.scene.selectedItems()
-        if len(item) == 1:
+        # Below are KeyPressEvents that modify the selected rectangles
+        item = self.selectedItemList()
+        if len(item) > 0:
 
             # Control modifier allows for 1 pixel size adjustments to selected rectangle:
             if event.modifiers() == Qt.KeyboardModifier.ControlModifier:
                 if event.key() == Qt.Key.Key_Left or event.key() == Qt.Key.Key_A:
-                    item[0].setRect(0, 0, int(item[0].rect().width()) - 1, int(item[0].rect().height()))
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                    self.growItems(item, -1, 0)
 
                 elif event.key() == Qt.Key.Key_Right or event.key() == Qt.Key.Key_D:
-                    item[0].setRect(0, 0, int(item[0].rect().width()) + 1, int(item[0].rect().height()))
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                    self.growItems(item, 1, 0)
 
                 elif event.key() == Qt.Key.Key_Up or event.key() == Qt.Key.Key_W:
-                    item[0].setRect(0, 0, int(item[0].rect().width()), int(item[0].rect().height()) - 1)
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                    self.growItems(item, 0, -1)
 
                 elif event.key() == Qt.Key.Key_Down or event.key() == Qt.Key.Key_S:
-                    item[0].setRect(0, 0, int(item[0].rect().width()), int(item[0].rect().height()) + 1)
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
-
-                elif event.key() == Qt.Key.Key_Return:
-                    # switch to next item; if at last index, switch to item with index 1
-                    current_index = self.item_index[self.current_key]
-                    current_page = self.view_tabs.currentIndex()
+                    self.growItems(item, 0, 1)
 
-                    if current_index + 1 not in self.item_index.values():
-                        current_index = 0
-
-                    next_item = [key for key, val in self.item_index.items() if val == current_index + 1]
-                    self.scene.clearSelection()
-                    next_item[0].setSelected(True)
-                    self.view_tabs.widget(current_page).centerOn(next_item[0].pos())
-
-                    # the lines below make it so that after switching items, the first annotation layer is selected
-                    if self.anno_bot_widgetTxts.count() > 0:
-                        self.anno_bot_widgetTxts.itemAt(0).widget().setFocus()
-                        self.anno_bot_widgetTxts.itemAt(0).widget().selectAll()
+                elif event.key() == Qt.Key.Key_Return and len(item) == 1:
+                    # switch to next item; if at last index, switch to item with index 1
+                    self.selectNextItem()
 
-                elif event.key() == Qt.Key.Key_I:
+                elif event.key() == Qt.Key.Key_I and len(item) == 1:
                     # inherit current annotation of previous item (by index)
                     self.inheritAnnotation()
 
@@ -1441,40 +1740,16 @@ class MainWindow(QMainWindow):
             # Shift modifier allows for 5 pixel size adjustments to selected rectangle:
             elif event.modifiers() == Qt.KeyboardModifier.ShiftModifier:
                 if event.key() == Qt.Key.Key_Left or event.key() == Qt.Key.Key_A:
-                    item[0].setRect(0, 0, int(item[0].rect().width()) - 5, int(item[0].rect().height()))
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                    self.growItems(item, -5, 0)
 
                 elif event.key() == Qt.Key.Key_Right or event.key() == Qt.Key.Key_D:
-                    item[0].setRect(0, 0, int(item[0].rect().width()) + 5, int(item[0].rect().height()))
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                    self.growItems(item, 5, 0)
 
                 elif event.key() == Qt.Key.Key_Up or event.key() == Qt.Key.Key_W:
-                    item[0].setRect(0, 0, int(item[0].rect().width()), int(item[0].rect().height()) - 5)
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                    self.growItems(item, 0, -5)
 
                 elif event.key() == Qt.Key.Key_Down or event.key() == Qt.Key.Key_S:
-                    item[0].setRect(0, 0, int(item[0].rect().width()), int(item[0].rect().height()) + 5)
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                    self.growItems(item, 0, 5)
 
                 elif event.key() == Qt.Key.Key_Space:
                     # press Space to set anchor
@@ -1483,40 +1758,16 @@ class MainWindow(QMainWindow):
             # Without any modifier, the position of the rectangle can be adjusted in 1 pixel increments
             else:
                 if event.key() == Qt.Key.Key_Left or event.key() == Qt.Key.Key_A:
-                    item[0].setPos(item[0].x() - 1, item[0].y())
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                    self.moveItems(item, -1, 0)
 
                 elif event.key() == Qt.Key.Key_Right or event.key() == Qt.Key.Key_D:
-                    item[0].setPos(item[0].x() + 1, item[0].y())
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                    self.moveItems(item, 1, 0)
 
                 elif event.key() == Qt.Key.Key_Up or event.key() == Qt.Key.Key_W:
-                    item[0].setPos(item[0].x(), item[0].y() - 1)
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                    self.moveItems(item, 0, -1)
 
                 elif event.key() == Qt.Key.Key_Down or event.key() == Qt.Key.Key_S:
-                    item[0].setPos(item[0].x(), item[0].y() + 1)
-                    # update coordinates dictionary
-                    self.item_coords[item[0]] = [round(item[0].x(), 2),
-                                                 round(item[0].y(), 2),
-                                                 item[0].rect().width(),
-                                                 item[0].rect().height()]
-                    self.anno_coordTxt.setText(str(self.item_coords[self.current_key]))
+                    self.moveItems(item, 0, 1)
 
                 elif event.key() == Qt.Key.Key_Space:
                     # press Space to set anchor
@@ -1526,12 +1777,13 @@ class MainWindow(QMainWindow):
         # (1) it toggles all items movable on pressing alt / immovable on releasing alt
         # (2) if an item is selected, it places another rectangle on top, which can be dragged around to adjust the size
         # of the selected item; this adjustment happens on release of Alt
-        if event.key() == Qt.Key.Key_Alt:
+        if event.key() == Qt.Key.Key_Alt and not event.isAutoRepeat():
             item = self.scene.selectedItems()
             if len(item) == 1:
                 for key in self.item_index.keys():
                     key.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, False)
 
+                self.removeSizer()
                 self.sizer = QGraphicsRectItem(0, 0, item[0].rect().width(), item[0].rect().height())
 
                 self.sizer.setPos(item[0].x(), item[0].y())
@@ -1543,6 +1795,8 @@ class MainWindow(QMainWindow):
                 self.scene.addItem(self.sizer)
 
     def keyReleaseEvent(self, event):
+        if event.isAutoRepeat(): return
+
         if event.key() == Qt.Key.Key_Alt and not self.view.is_pressed:
 
             for key in self.item_index.keys():
@@ -1552,16 +1806,7 @@ class MainWindow(QMainWindow):
 
             # this is the keyRelease-part to the item resizing function;
             # only on release is the actual resizing triggered
-            item = self.scene.selectedItems()
-            if len(item) == 1:
-                x = self.sizer.x()
-                y = self.sizer.y()
-
-                self.scene.removeItem(self.sizer)
-                self.resizeItem(x, y)
-
-                try: self.scene.removeItem(self.sizer)
-                except: return
+            self.releaseSizer()
 
         elif event.key() == Qt.Key.Key_Alt:
             # the part below is there in order to prevent a glitch that only happens when Alt is released before the
@@ -1571,20 +1816,1192 @@ class MainWindow(QMainWindow):
 
             # this is the keyRelease-part to the item resizing function;
             # only on release is the actual resizing triggered
-            item = self.scene.selectedItems()
-            if len(item) == 1:
-                x = self.sizer.x()
-                y = self.sizer.y()
+            self.releaseSizer()
+
+    '''
+    ((3.7)) Diagnostics (latency overlay, profiling)
+    '''
+    # actions shown in the status bar overlay (median/95th percentile of the recent calls)
+    OVERLAY_ACTIONS = ['changePage', 'changeKey', 'mouseTracker', 'updateAnnotations']
+
+    def toggleOverlay(self):
+        if self.overlay_action.isChecked():
+            self.updateOverlay()
+            self.overlay_label.show()
+            self.overlay_timer.start(1000)
+        else:
+            self.overlay_timer.stop()
+            self.overlay_label.hide()
+
+    def updateOverlay(self):
+        self.overlay_label.setText(self.instrumentation.overlayText(self.OVERLAY_ACTIONS))
+
+    # opens a dialog to choose the action to be profiled (and the profiler); toggling off writes the results
+    def toggleProfiling(self):
+        if not self.profile_action.isChecked():
+            path = self.instrumentation.stopProfiling()
+            if path is None: self.status_bar.showMessage('Profiling stopped, nothing was profiled', 5000)
+            else: self.status_bar.showMessage('Profile written to ' + path, 5000)
+            return
+
+        dialog = QDialog(self)
+        dialog.setWindowTitle('Profile Action')
+
+        layout = QGridLayout()
+        layout.addWidget(QLabel('Profile every call of this action until profiling is toggled off:'), 0, 0, 1, 2)
+
+        actions = QComboBox()
+        actions.addItems(['changePage', 'changeKey', 'addItem', 'deleteItem', 'updateAnnotations', 'mouseTracker',
+                          'pdfImport', 'csvImport', 'exportAnnotations', 'screenshotPage', 'screenshotDocument'])
+        profilers = QComboBox()
+        profilers.addItems(['cProfile', 'sampling'])
+
+        confirm_button = QPushButton('Confirm')
+        confirm_button.pressed.connect(dialog.accept)
+        cancel_button = QPushButton('Cancel')
+        cancel_button.pressed.connect(dialog.reject)
+
+        layout.addWidget(actions,           1, 0, 1, 1)
+        layout.addWidget(profilers,         1, 1, 1, 1)
+        layout.addWidget(confirm_button,    2, 0, 1, 1)
+        layout.addWidget(cancel_button,     2, 1, 1, 1)
+
+        dialog.setLayout(layout)
+
+        if dialog.exec():
+            self.instrumentation.startProfiling(actions.currentText(), profilers.currentText())
+            self.status_bar.showMessage('Profiling ' + actions.currentText(), 5000)
+        else:
+            self.profile_action.setChecked(False)
+        dialog.deleteLater()
+
+    def writeLatencySummary(self):
+        self.instrumentation.logSummary()
+        self.status_bar.showMessage('Latency summary written to Diagnostics/latency.log', 5000)
+
+    def closeEvent(self, event):
+        self.stopJobs()
+        if self.journal is not None: self.journal.close()
+        self.closeProject()
+        if self.corpus_index is not None: self.corpus_index.close()
+        self.instrumentation.stopProfiling()
+        if len(self.instrumentation.histograms) > 0:
+            self.instrumentation.logSummary()
+        super().closeEvent(event)
+
+    '''
+    ((3.8)) Lifecycle of scene items and widgets
+    '''
+    # Qt objects that are only removed from a scene or layout stay alive; the functions below either reuse such objects
+    # or delete them, so that memory stays flat over long sessions (see leak_check.py)
+
+    # shows the image of a page; the pixmap item is reused for every page; with a display filter, the filtered image
+    # is shown instead once it is cached (see ((3.21)))
+    def showPage(self, path):
+        path = self.displayImage(path)
+        if self.page_pixmap is None:
+            self.page_pixmap = self.scene.addPixmap(QPixmap(path))
+            self.page_pixmap.setZValue(1)
+        else:
+            self.page_pixmap.setPixmap(QPixmap(path))
+
+    # shows the anchor of the selected item as a dashed green line; the line item is reused for every item
+    def showAnchor(self, x, y):
+        if self.anchor is None:
+            self.anchor = QGraphicsLineItem()
+
+            pen = QPen(Qt.GlobalColor.green)
+            pen.setWidth(1)
+            pen.setStyle(Qt.PenStyle.DashLine)
+            self.anchor.setPen(pen)
+            self.anchor.setZValue(3)
+
+            self.scene.addItem(self.anchor)
+
+        self.anchor.setLine(x - 5, y, x + 5, y)
+        self.anchor.show()
+        self.anchorStatus = True
+
+    def hideAnchor(self):
+        if self.anchorStatus:
+            self.anchor.hide()
+            self.anchorStatus = False
+
+    # removes the sizer rectangle (see keyPressEvent) from the scene
+    def removeSizer(self):
+        if self.sizer is not None:
+            self.scene.removeItem(self.sizer)
+            self.sizer = None
+
+    # resizes the selected item to the position of the sizer rectangle and removes the sizer
+    def releaseSizer(self):
+        if self.sizer is None: return
+
+        x = self.sizer.x()
+        y = self.sizer.y()
+        self.removeSizer()
+
+        if len(self.scene.selectedItems()) == 1:
+            self.resizeItem(x, y)
+
+    # call this function instead of scene.clear(); items that are reused must be created again afterwards
+    def clearScene(self):
+        self.scene.clear()
+        self.proposals = dict()
+        self.proposal_values = dict()
+        self.page_pixmap = None
+        self.anchor = None
+        self.anchorStatus = False
+        self.sizer = None
+
+    # removes all widgets of a layout and deletes them
+    def clearLayout(self, layout):
+        while layout.count() > 0:
+            widget = layout.takeAt(0).widget()
+            widget.deleteLater()
+
+    '''
+    ((3.9)) Edit journal (crash recovery)
+    '''
+    # every edit is appended to Recovery/<document>.journal (see journal.py); exporting starts a new journal
+    def startJournal(self, base=None):
+        if self.replaying or self.document_path is None: return
+        self.closeProject()  # <- a newly loaded document is not part of the project
+
+        if self.journal is not None: self.journal.close()
+        self.journal = Journal('Recovery', self.anno_sheetTxt.text())
+        self.journal.start(self.document_path, base)
+
+    def journalEdit(self, op, item=None, **fields):
+        if (self.journal is None and self.project is None) or self.replaying: return
+
+        record = {'op': op}
+        if item is not None: record['index'] = self.item_index[item]
+        record.update(fields)
+
+        if self.edit_batch is not None:
+            self.edit_batch.append(record)
+            return
+        self.saveEdits([record])
+
+    # writes edits to the project (in one transaction) or to the journal
+    def saveEdits(self, records):
+        if len(records) == 0: return
+
+        if self.project is not None:
+            self.project.applyEdits(self.project_document, records)
+            return
+        for record in records:
+            self.journal.append(record)
+
+        if self.journal.count >= self.snapshot_every:
+            self.compactJournal()
+
+    # writes the current state as snapshot and starts the journal over
+    def compactJournal(self):
+        if self.journal is None or self.journal.count == 0: return
+        self.journal.compact(self.writeSnapshot)
+
+    # asks whether edits of a previous session that were not exported should be replayed
+    def offerRecovery(self):
+        for path in pendingJournals('Recovery'):
+            if self.journal is not None and os.path.abspath(path) == os.path.abspath(self.journal.path):
+                continue  # <- a document was loaded before the event loop started; its journal is in use
+
+            header, edits = readJournal(path)
+
+            dialog = QDialog(self)
+            dialog.setWindowTitle('Recover unsaved edits')
+
+            layout = QGridLayout()
+            layout.addWidget(QLabel('HAnnoI was closed with %d edits of "%s" that were not exported.\n'
+                                    'Replay them?' % (len(edits), os.path.basename(header['document']))), 0, 0, 1, 2)
+
+            replay_button = QPushButton('Replay')
+            replay_button.pressed.connect(dialog.accept)
+            discard_button = QPushButton('Discard')
+            discard_button.pressed.connect(dialog.reject)
+
+            layout.addWidget(replay_button,     1, 0, 1, 1)
+            layout.addWidget(discard_button,    1, 1, 1, 1)
+
+            dialog.setLayout(layout)
+            replay = dialog.exec()
+            dialog.deleteLater()
+
+            if replay:
+                self.recoverJournal(path)
+                break  # <- only one document can be open; other journals are offered again on the next start
+            else:
+                Journal(os.path.dirname(path), os.path.basename(path)[0:-len('.journal')]).discard()
+
+    # loads the base of a journal (exported CSV, snapshot or only the document) and replays all edits
+    def recoverJournal(self, path):
+        header, edits = readJournal(path)
+        document = Path(header['document']).as_posix()
+
+        if not os.path.exists(document):
+            self.status_bar.showMessage('Cannot recover edits: %s not found' % document, 10000)
+            return
+
+        # the journal file is only replaced once the recovered state is written as snapshot (see below)
+        self.replaying = True
+        try:
+            if header['base'] is not None: self.loadCsv(Path(header['base']).as_posix(), document)
+            elif document.lower().endswith('.pdf'): self.loadPdf(document)
+            else: self.loadImage(document)
+
+            lookup = {val: key for key, val in self.item_index.items()}
+            for record in edits:
+                lookup = self.applyEdit(record, lookup)
+        finally:
+            self.replaying = False
 
-                self.scene.removeItem(self.sizer)
-                self.resizeItem(x, y)
+        self.changePage()
 
-                try: self.scene.removeItem(self.sizer)
-                except: return
+        self.journal = Journal(os.path.dirname(path), os.path.basename(path)[0:-len('.journal')])
+        self.journal.header = header
+        self.journal.count = len(edits)
+        self.compactJournal()
 
+        self.status_bar.showMessage('Recovered %d edits' % len(edits), 5000)
 
-app = QApplication(sys.argv)
-app.setStyle('Fusion')
-window = MainWindow()
-window.show()
-app.exec()
\ No newline at end of file
+    # applies one journaled edit; lookup maps indices to items and is returned updated
+    def applyEdit(self, record, lookup):
+        op = record['op']
+
+        if op == 'add':
+            values = ['' for i in range(len(self.annotation_layers['Dims']))]
+            rect = self.createItem(record['coords'], record['page'], record['index'], record['color'], None, values)
+            self.item_counter = record['index'] + 1
+            lookup[record['index']] = rect
+
+        elif op == 'delete':
+            self.discardItem(lookup[record['index']])
+            lookup = {val: key for key, val in self.item_index.items()}
+
+        elif op == 'reindex':
+            self.moveIndex(lookup[record['index']], record['new'])
+            lookup = {val: key for key, val in self.item_index.items()}
+
+        elif op == 'renumber':
+            for old, new in record['pairs']:
+                self.item_index[lookup[old]] = new
+            lookup = {val: key for key, val in self.item_index.items()}
+
+        elif op == 'coords':
+            item = lookup[record['index']]
+            x, y, width, height = record['coords']
+            item.setPos(x, y)
+            item.setRect(0, 0, width, height)
+            self.item_coords[item] = record['coords']
+
+        elif op == 'annotate':
+            self.item_dict[lookup[record['index']]][record['layer']] = record['value']
+
+        elif op == 'anchor':
+            self.item_anchors[lookup[record['index']]] = record['anchor']
+
+        elif op == 'color':
+            item = lookup[record['index']]
+            self.item_colors[item] = record['color']
+            item.setPen(self.colorPen(record['color']))
+
+        elif op == 'layer':
+            self.addLayer(record['name'])
+
+        return lookup
+
+    '''
+    ((3.10)) SQLite projects (see project_store.py)
+    '''
+    def openProject(self):
+        fname = QFileDialog.getOpenFileName(self, 'Open Project', './', '(*%s)' % EXTENSION, )
+        if len(fname[0]) == 0: return
+
+        store = ProjectStore(fname[0])
+        documents = store.documents()
+        store.close()
+
+        if len(documents) == 0:
+            self.status_bar.showMessage('The project does not contain any documents', 5000)
+            return
+
+        # projects with more than one document: ask which one to open
+        document = documents[0]
+        if len(documents) > 1:
+            names = [name for id, path, name in documents]
+            name, ok = QInputDialog.getItem(self, 'Open Project', 'Document:', names, 0, False)
+            if not ok: return
+            document = documents[names.index(name)]
+
+        self.loadProject(fname[0], document[0])
+
+    # loads one document of a project (only its items and annotations are read from the project file)
+    @instrumented('projectImport')
+    def loadProject(self, path, document):
+        store = ProjectStore(path)
+        document_path = [row[1] for row in store.documents() if row[0] == document][0]
+
+        if not os.path.exists(document_path):
+            store.close()
+            self.status_bar.showMessage('Cannot open project: %s not found' % document_path, 10000)
+            return
+
+        self.loadFrame(store.frame(document), None, Path(document_path).as_posix())
+        self.attachProject(store, document)
+
+    # saves the current document to a (new or existing) project file; all later edits are saved to it right away
+    def saveProject(self):
+        fname = QFileDialog.getSaveFileName(self, 'Save to Project', './', '(*%s)' % EXTENSION, '',
+                                            QFileDialog.Option.DontConfirmOverwrite)
+        if len(fname[0]) == 0: return
+
+        path = fname[0] if fname[0].endswith(EXTENSION) else fname[0] + EXTENSION
+        self.writeProject(path)
+
+    def writeProject(self, path):
+        if self.document_path is None:
+            self.status_bar.showMessage('Nothing to save', 5000)
+            return
+
+        self.closeProject()
+        store = ProjectStore(path)
+        document = store.saveFrame(self.document_path, len(self.page_index), self.annotationFrame())
+        self.attachProject(store, document)
+
+    # from now on, edits are saved to the project; the edit journal is not needed anymore
+    def attachProject(self, store, document):
+        if self.journal is not None:
+            self.journal.discard()
+            self.journal = None
+
+        self.project = store
+        self.project_document = document
+        self.status_bar.showMessage('Saving edits to %s' % os.path.basename(store.path), 5000)
+
+    def closeProject(self):
+        if self.project is not None:
+            self.project.close()
+            self.project = None
+            self.project_document = None
+
+    '''
+    ((3.11)) Background jobs (export, rendering)
+    '''
+    # runs job (see jobs.py) in the background with a progress dialog that can cancel it; aborted is called if the
+    # job is cancelled or fails, succeeded if it finishes
+    def startJob(self, job, label, aborted=None, succeeded=None):
+        dialog = QProgressDialog(label, 'Cancel', 0, 0, self)
+        dialog.setWindowTitle('Background Job')
+        dialog.setWindowModality(Qt.WindowModality.NonModal)  # <- annotating goes on while the job runs
+        dialog.setMinimumDuration(500)  # <- short jobs finish without showing the dialog
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.canceled.connect(job.cancel)
+
+        job.progress.connect(lambda done, total: self.jobProgress(dialog, done, total))
+        job.finished.connect(lambda: self.jobFinished(job, dialog, aborted, succeeded))
+
+        self.jobs.append(job)
+        job.start()
+        return job
+
+    def jobProgress(self, dialog, done, total):
+        dialog.setMaximum(total)
+        dialog.setValue(done)
+
+    def jobFinished(self, job, dialog, aborted, succeeded):
+        self.jobs.remove(job)
+
+        dialog.canceled.disconnect()  # <- closing the dialog would cancel the (finished) job otherwise
+        dialog.close()
+        dialog.deleteLater()
+
+        if job.error is not None:
+            self.status_bar.showMessage('Job failed: ' + job.error, 10000)
+        elif job.cancelled:
+            self.status_bar.showMessage('Job cancelled', 5000)
+        else:
+            self.instrumentation.record(job.action, job.elapsed)
+            self.status_bar.showMessage('Job finished', 3000)
+
+        if (job.error is not None or job.cancelled) and aborted is not None:
+            aborted()
+        elif job.error is None and not job.cancelled and succeeded is not None:
+            succeeded()
+        job.deleteLater()
+
+    # jobs that read the page images are cancelled, all other jobs are finished; called before the temp folder is
+    # cleared and on exit
+    def stopJobs(self):
+        for job in self.jobs:
+            if job.uses_pages: job.cancel()
+            job.wait()
+
+    # the journal was started over with an export that did not finish, so the current state becomes its base instead
+    def restoreJournal(self):
+        if self.journal is not None:
+            self.journal.compact(self.writeSnapshot)
+
+    '''
+    ((3.12)) Letter box proposals (connected components, see page_analysis.py)
+    '''
+    @instrumented('proposeBoxes')
+    def proposeCurrentPage(self):
+        if len(self.page_index) == 0: return
+        page = self.view_tabs.currentIndex() + 1
+        self.addProposals(page, proposePage(self.pageImage(page)))
+
+    # all pages are analysed in a pool of worker processes in the background
+    def proposeAllPages(self):
+        if len(self.page_index) == 0: return
+        job = ProposalJob({page: self.pageImage(page) for page in self.page_index.values()})
+        return self.startJob(job, 'Proposing letter boxes ...', succeeded=lambda: self.receiveProposals(job))
+
+    def receiveProposals(self, job):
+        proposed = 0
+        for page, boxes in sorted(job.result.items()):
+            proposed += self.addProposals(page, boxes)
+        self.status_bar.showMessage('%d boxes proposed' % proposed, 5000)
+
+    # adds boxes as proposals to page; boxes that overlap an item or an earlier proposal are left out; values are the
+    # annotation values the proposals get when they are accepted (empty by default)
+    def addProposals(self, page, boxes, values=None):
+        existing = [self.item_coords[item] for item in self.page_items[page]]
+        existing += [[p.x(), p.y(), p.rect().width(), p.rect().height()] for p in self.proposals.get(page, [])]
+        boxes = newBoxes(boxes, existing)
+
+        pen = self.colorPen('proposed')
+        for x, y, width, height in boxes:
+            rect = QGraphicsRectItem(0, 0, width, height)
+            rect.setPos(x, y)
+            rect.setPen(pen)
+            rect.setZValue(2 if page == self.view_tabs.currentIndex() + 1 else 0)
+            self.scene.addItem(rect)
+            self.proposals.setdefault(page, []).append(rect)
+            if values is not None: self.proposal_values[rect] = values
+
+        self.status_bar.showMessage('%d boxes proposed' % len(boxes), 5000)
+        return len(boxes)
+
+    # turns all proposals of the current page into items (with the current item color)
+    def acceptProposals(self):
+        page = self.view_tabs.currentIndex() + 1
+        layers = len(self.annotation_layers['Dims'])
+
+        with self.editBatch():
+            for proposal in self.proposals.pop(page, []):
+                coords = [proposal.x(), proposal.y(), proposal.rect().width(), proposal.rect().height()]
+                self.scene.removeItem(proposal)
+
+                values = list(self.proposal_values.pop(proposal, []))
+                values += ['' for i in range(layers - len(values))]  # <- layers may have been added in the meantime
+                rect = self.createItem(coords, page, self.item_counter, self.rect_col.currentText(), None,
+                                       self.blankValues())
+                rect.setZValue(2)
+                rect.setFlags(QGraphicsItem.GraphicsItemFlag.ItemIsMovable |
+                              QGraphicsItem.GraphicsItemFlag.ItemIsSelectable)
+                self.item_counter += 1
+
+                self.journalEdit('add', rect, page=page, coords=self.item_coords[rect], color=self.item_colors[rect])
+                for layer, value in enumerate(values):
+                    if value != '': self.setItemValue(rect, layer, value)
+
+        self.toggleItems()
+
+    def rejectProposals(self):
+        for proposal in self.proposals.pop(self.view_tabs.currentIndex() + 1, []):
+            self.proposal_values.pop(proposal, None)
+            self.scene.removeItem(proposal)
+
+    '''
+    ((3.13)) Baselines (anchors from projection profiles, see page_analysis.py)
+    '''
+    # text lines (top, bottom, baseline) of page; they are computed once per page and kept until another document is
+    # loaded
+    def pageLines(self, page):
+        if page not in self.page_lines:
+            self.page_lines[page] = textLines(loadGray(self.pageImage(page)))
+        return self.page_lines[page]
+
+    @instrumented('snapAnchors')
+    def snapSelectedAnchors(self):
+        items = [item for item in self.scene.selectedItems() if item in self.item_index]
+        self.snapItemAnchors(self.view_tabs.currentIndex() + 1, items)
+
+    @instrumented('snapAnchors')
+    def snapPageAnchors(self):
+        page = self.view_tabs.currentIndex() + 1
+        self.snapItemAnchors(page, self.page_items.get(page, []))
+
+    # sets the anchors of items (all on page) to the baseline of their text line
+    def snapItemAnchors(self, page, items):
+        if len(items) == 0: return
+
+        anchors = snapAnchors([self.item_coords[item] for item in items], self.pageLines(page))
+        for item, (x, y) in zip(items, anchors):
+            self.item_anchors[item] = [round(float(x), 2), round(float(y), 2)]
+            self.journalEdit('anchor', item, anchor=self.item_anchors[item])
+
+        if self.current_key in items:
+            self.anno_anchorTxt.setText(str(self.item_anchors[self.current_key]))
+            self.showAnchor(*self.item_anchors[self.current_key])
+
+        self.status_bar.showMessage('%d anchors set' % len(items), 3000)
+
+    '''
+    ((3.14)) Reading order
+    '''
+    # returns the items of page in reading order (see page_analysis.py)
+    def readingItems(self, page):
+        items = self.page_items.get(page, [])
+        order = readingOrder([self.item_coords[item] for item in items], [self.item_anchors[item] for item in items])
+        return [items[i] for i in order]
+
+    # the items of the current page keep their set of indices, but get them in reading order
+    @instrumented('renumber')
+    def renumberPage(self):
+        items = self.readingItems(self.view_tabs.currentIndex() + 1)
+        indices = sorted(self.item_index[item] for item in items)
+        self.renumberItems(dict(zip(items, indices)))
+
+    @instrumented('renumber')
+    def renumberDocument(self):
+        new_index = dict()
+        for page in sorted(self.page_items):
+            for item in self.readingItems(page):
+                new_index[item] = len(new_index) + 1
+        self.renumberItems(new_index)
+
+    # gives the items in new_index (dictionary of items and indices) their new indices
+    def renumberItems(self, new_index):
+        pairs = [[self.item_index[item], index] for item, index in new_index.items() if self.item_index[item] != index]
+        if len(pairs) == 0:
+            self.status_bar.showMessage('Nothing changed', 3000)
+            return
+
+        self.journalEdit('renumber', pairs=pairs)
+        for item, index in new_index.items():
+            self.item_index[item] = index
+
+        self.renameScreenshots(pairs)
+
+        if self.current_key in new_index:
+            self.anno_indexTxt.setText(str(self.item_index[self.current_key]))
+        self.status_bar.showMessage('%d items renumbered' % len(pairs), 3000)
+
+    # screenshots are named by item index, so existing screenshots are renamed along with their items
+    def renameScreenshots(self, pairs):
+        file_name = self.anno_sheetTxt.text()[0:-4]
+        folder = 'Annotated/' + file_name + '/Screenshots/'
+        if not os.path.exists(folder): return
+
+        # two steps, as the new names are the old names of other screenshots
+        moved = []
+        for old, new in pairs:
+            path = folder + cropName(file_name, old)
+            if os.path.exists(path):
+                os.replace(path, path + '.renumber')
+                moved.append((path + '.renumber', folder + cropName(file_name, new)))
+        for temp_path, path in moved:
+            os.replace(temp_path, path)
+
+    '''
+    ((3.15)) Overlapping items (duplicates)
+    '''
+    # lists all pairs of items on the same page that overlap by at least the given IoU; selecting a pair shows its
+    # later item (the one with the higher index), which can then be deleted
+    def findOverlaps(self):
+        threshold, ok = QInputDialog.getDouble(self, 'Find Overlapping Items', 'Minimum overlap (IoU):', 0.5, 0.01, 1,
+                                               2)
+        if not ok: return
+
+        self.overlaps = self.overlappingItems(threshold)
+        if len(self.overlaps) == 0:
+            self.status_bar.showMessage('No overlapping items found', 5000)
+            return
+
+        dialog = QDialog(self)
+        dialog.setWindowTitle('Overlapping Items')
+        layout = QVBoxLayout()
+
+        self.overlap_list = QListWidget()
+        self.overlap_list.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        for page, first, second, iou in self.overlaps:
+            self.overlap_list.addItem('Page %d: items %d and %d (IoU %.2f)' % (page, self.item_index[first],
+                                                                                self.item_index[second], iou))
+        self.overlap_list.itemSelectionChanged.connect(self.showOverlap)
+        layout.addWidget(self.overlap_list)
+
+        delete_button = QPushButton('Delete Later Item of Selected Pairs')
+        delete_button.pressed.connect(self.deleteOverlaps)
+        delete_button.pressed.connect(dialog.accept)
+        close_button = QPushButton('Close')
+        close_button.pressed.connect(dialog.accept)
+        layout.addWidget(delete_button)
+        layout.addWidget(close_button)
+
+        dialog.setLayout(layout)
+        dialog.exec()
+        dialog.deleteLater()
+        self.overlap_list = None
+
+    # returns a list of (page, earlier item, later item, IoU), page by page
+    @instrumented('findOverlaps')
+    def overlappingItems(self, threshold):
+        overlaps = []
+        for page in sorted(self.page_items):
+            items = self.page_items[page]
+            pairs, ious = overlappingPairs([self.item_coords[item] for item in items], threshold)
+            for (a, b), iou in zip(pairs, ious):
+                first, second = sorted([items[a], items[b]], key=self.item_index.get)
+                overlaps.append((page, first, second, float(iou)))
+        return overlaps
+
+    def showOverlap(self):
+        rows = self.overlap_list.selectedIndexes()
+        if len(rows) == 0: return
+
+        page, first, second, iou = self.overlaps[rows[-1].row()]
+        self.view_tabs.setCurrentIndex(page - 1)
+        self.scene.clearSelection()
+        second.setSelected(True)
+        self.view_tabs.currentWidget().centerOn(second)
+
+    def deleteOverlaps(self):
+        items = [self.overlaps[row.row()][2] for row in self.overlap_list.selectedIndexes()]
+        self.scene.clearSelection()
+        self.discardItems(items)
+        self.status_bar.showMessage('%d items deleted' % len(set(items)), 5000)
+
+    '''
+    ((3.16)) Similar items (glyph descriptors, see page_analysis.py)
+    '''
+    # lists the items most similar to the selected item; descriptors are computed once per item (and again after the
+    # item was moved or resized), for many items in the background
+    def findSimilar(self):
+        selected = [item for item in self.scene.selectedItems() if item in self.item_index]
+        if len(selected) == 0: return
+        item = selected[0]
+
+        # descriptors of deleted items are dropped, those of moved or resized items are computed again
+        for old in [old for old in self.glyphs if old not in self.item_index]:
+            self.glyphs.pop(old)
+            self.glyph_matrix = None
+
+        missing = dict()
+        for page, items in self.page_items.items():
+            for other in items:
+                if other not in self.glyphs or self.glyphs[other][1] != self.item_coords[other]:
+                    missing.setdefault(page, []).append(other)
+
+        if sum(len(items) for items in missing.values()) > self.glyph_job_size:
+            job = DescriptorJob({page: (self.pageImage(page), [self.item_coords[other] for other in items])
+                                 for page, items in missing.items()})
+            self.startJob(job, 'Describing items ...',
+                          succeeded=lambda: self.receiveDescriptors(missing, job.result, item))
+            return
+
+        self.receiveDescriptors(missing, {page: pageDescriptors(self.pageImage(page),
+                                                                [self.item_coords[other] for other in items])
+                                          for page, items in missing.items()}, item)
+
+    def receiveDescriptors(self, missing, descriptors, item):
+        for page, items in missing.items():
+            for other, descriptor in zip(items, descriptors[page]):
+                if other in self.item_index:  # <- the item may have been deleted while the job ran
+                    self.glyphs[other] = (page, list(self.item_coords[other]), descriptor)
+        if len(missing) > 0: self.glyph_matrix = None
+
+        if item in self.item_index: self.showSimilar(item)
+
+    @instrumented('findSimilar')
+    def showSimilar(self, item):
+        if self.glyph_matrix is None:
+            items = list(self.glyphs)
+            self.glyph_matrix = (items, [self.glyphs[other][0] for other in items],
+                                 np.stack([self.glyphs[other][2] for other in items]))
+        items, pages, matrix = self.glyph_matrix
+
+        rows, scores = nearest(matrix, self.glyphs[item][2], self.similar_count + 1)
+        results = [(items[row], pages[row], score) for row, score in zip(rows, scores) if items[row] is not item]
+        results = results[:self.similar_count]
+        self.similar_items = [(other, page) for other, page, score in results]
+
+        if self.similar_dialog is None:
+            self.similar_dialog = QDialog(self)
+            self.similar_dialog.setWindowTitle('Similar Items')
+            layout = QVBoxLayout()
+            self.similar_list = QListWidget()
+            self.similar_list.itemClicked.connect(self.showSimilarItem)
+            layout.addWidget(self.similar_list)
+            self.similar_dialog.setLayout(layout)
+
+        self.similar_list.clear()
+        for other, page, score in results:
+            annotations = ', '.join(value for value in self.itemValues(other) if value != '')
+            self.similar_list.addItem('Page %d, item %d (%.2f)  %s' % (page, self.item_index[other], score,
+                                                                        annotations))
+
+        self.similar_dialog.setWindowTitle('Items similar to item %d' % self.item_index[item])
+        self.similar_dialog.show()
+
+    # jumps to the page of the clicked item and selects it
+    def showSimilarItem(self, entry):
+        other, page = self.similar_items[self.similar_list.row(entry)]
+        if other not in self.item_index: return
+
+        self.view_tabs.setCurrentIndex(page - 1)
+        self.scene.clearSelection()
+        other.setSelected(True)
+        self.view_tabs.currentWidget().centerOn(other)
+
+    '''
+    ((3.17)) Occurrences (template matching, see page_analysis.py)
+    '''
+    # proposes boxes for the other occurrences of the selected item on the current page; the proposals have the size of
+    # the selected item and get the values of the chosen annotation layers when they are accepted
+    @instrumented('matchTemplate')
+    def matchCurrentPage(self):
+        source = self.matchSource()
+        if source is None: return
+        item, page, values, threshold = source
+
+        current = self.view_tabs.currentIndex() + 1
+        gray = loadGray(self.pageImage(current))
+        template = gray if current == page else loadGray(self.pageImage(page))
+        template = self.itemTemplate(item, template)
+        self.receiveMatches(item, values, {current: matchTemplate(gray, template, threshold)})
+
+    # all pages are searched in a pool of worker processes in the background
+    def matchAllPages(self):
+        source = self.matchSource()
+        if source is None: return
+        item, page, values, threshold = source
+
+        template = self.itemTemplate(item, loadGray(self.pageImage(page)))
+        job = MatchJob({page: self.pageImage(page) for page in self.page_index.values()}, template, threshold)
+        return self.startJob(job, 'Finding occurrences ...',
+                             succeeded=lambda: self.receiveMatches(item, values, job.result))
+
+    def receiveMatches(self, item, values, matches):
+        if item not in self.item_index: return  # <- the item was deleted while the job ran
+        width, height = self.item_coords[item][2:4]
+
+        proposed = 0
+        for page, hits in sorted(matches.items()):
+            proposed += self.addProposals(page, [[x, y, width, height] for (x, y, w, h), score in hits], values)
+        self.status_bar.showMessage('%d occurrences proposed' % proposed, 5000)
+
+    # the part of the (grayscale) page image that is covered by item
+    def itemTemplate(self, item, gray):
+        left, top, right, bottom = cropBox(*self.item_coords[item])
+        return gray[max(top, 0):bottom, max(left, 0):right]
+
+    # asks which annotation layers the occurrences of the selected item take over, and how similar they must be;
+    # returns (item, page, values, threshold) or None
+    def matchSource(self):
+        selected = [item for item in self.scene.selectedItems() if item in self.item_index]
+        if len(selected) != 1:
+            self.status_bar.showMessage('Select the item whose occurrences should be found', 5000)
+            return None
+        item = selected[0]
+        page = [page for page, items in self.page_items.items() if item in items][0]
+
+        dialog = QDialog(self)
+        dialog.setWindowTitle('Find occurrences of item %d' % self.item_index[item])
+
+        layout = QGridLayout()
+        layout.addWidget(QLabel('Annotation layers the occurrences take over:'), 0, 0, 1, 2)
+
+        layers = QListWidget()
+        for layer, value in zip(self.annotation_layers['Dims'], self.itemValues(item)):
+            entry = QListWidgetItem('%s: %s' % (layer, value))
+            entry.setFlags(entry.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            entry.setCheckState(Qt.CheckState.Checked if value != '' else Qt.CheckState.Unchecked)
+            layers.addItem(entry)
+
+        threshold = QSpinBox()
+        threshold.setRange(1, 100)
+        threshold.setSuffix(' %')
+        threshold.setValue(self.match_threshold)
+
+        confirm_button = QPushButton('Confirm')
+        confirm_button.pressed.connect(dialog.accept)
+
+        cancel_button = QPushButton('Cancel')
+        cancel_button.pressed.connect(dialog.reject)
+
+        layout.addWidget(layers,                        1, 0, 1, 2)
+        layout.addWidget(QLabel('Minimum similarity:'), 2, 0, 1, 1)
+        layout.addWidget(threshold,                     2, 1, 1, 1)
+        layout.addWidget(confirm_button,                3, 0, 1, 1)
+        layout.addWidget(cancel_button,                 3, 1, 1, 1)
+
+        dialog.setLayout(layout)
+        confirmed = dialog.exec() == QDialog.DialogCode.Accepted
+        values = [value if layers.item(i).checkState() == Qt.CheckState.Checked else ''
+                  for i, value in enumerate(self.itemValues(item))]
+        if confirmed: self.match_threshold = threshold.value()
+        dialog.deleteLater()
+
+        return (item, page, values, self.match_threshold / 100) if confirmed else None
+
+    '''
+    ((3.18)) Multi-selection (batch edits of several items)
+    '''
+    # Shift + drag selects all items within a rectangle, Ctrl + click adds items to the selection. Edits of several
+    # items are journaled as one batch (one transaction in a project), and the panel is updated once afterwards.
+    @contextmanager
+    def editBatch(self):
+        if self.edit_batch is not None:  # <- nested batches are part of the outer batch
+            yield
+            return
+
+        self.edit_batch = []
+        try:
+            yield
+        finally:
+            records, self.edit_batch = self.edit_batch, None
+            self.saveEdits(records)
+
+    # the selected items (without the sizer and proposals)
+    def selectedItemList(self):
+        return [item for item in self.scene.selectedItems() if item in self.item_index]
+
+    def selectPage(self):
+        self.scene.blockSignals(True)  # <- otherwise, changeKey would run once per item
+        for item in self.page_items.get(self.view_tabs.currentIndex() + 1, []):
+            item.setSelected(True)
+        self.scene.blockSignals(False)
+        self.changeKey()
+
+    # called at the end of every left click; items that were dragged together are saved here (and not on every mouse
+    # move, see mouseTracker)
+    def mouseReleased(self, selecting):
+        if selecting: self.changeKey()
+
+        items = self.selectedItemList()
+        if len(items) > 1:
+            with self.editBatch():
+                for item in items:
+                    self.updateCoords(item)
+
+    # shows the annotations of several items; a layer shows its value if all items have the same one, and the value
+    # entered for a layer is given to all items (on Return)
+    def showSelection(self, items):
+        self.clearLayout(self.anno_bot_widgetTxts)
+
+        for i in range(len(self.annotation_layers['Dims'])):
+            values = {self.itemValue(item, i) for item in items}
+            line = QLineEdit(list(values)[0] if len(values) == 1 else '')
+            line.setPlaceholderText('NA' if len(values) == 1 else 'Several values')
+            line.setFixedHeight(30)
+            line.editingFinished.connect(lambda layer=i, line=line: self.annotateSelection(items, layer, line))
+            self.anno_bot_widgetTxts.addWidget(line)
+
+        self.anno_indexTxt.setText('%d items selected' % len(items))
+        self.anno_coordTxt.setText('%d items selected' % len(items))
+        self.anno_anchorTxt.setText('%d items selected' % len(items))
+
+    def annotateSelection(self, items, layer, line):
+        if not line.isModified(): return  # <- the line lost focus without being edited
+        line.setModified(False)
+
+        items = [item for item in items if item in self.item_index]
+        with self.editBatch():
+            annotated = self.annotateItems(items, layer, line.text())
+        if annotated: self.status_bar.showMessage('%d items annotated' % len(items), 3000)
+
+    # gives value to items in layer; returns False if value was rejected (see ((3.19)))
+    def annotateItems(self, items, layer, value):
+        code = self.encodeValue(layer, value)
+        if code is None:
+            self.rejectValue(layer, value)
+            return False
+
+        for item in items:
+            if self.item_dict[item][layer] != code:
+                self.item_dict[item][layer] = code
+                self.journalEdit('annotate', item, layer=layer, value=value)
+        return True
+
+    def recolorSelection(self):
+        with self.editBatch():
+            self.recolorItems(self.selectedItemList(), self.rect_col.currentText())
+
+    def recolorItems(self, items, color):
+        for item in items:
+            if item is self.current_key: self.current_color = color  # <- its pen is set when it is deselected
+            else: item.setPen(self.colorPen(color))
+
+            if self.item_colors[item] != color:
+                self.item_colors[item] = color
+                self.journalEdit('color', item, color=color)
+
+    # moves items by dx, dy pixels
+    def moveItems(self, items, dx, dy):
+        with self.editBatch():
+            for item in items:
+                item.setPos(item.x() + dx, item.y() + dy)
+                self.updateCoords(item)
+
+    # changes the size of items by dw, dh pixels
+    def growItems(self, items, dw, dh):
+        with self.editBatch():
+            for item in items:
+                item.setRect(0, 0, int(item.rect().width()) + dw, int(item.rect().height()) + dh)
+                self.updateCoords(item)
+
+    '''
+    ((3.19)) Categorical layers (values stored as codes of their levels)
+    '''
+    # Items store the position of their level in layer_levels (-1 for no value) instead of the level itself; values
+    # that are not among the levels of a categorical layer are rejected. Journal and project keep the levels.
+
+    # makes layer categorical with levels; fails (and returns False) if an item has a value that is not a level
+    def encodeLayer(self, layer, levels):
+        position = self.annotation_layers['Dims'].index(layer)
+        invalid = sorted({values[position] for values in self.item_dict.values()} - set(levels) - {''})
+        if len(levels) == 0 or len(invalid) > 0:
+            self.status_bar.showMessage('Layer %s is not categorical: %s' % (
+                layer, 'no levels given' if len(levels) == 0 else 'values missing from the levels: ' +
+                                                                  ', '.join(invalid[:10])), 10000)
+            return False
+
+        self.layer_levels[layer] = levels
+        self.level_codes[layer] = {level: code for code, level in enumerate(levels)}
+        for values in self.item_dict.values():
+            values[position] = self.level_codes[layer].get(values[position], -1)
+        return True
+
+    # returns what an item stores for value in layer (a position in the item's values): the code of value in a
+    # categorical layer, otherwise value itself; None if value is not a level of the categorical layer
+    def encodeValue(self, layer, value):
+        codes = self.level_codes.get(self.annotation_layers['Dims'][layer])
+        if codes is None: return value
+        if value == '': return -1
+        return codes.get(value)
+
+    def itemValue(self, item, layer):
+        value = self.item_dict[item][layer]
+        levels = self.layer_levels.get(self.annotation_layers['Dims'][layer])
+        if levels is None: return value
+        return '' if value < 0 else levels[value]
+
+    def itemValues(self, item):
+        return [self.itemValue(item, layer) for layer in range(len(self.item_dict[item]))]
+
+    # values of a new item (empty values; -1 in categorical layers)
+    def blankValues(self):
+        return [self.encodeValue(layer, '') for layer in range(len(self.annotation_layers['Dims']))]
+
+    # sets (and journals) the value of item in layer; returns False if value was rejected
+    def setItemValue(self, item, layer, value):
+        code = self.encodeValue(layer, value)
+        if code is None:
+            self.rejectValue(layer, value)
+            return False
+
+        self.item_dict[item][layer] = code
+        self.journalEdit('annotate', item, layer=layer, value=value)
+        return True
+
+    def rejectValue(self, layer, value):
+        self.status_bar.showMessage('"%s" is not a level of layer %s' % (value, self.annotation_layers['Dims'][layer]),
+                                    5000)
+
+    # number of items per level of each categorical layer (and without value)
+    def levelCounts(self):
+        counts = dict()
+        for layer, levels in self.layer_levels.items():
+            position = self.annotation_layers['Dims'].index(layer)
+            codes = np.fromiter((values[position] for values in self.item_dict.values()), dtype=np.int64,
+                                count=len(self.item_dict))
+            counts[layer] = (np.bincount(codes[codes >= 0], minlength=len(levels)), int((codes < 0).sum()))
+        return counts
+
+    def showLevelCounts(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle('Level Counts')
+
+        layout = QVBoxLayout()
+        counts = self.levelCounts()
+        if len(counts) == 0: layout.addWidget(QLabel('There are no categorical layers'))
+        for layer, (level_counts, empty) in counts.items():
+            lines = ['%s: %d' % (level, count) for level, count in zip(self.layer_levels[layer], level_counts)]
+            layout.addWidget(QLabel('%s\n  %s\n  no value: %d' % (layer, '\n  '.join(lines), empty)))
+
+        dialog.setLayout(layout)
+        dialog.exec()
+        dialog.deleteLater()
+
+    '''
+    ((3.20)) Corpus search (see corpus_index.py)
+    '''
+    # searches the index of all exported CSV files (Annotated/<document>/*.csv) for items with given values, e.g.
+    # 'Letter=s Word=w*'; clicking a result jumps to the item if its document is loaded, double-clicking loads the CSV
+    # file of another document first
+    def showCorpusSearch(self):
+        if self.corpus_dialog is None:
+            self.corpus_dialog = QDialog(self)
+            self.corpus_dialog.setWindowTitle('Search Corpus')
+            layout = QGridLayout()
+
+            self.corpus_query = QLineEdit()
+            self.corpus_query.setPlaceholderText('Letter=s Word=w*')
+            self.corpus_query.returnPressed.connect(self.searchCorpus)
+            layout.addWidget(self.corpus_query, 0, 0)
+
+            update_button = QPushButton('Update Index')
+            update_button.setToolTip('Index new and changed CSV files in the Annotated folder')
+            update_button.clicked.connect(self.updateCorpusIndex)
+            layout.addWidget(update_button, 0, 1)
+
+            self.corpus_summary = QLabel('')
+            layout.addWidget(self.corpus_summary, 1, 0, 1, 2)
+
+            self.corpus_list = QListWidget()
+            self.corpus_list.itemClicked.connect(lambda entry: self.showCorpusItem(entry, False))
+            self.corpus_list.itemActivated.connect(lambda entry: self.showCorpusItem(entry, True))
+            self.corpus_list.currentRowChanged.connect(self.previewCorpusItem)
+            layout.addWidget(self.corpus_list, 2, 0)
+
+            self.corpus_preview = QLabel('')
+            self.corpus_preview.setAlignment(Qt.AlignmentFlag.AlignCenter)
+            self.corpus_preview.setMinimumWidth(120)
+            layout.addWidget(self.corpus_preview, 2, 1)
+
+            self.corpus_dialog.setLayout(layout)
+
+        self.corpus_dialog.show()
+        self.corpus_query.setFocus()
+
+    def openCorpusIndex(self):
+        if self.corpus_index is None: self.corpus_index = CorpusIndex(CORPUS_INDEX)
+        return self.corpus_index
+
+    @instrumented('searchCorpus')
+    def searchCorpus(self):
+        try: results, total = self.openCorpusIndex().search(self.corpus_query.text(), self.corpus_limit)
+        except ValueError as error:
+            self.corpus_summary.setText(str(error))
+            return
+
+        self.corpus_results = results
+        self.corpus_list.clear()
+        for result in results:
+            self.corpus_list.addItem('%s  page %d, item %d' % (result['source'], result['page'], result['index']))
+
+        if total > len(results):
+            self.corpus_summary.setText('%d items (first %d listed)' % (total, len(results)))
+        elif self.corpus_index.fileCount() == 0:
+            self.corpus_summary.setText('The index is empty; update it to search the exported CSV files')
+        else: self.corpus_summary.setText('%d items' % total)
+
+    # (re)indexes the exported CSV files in the background; the search is repeated once the index is up to date
+    def updateCorpusIndex(self):
+        job = IndexJob(CORPUS_INDEX, 'Annotated')
+        return self.startJob(job, 'Updating the corpus index ...', succeeded=lambda: self.receiveCorpusIndex(job))
+
+    def receiveCorpusIndex(self, job):
+        counts = job.result
+        self.status_bar.showMessage('Corpus index: %d files indexed, %d unchanged, %d removed, %d failed' % (
+            counts['indexed'], counts['unchanged'], counts['removed'], len(counts['failed'])), 5000)
+        if self.corpus_dialog is not None and self.corpus_query.text().strip() != '': self.searchCorpus()
+
+    # shows the screenshot of the current result (if it was rendered)
+    def previewCorpusItem(self, row):
+        if row < 0 or row >= len(self.corpus_results) or not os.path.exists(self.corpus_results[row]['crop']):
+            self.corpus_preview.setPixmap(QPixmap())
+            self.corpus_preview.setText('no screenshot')
+            return
+        pixmap = QPixmap(self.corpus_results[row]['crop'])
+        self.corpus_preview.setPixmap(pixmap.scaled(120, 120, Qt.AspectRatioMode.KeepAspectRatio))
+
+    # jumps to the item of a result; its CSV file is loaded first if it belongs to another document and load is True
+    def showCorpusItem(self, entry, load):
+        result = self.corpus_results[self.corpus_list.row(entry)]
+        if result['source'] != self.anno_sheetTxt.text():
+            if not load:
+                self.status_bar.showMessage('Double-click to open ' + result['source'], 3000)
+                return
+            self.loadCsv(result['csv'])
+            if result['source'] != self.anno_sheetTxt.text(): return  # <- the document was not found
+
+        item = next((item for item in self.page_items.get(result['page'], [])
+                     if self.item_index[item] == result['index']), None)
+        if item is None:
+            self.status_bar.showMessage('Item %d is no longer on page %d' % (result['index'], result['page']), 5000)
+            return
+
+        self.view_tabs.setCurrentIndex(result['page'] - 1)
+        self.scene.clearSelection()
+        item.setSelected(True)
+        self.view_tabs.currentWidget().centerOn(item)
+
+
+    '''
+    ((3.21)) Display filters (contrast, binarization, background, see page_analysis.py)
+    '''
+    # the filtered images of a page image are cached in the temp folder (which is cleared when another document is
+    # loaded); all filters of a page are computed together, so that switching between them is only loading an image
+    def filteredImage(self, path, name):
+        return 'temp/' + filteredName(os.path.basename(path), name)
+
+    # path of the image a page image is shown as; while its filtered image is not cached yet, the page image itself is
+    # shown and the filters are computed in the background
+    def displayImage(self, path):
+        if self.page_filter is None: return path
+        filtered = self.filteredImage(path, self.page_filter)
+        if os.path.exists(filtered): return filtered
+        if self.filter_job is None: QTimer.singleShot(0, self.filterPages)  # <- once the document is loaded
+        return path
+
+    @instrumented('setPageFilter')
+    def setPageFilter(self, name):
+        self.page_filter = name
+        self.refreshPage()
+
+    def refreshPage(self):
+        if len(self.page_index) == 0: return
+        self.showPage(self.pageImage(self.view_tabs.currentIndex() + 1))
+
+    # computes the filters of all pages that are not cached yet in a pool of worker processes (current page first)
+    def filterPages(self):
+        if self.filter_job is not None or self.page_filter is None or len(self.page_index) == 0: return
+        current = self.view_tabs.currentIndex() + 1
+
+        pages = dict()
+        for page in sorted(self.page_index.values(), key=lambda page: page != current):
+            path = self.pageImage(page)
+            paths = {name: self.filteredImage(path, name) for name in FILTERS}
+            if not all(os.path.exists(out_path) for out_path in paths.values()): pages[page] = (path, paths)
+        if len(pages) == 0: return
+
+        job = FilterJob(pages)
+        self.filter_job = job
+        return self.startJob(job, 'Filtering pages ...', aborted=lambda: self.filtersAborted(job),
+                             succeeded=lambda: self.receiveFilters(job))
+
+    def receiveFilters(self, job):
+        if self.filter_job is job: self.filter_job = None
+        self.refreshPage()
+
+    # a failed or cancelled job switches back to the page images, unless it was cancelled because another document
+    # was loaded (see clearPages)
+    def filtersAborted(self, job):
+        if self.filter_job is not job: return
+        self.filter_job = None
+        self.page_filter = None
+        self.filter_group.actions()[0].setChecked(True)
+        self.refreshPage()
+
+
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
+    app.setStyle('Fusion')
+    window = MainWindow()
+    window.show()
+    app.exec()
\ No newline at end of file
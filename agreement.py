@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+'''
+((1)) Signed CSV files
+'''
+# HAnnoI exports the annotations of one annotator as <document>_<sign>.csv; the sign names the annotator
+def annotatorName(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name.rsplit('_', 1)[-1] if '_' in name else name
+
+
+# parses a column of '[a, b, ...]' strings into an array with one row per entry (rows of empty entries are NaN)
+def parseLists(column, length):
+    values = np.full((len(column), length), np.nan)
+    column = column.to_numpy()
+    present = (column != '') & (column != '[]')
+    if present.any():
+        text = ' '.join(column[present]).replace('[', ' ').replace(']', ' ').replace(',', ' ')
+        values[present] = np.fromstring(text, sep=' ').reshape(-1, length)
+    return values
+
+
+# reads the CSV files of all annotators into one data frame (one row per box): annotator (position in paths), page,
+# index, box, anchor and all annotation layers (in the order they first appear; missing layers are empty)
+def readAnnotations(paths):
+    frames, layers = [], []
+    for annotator, path in enumerate(paths):
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        layers += [layer for layer in df.columns[6:] if layer not in layers]
+
+        frame = pd.DataFrame({'annotator': annotator,
+                              'page': df['Page'].astype(np.int64),
+                              'index': df['Index'].astype(np.int64),
+                              'source': df['Source']})
+        frame[['x', 'y', 'width', 'height']] = parseLists(df['Coordinates'], 4)
+        frame[['anchor_x', 'anchor_y']] = parseLists(df['Anchor'], 2)
+        for layer in df.columns[6:]:
+            frame[layer] = df[layer].to_numpy()
+        frames.append(frame)
+
+    frame = pd.concat(frames, ignore_index=True)
+    frame[layers] = frame[layers].fillna('')
+    return frame, layers
+
+
+'''
+((2)) Matching boxes
+'''
+# Boxes are matched annotator by annotator: the boxes of the first annotator start one group each, the boxes of every
+# further annotator are assigned to the groups (by their mean box) with the Hungarian algorithm, so that each group
+# gets at most one box per annotator; boxes without a match start new groups. Only boxes whose centers are close
+# enough to overlap at all are compared (k-d tree), and the candidate pairs are split into connected components:
+# components in which one side has a single box take their best pair, only the others go through the Hungarian
+# algorithm (each on its own).
+
+# returns the pairs (row, column) of a maximum IoU matching; rows, columns and ious are the candidate pairs
+def assignPairs(rows, columns, ious):
+    row_ids, row_positions = np.unique(rows, return_inverse=True)
+    column_ids, column_positions = np.unique(columns, return_inverse=True)
+    nodes = len(row_ids) + len(column_ids)
+    graph = coo_matrix((np.ones(len(rows)), (row_positions, len(row_ids) + column_positions)), shape=(nodes, nodes))
+    count, labels = connected_components(graph, directed=False)
+
+    components = labels[row_positions]
+    simple = (np.bincount(labels[:len(row_ids)], minlength=count) == 1) | \
+             (np.bincount(labels[len(row_ids):], minlength=count) == 1)
+
+    # best pair of every simple component
+    edges = np.flatnonzero(simple[components])
+    edges = edges[np.lexsort((-ious[edges], components[edges]))]
+    edges = edges[np.unique(components[edges], return_index=True)[1]]
+    matched_rows, matched_columns = [rows[edges]], [columns[edges]]
+
+    edges = np.flatnonzero(~simple[components])
+    edges = edges[np.argsort(components[edges], kind='stable')]
+    for component in np.split(edges, np.flatnonzero(np.diff(components[edges])) + 1):
+        if len(component) == 0: continue
+        component_rows, row_index = np.unique(rows[component], return_inverse=True)
+        component_columns, column_index = np.unique(columns[component], return_inverse=True)
+        weights = np.zeros((len(component_rows), len(component_columns)))
+        weights[row_index, column_index] = ious[component]
+
+        assigned_rows, assigned_columns = linear_sum_assignment(weights, maximize=True)
+        keep = weights[assigned_rows, assigned_columns] > 0
+        matched_rows.append(component_rows[assigned_rows[keep]])
+        matched_columns.append(component_columns[assigned_columns[keep]])
+    return np.concatenate(matched_rows), np.concatenate(matched_columns)
+
+
+# returns the pairs (i, j, IoU) of boxes a[i] and b[j] that overlap by at least threshold; pages are kept apart by
+# moving every page below the previous one
+def candidatePairs(a, a_pages, b, b_pages, threshold):
+    # boxes with an IoU of at least threshold have centers at most (1 - threshold) times the larger width (height)
+    # apart; y is scaled so that one (Chebyshev) distance covers both directions
+    max_width = max(a[:, 2].max(), b[:, 2].max(), 1e-9)
+    max_height = max(a[:, 3].max(), b[:, 3].max(), 1e-9)
+    reach = max_width * (1 - min(threshold, 1)) + 1e-6
+    page_height = max((a[:, 1] + a[:, 3]).max(), (b[:, 1] + b[:, 3]).max()) + 2 * max_height
+
+    def centers(boxes, pages):
+        y = boxes[:, 1] + boxes[:, 3] / 2 + pages * page_height
+        return np.column_stack([boxes[:, 0] + boxes[:, 2] / 2, y * max_width / max_height])
+
+    pairs = cKDTree(centers(a, a_pages)).sparse_distance_matrix(cKDTree(centers(b, b_pages)), reach, p=np.inf,
+                                                                output_type='ndarray')
+    i, j = pairs['i'].astype(np.int64), pairs['j'].astype(np.int64)
+
+    left = np.maximum(a[i, 0], b[j, 0])
+    top = np.maximum(a[i, 1], b[j, 1])
+    right = np.minimum(a[i, 0] + a[i, 2], b[j, 0] + b[j, 2])
+    bottom = np.minimum(a[i, 1] + a[i, 3], b[j, 1] + b[j, 3])
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    ious = intersection / np.maximum(a[i, 2] * a[i, 3] + b[j, 2] * b[j, 3] - intersection, 1e-9)
+
+    keep = ious >= threshold
+    return i[keep], j[keep], ious[keep]
+
+
+# returns the group of every box (row of frame) and the mean box and page of every group
+def matchBoxes(frame, threshold=0.5):
+    boxes = frame[['x', 'y', 'width', 'height']].to_numpy()
+    pages = frame['page'].to_numpy()
+    annotators = frame['annotator'].to_numpy()
+
+    groups = np.full(len(frame), -1, dtype=np.int64)
+    sums, counts, group_pages = np.empty((0, 4)), np.empty(0), np.empty(0, dtype=np.int64)
+
+    for annotator in np.unique(annotators):
+        rows = np.flatnonzero(annotators == annotator)
+        matched, targets = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if len(sums) > 0 and len(rows) > 0:
+            i, j, ious = candidatePairs(sums / counts[:, None], group_pages, boxes[rows], pages[rows], threshold)
+            if len(i) > 0: targets, matched = assignPairs(i, j, ious)
+
+        groups[rows[matched]] = targets
+        sums[targets] += boxes[rows[matched]]
+        counts[targets] += 1
+
+        new = np.setdiff1d(np.arange(len(rows)), matched)
+        groups[rows[new]] = len(sums) + np.arange(len(new))
+        sums = np.vstack([sums, boxes[rows[new]]])
+        counts = np.concatenate([counts, np.ones(len(new))])
+        group_pages = np.concatenate([group_pages, pages[rows[new]]])
+
+    return groups, sums / counts[:, None], group_pages
+
+
+'''
+((3)) Agreement
+'''
+# ratings: one row per group, one column per annotator, holding the code of the annotator's value (-1: no box)
+def ratingMatrix(frame, groups, group_count, annotator_count, layer):
+    codes, levels = pd.factorize(frame[layer])
+    ratings = np.full((group_count, annotator_count), -1, dtype=np.int64)
+    ratings[groups, frame['annotator'].to_numpy()] = codes
+    return ratings, np.asarray(levels)
+
+
+# percent agreement and Cohen's kappa of every pair of annotators, on the groups both of them boxed; one pass per
+# annotator: the level counts of annotator a on the groups each other annotator rated as well are one sparse product
+def pairwiseAgreement(ratings, level_count):
+    groups, annotators = ratings.shape
+    rated = ratings >= 0
+    rated_counts = rated.astype(np.float64)
+    both = rated_counts.T @ rated_counts
+
+    same = np.zeros((annotators, annotators))
+    level_counts = np.zeros((annotators, level_count, annotators))
+    for a in range(annotators):
+        same[a] = ((ratings == ratings[:, [a]]) & rated & rated[:, [a]]).sum(axis=0)
+        rows = np.flatnonzero(rated[:, a])
+        levels = coo_matrix((np.ones(len(rows)), (ratings[rows, a], rows)), shape=(level_count, groups)).tocsr()
+        level_counts[a] = levels @ rated_counts
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        agreement = same / both
+        expected = np.einsum('akb,bka->ab', level_counts, level_counts) / both ** 2
+        kappa = np.where(expected < 1, (agreement - expected) / (1 - expected), np.where(agreement == 1, 1.0, np.nan))
+
+    agreement[both == 0] = np.nan
+    kappa[both == 0] = np.nan
+    np.fill_diagonal(agreement, np.nan)
+    np.fill_diagonal(kappa, np.nan)
+    return agreement, kappa
+
+
+# Fleiss' kappa (for any number of ratings per group); groups rated by less than two annotators are left out
+def fleissKappa(ratings, level_count):
+    rated = ratings >= 0
+    n = rated.sum(axis=1)
+    keep = n >= 2
+    if not keep.any(): return np.nan, np.nan, 0
+
+    rows = np.nonzero(rated[keep])[0]
+    counts = np.bincount(rows * level_count + ratings[keep][rated[keep]],
+                         minlength=keep.sum() * level_count).reshape(-1, level_count)
+    n = n[keep]
+
+    observed = ((counts ** 2).sum(axis=1) - n) / (n * (n - 1))
+    shares = counts.sum(axis=0) / n.sum()
+    observed_mean, expected = observed.mean(), (shares ** 2).sum()
+    kappa = (observed_mean - expected) / (1 - expected) if expected < 1 else (1.0 if observed_mean == 1 else np.nan)
+    return kappa, observed_mean, int(keep.sum())
+
+
+def layerAgreement(ratings, levels):
+    agreement, kappa = pairwiseAgreement(ratings, len(levels))
+    fleiss, observed, groups = fleissKappa(ratings, len(levels))
+    return {'percent_agreement': np.nanmean(agreement) if not np.isnan(agreement).all() else np.nan,
+            'cohens_kappa': np.nanmean(kappa) if not np.isnan(kappa).all() else np.nan,
+            'fleiss_kappa': fleiss,
+            'fleiss_observed_agreement': observed,
+            'groups_rated_twice': groups,
+            'pairwise_agreement': agreement,
+            'pairwise_cohens_kappa': kappa}
+
+
+'''
+((4)) Consensus
+'''
+# one item per group that was boxed by at least min_votes annotators, with the mean box and anchor and the most
+# frequent value of every layer; items that not all annotators boxed identically (same values) are red, the others green
+def consensusFrame(frame, layers, groups, mean_boxes, group_pages, annotator_count, min_votes):
+    group_count = len(mean_boxes)
+    votes = np.bincount(groups, minlength=group_count)
+    unanimous = votes == annotator_count
+
+    values = dict()
+    for layer in layers:
+        ratings, levels = ratingMatrix(frame, groups, group_count, annotator_count, layer)
+        rated = ratings >= 0
+        counts = np.bincount(np.nonzero(rated)[0] * len(levels) + ratings[rated],
+                             minlength=group_count * len(levels)).reshape(group_count, len(levels))
+        values[layer] = levels[counts.argmax(axis=1)] if len(levels) > 0 else np.full(group_count, '')
+        unanimous &= counts.max(axis=1, initial=0) == votes
+
+    anchors = np.full((group_count, 2), np.nan)
+    anchored = ~np.isnan(frame['anchor_x'].to_numpy())
+    anchor_counts = np.bincount(groups[anchored], minlength=group_count)
+    for axis, column in enumerate(['anchor_x', 'anchor_y']):
+        sums = np.bincount(groups[anchored], weights=frame[column].to_numpy()[anchored], minlength=group_count)
+        anchors[anchor_counts > 0, axis] = sums[anchor_counts > 0] / anchor_counts[anchor_counts > 0]
+
+    # items are numbered page by page, in the mean order the annotators gave them
+    order_key = np.bincount(groups, weights=frame['index'].to_numpy(), minlength=group_count) / np.maximum(votes, 1)
+    keep = np.flatnonzero(votes >= min_votes)
+    keep = keep[np.lexsort((order_key[keep], group_pages[keep]))]
+
+    boxes = np.round(mean_boxes[keep], 2)
+    consensus = pd.DataFrame({
+        'Index': np.arange(1, len(keep) + 1),
+        'Page': group_pages[keep],
+        'Coordinates': [str(box) for box in boxes.tolist()],
+        'Color': np.where(unanimous[keep], 'green', 'red'),
+        'Anchor': [str(anchor) if not np.isnan(anchor[0]) else '' for anchor in np.round(anchors[keep], 2).tolist()],
+        'Source': frame['source'].mode().iloc[0]})
+    for layer in layers:
+        consensus[layer] = values[layer][keep]
+    return consensus
+
+
+'''
+((5)) Command line
+'''
+def jsonValue(value):
+    if isinstance(value, np.ndarray): return [jsonValue(v) for v in value.tolist()]
+    if isinstance(value, list): return [jsonValue(v) for v in value]
+    if isinstance(value, (float, np.floating)): return None if np.isnan(value) else round(float(value), 4)
+    if isinstance(value, np.integer): return int(value)
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the signed CSV files (<document>_<sign>.csv) of several '
+                                                 'annotators of one document: match their boxes, compute the '
+                                                 'agreement of every annotation layer and write a consensus CSV file.')
+    parser.add_argument('csv', nargs='+', help='signed CSV files of the same document')
+    parser.add_argument('--iou', type=float, default=0.5, help='minimum overlap (IoU) of boxes of the same letter')
+    parser.add_argument('--min-votes', type=int, help='annotators that must have boxed a letter for the consensus '
+                                                      '(default: more than half)')
+    parser.add_argument('--consensus', help='consensus CSV file (default: <document>_consensus.csv next to the first '
+                                            'CSV file)')
+    parser.add_argument('--report', help='JSON file for all statistics, including the pairwise ones')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    names = [annotatorName(path) for path in args.csv]
+    if len(set(names)) < len(names): names = [os.path.splitext(os.path.basename(path))[0] for path in args.csv]
+    frame, layers = readAnnotations(args.csv)
+    if frame['source'].nunique() > 1:
+        print('warning: the files annotate different documents: ' + ', '.join(frame['source'].unique()))
+
+    groups, mean_boxes, group_pages = matchBoxes(frame, args.iou)
+    annotators, group_count = len(args.csv), len(mean_boxes)
+    boxed = np.zeros((group_count, annotators), dtype=bool)
+    boxed[groups, frame['annotator'].to_numpy()] = True
+
+    both = boxed.T.astype(np.int64) @ boxed.astype(np.int64)
+    box_counts = np.diag(both)
+    box_f1 = 2 * both / np.maximum(box_counts[:, None] + box_counts[None, :], 1)
+    np.fill_diagonal(box_f1, np.nan)
+
+    report = {'annotators': names,
+              'boxes': box_counts,
+              'groups': group_count,
+              'groups_boxed_by_all': int(boxed.all(axis=1).sum()),
+              'box_f1': np.nanmean(box_f1) if annotators > 1 else np.nan,
+              'pairwise_box_f1': box_f1,
+              'layers': dict()}
+
+    print('%d annotators, %d boxes, %d letters (%d boxed by all), box F1 %.3f' % (
+        annotators, len(frame), group_count, report['groups_boxed_by_all'], report['box_f1']))
+    for layer in layers:
+        ratings, levels = ratingMatrix(frame, groups, group_count, annotators, layer)
+        report['layers'][layer] = layerAgreement(ratings, levels)
+        statistics = report['layers'][layer]
+        print('%-20s agreement %.3f   Cohen\'s kappa %.3f   Fleiss\' kappa %.3f' % (
+            layer, statistics['percent_agreement'], statistics['cohens_kappa'], statistics['fleiss_kappa']))
+
+    min_votes = args.min_votes if args.min_votes is not None else annotators // 2 + 1
+    consensus = consensusFrame(frame, layers, groups, mean_boxes, group_pages, annotators, min_votes)
+    consensus_path = args.consensus
+    if consensus_path is None:
+        document = os.path.splitext(os.path.basename(args.csv[0]))[0].rsplit('_', 1)[0]
+        consensus_path = os.path.join(os.path.dirname(args.csv[0]), document + '_consensus.csv')
+    consensus.to_csv(consensus_path, index=False)
+    print('%d items (boxed by at least %d annotators) written to %s' % (len(consensus), min_votes, consensus_path))
+
+    if args.report is not None:
+        with open(args.report, 'w') as file:
+            json.dump({key: jsonValue(value) if key != 'layers' else
+                       {layer: {k: jsonValue(v) for k, v in statistics.items()} for layer, statistics in value.items()}
+                       for key, value in report.items()}, file, indent=2)
+        print('statistics written to ' + args.report)
+
+    print('%.1f s' % (time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
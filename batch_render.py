@@ -0,0 +1,206 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+import pandas as pd
+import fitz
+from PIL import Image
+
+from project_store import parseList
+
+'''
+((1)) Tasks
+'''
+# A task renders the crops of a few pages of one document; large documents are split into several tasks, so that the
+# pages of one document are spread over all workers as well. Tasks only carry file paths and coordinates, the page
+# images are read by the workers themselves.
+
+# name of a screenshot (same as in HAnnoI)
+def cropName(prefix, index):
+    return '%s_%d.png' % (prefix, index)
+
+
+# pixel box of an item (same rounding as in HAnnoI)
+def cropBox(x, y, width, height):
+    return int(x), int(y), int(x) + int(width), int(y) + int(height)
+
+
+# returns the document (PDF or image) of a CSV file: the "Source" next to the CSV file, unless it is given
+def findDocument(csv_path, df, document=None):
+    if document is not None: return document
+    return os.path.join(os.path.dirname(os.path.abspath(csv_path)), df['Source'][0])
+
+
+# splits the items of one CSV file into tasks of at most pages_per_task pages each
+def documentTasks(csv_path, document, output, pages_per_task):
+    df = pd.read_csv(csv_path)
+    document = findDocument(csv_path, df, document)
+    prefix = os.path.basename(document)[0:-4]  # <- as in HAnnoI, where the name of the screenshots comes from
+
+    pages = dict()
+    for index, page, coords in zip(df['Index'], df['Page'], df['Coordinates']):
+        pages.setdefault(int(page), []).append((int(index), *parseList(coords)))
+
+    numbers = sorted(pages)
+    tasks = []
+    for start in range(0, len(numbers), pages_per_task):
+        chunk = numbers[start:start + pages_per_task]
+        tasks.append({'id': '%s:%d-%d' % (os.path.abspath(document), chunk[0], chunk[-1]),
+                      'document': document,
+                      'folder': os.path.join(output, prefix, 'Screenshots'),
+                      'prefix': prefix,
+                      'pages': {page: pages[page] for page in chunk}})
+    return tasks
+
+
+'''
+((2)) Workers
+'''
+# every worker keeps the last opened document, as consecutive tasks mostly belong to the same document; only one
+# document is open per worker at a time, which (together with maxtasksperchild) keeps the memory per worker bounded
+worker_document = {'path': None, 'file': None}
+
+
+def openDocument(path):
+    if worker_document['path'] != path:
+        if worker_document['file'] is not None: worker_document['file'].close()
+        worker_document['path'], worker_document['file'] = path, fitz.open(path)
+    return worker_document['file']
+
+
+# returns the image of page (1-based) like HAnnoI shows it: the first image of a PDF page, or the image itself
+def pageImage(path, page):
+    if not path.lower().endswith('.pdf'):
+        return Image.open(path)
+    pdf_file = openDocument(path)
+    xref = pdf_file.load_page(page - 1).get_images(full=True)[0][0]
+    return Image.open(io.BytesIO(pdf_file.extract_image(xref)['image']))
+
+
+def runTask(task):
+    start = time.perf_counter()
+    result = {'id': task['id'], 'document': task['document'], 'pages': len(task['pages']), 'crops': 0,
+              'error': None}
+    try:
+        os.makedirs(task['folder'], exist_ok=True)
+        for page, crops in task['pages'].items():
+            with pageImage(task['document'], page) as image:
+                if image.mode not in ('RGB', 'RGBA', 'L'): image = image.convert('RGB')
+                for index, x, y, width, height in crops:
+                    path = os.path.join(task['folder'], cropName(task['prefix'], index))
+                    image.crop(cropBox(x, y, width, height)).save(path + '.partial', format='PNG')
+                    os.replace(path + '.partial', path)  # <- an interrupted run never leaves half-written crops
+                    result['crops'] += 1
+    except Exception as error:
+        result['error'] = '%s: %s' % (type(error).__name__, error)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+'''
+((3)) Runner
+'''
+# returns the ids of the tasks that were finished by earlier runs (one JSON record per line)
+def finishedTasks(progress_path):
+    finished = set()
+    if not os.path.exists(progress_path): return finished
+    with open(progress_path, encoding='utf-8') as file:
+        for line in file:
+            try: record = json.loads(line)
+            except ValueError: continue  # <- last line of an interrupted run
+            if record['error'] is None: finished.add(record['id'])
+    return finished
+
+
+# reads CSV files (or CSV,PDF pairs) from the command line and from list files
+def readInputs(args):
+    inputs = list(args.csv)
+    if args.list is not None:
+        with open(args.list, encoding='utf-8') as file:
+            inputs += [line.strip() for line in file if line.strip() != '' and not line.startswith('#')]
+
+    pairs = []
+    for entry in inputs:
+        csv_path, _, document = entry.partition(',')
+        pairs.append((csv_path.strip(), document.strip() or None))
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the crops (screenshots) of many annotated documents with a '
+                                                 'pool of worker processes.')
+    parser.add_argument('csv', nargs='*', help='CSV files, or CSV,PDF pairs if the PDF is not next to the CSV file')
+    parser.add_argument('--list', help='text file with one CSV file (or CSV,PDF pair) per line')
+    parser.add_argument('--output', default='Annotated', help='output folder (crops go to <output>/<document>/'
+                                                              'Screenshots, like in HAnnoI)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--pages-per-task', type=int, default=10, help='pages rendered by one task')
+    parser.add_argument('--max-tasks-per-child', type=int, default=50,
+                        help='workers are replaced after this many tasks (bounds memory growth)')
+    parser.add_argument('--restart', action='store_true', help='ignore the progress of earlier runs')
+    args = parser.parse_args()
+
+    pairs = readInputs(args)
+    if len(pairs) == 0: parser.error('no CSV files given')
+
+    os.makedirs(args.output, exist_ok=True)
+    progress_path = os.path.join(args.output, 'batch_progress.jsonl')
+    summary_path = os.path.join(args.output, 'batch_summary.json')
+    if args.restart and os.path.exists(progress_path): os.remove(progress_path)
+
+    tasks, failures = [], []
+    for csv_path, document in pairs:
+        try: tasks += documentTasks(csv_path, document, args.output, args.pages_per_task)
+        except Exception as error:
+            failures.append({'id': csv_path, 'error': '%s: %s' % (type(error).__name__, error)})
+
+    finished = finishedTasks(progress_path)
+    skipped = len([task for task in tasks if task['id'] in finished])
+    tasks = [task for task in tasks if task['id'] not in finished]
+
+    print('%d documents, %d tasks (%d finished earlier), %d workers' % (len(pairs), len(tasks) + skipped, skipped,
+                                                                      args.workers), flush=True)
+
+    start = time.perf_counter()
+    totals = {'pages': 0, 'crops': 0, 'tasks': 0}
+    done = 0
+    with open(progress_path, 'a', encoding='utf-8') as progress, \
+            multiprocessing.Pool(args.workers, maxtasksperchild=args.max_tasks_per_child) as pool:
+        for result in pool.imap_unordered(runTask, tasks):
+            progress.write(json.dumps(result) + '\n')
+            progress.flush()
+            done += 1
+
+            if result['error'] is not None:
+                failures.append({'id': result['id'], 'error': result['error']})
+            else:
+                totals['tasks'] += 1
+                totals['pages'] += result['pages']
+                totals['crops'] += result['crops']
+            print('%6d/%d tasks   %8d crops   %s' % (done, len(tasks), totals['crops'], result['id']), flush=True)
+
+    seconds = time.perf_counter() - start
+    summary = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'documents': len(pairs),
+               'workers': args.workers,
+               'tasks': totals['tasks'],
+               'tasks_finished_earlier': skipped,
+               'pages': totals['pages'],
+               'crops': totals['crops'],
+               'seconds': round(seconds, 2),
+               'crops_per_second': round(totals['crops'] / seconds, 1) if seconds > 0 else None,
+               'failures': failures}
+    with open(summary_path, 'w') as file:
+        json.dump(summary, file, indent=2)
+
+    print('%d pages, %d crops in %.1f s (%s crops/s); %d failures; summary written to %s' % (
+        summary['pages'], summary['crops'], seconds, summary['crops_per_second'], len(failures), summary_path))
+    sys.exit(1 if len(failures) > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+import sys
+import os
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import fitz
+from PIL import Image
+
+# the benchmarks never open a window on screen; this has to be set before Qt is imported
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6.QtWidgets import QApplication
+
+'''
+((1)) Synthetic documents
+'''
+# name: (pages, page width, page height, items per page); 'test_file' uses the shipped test_file.pdf/test_file.csv
+TIERS = {
+    'test_file': None,
+    'small': (10, 1748, 2480, 50),
+    'medium': (50, 1748, 2480, 200),
+    'large': (200, 1748, 2480, 500),
+}
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+# returns the boxes of one synthetic page as a list of [x, y, width, height]; boxes are laid out line by line like
+# letters in a handwritten text, so that they can also be used to test proposals, anchors and reading order
+def syntheticBoxes(width, height, items, seed):
+    rng = np.random.default_rng(seed)
+    per_line = max(1, int(np.ceil(np.sqrt(items * width / height))))
+    lines = int(np.ceil(items / per_line))
+    step_x = width / (per_line + 1)
+    step_y = height / (lines + 1)
+
+    boxes = []
+    for i in range(items):
+        line, col = divmod(i, per_line)
+        w = int(rng.integers(14, max(15, min(40, int(step_x * 0.8)))))
+        h = int(rng.integers(20, max(21, min(45, int(step_y * 0.8)))))
+        x = round(step_x * (col + 1) - w / 2 + rng.uniform(-2, 2), 2)
+        y = round(step_y * (line + 1) - h + rng.uniform(-2, 2), 2)
+        boxes.append([x, y, w, h])
+    return boxes
+
+
+# draws dark blobs (our "letters") on a light, slightly noisy background and returns the page as JPEG bytes
+def syntheticPage(width, height, boxes, seed):
+    rng = np.random.default_rng(seed)
+    page = rng.normal(235, 6, (height, width)).clip(0, 255).astype(np.uint8)
+
+    for x, y, w, h in boxes:
+        x0, y0 = max(0, int(x) + 2), max(0, int(y) + 2)
+        x1, y1 = min(width, int(x + w) - 2), min(height, int(y + h) - 2)
+        page[y0:y1, x0:x1] = rng.integers(20, 70)
+
+    buffer = io.BytesIO()
+    Image.fromarray(page).save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+# writes <name>.pdf (one image per page, as expected by HAnnoI) and <name>.csv (one row per item) to folder
+def makeDocument(folder, name, pages, width, height, items):
+    pdf_file = fitz.open()
+    rows = []
+    index = 1
+
+    for p in range(pages):
+        boxes = syntheticBoxes(width, height, items, seed=p)
+        page = pdf_file.new_page(width=width * 72 / 300, height=height * 72 / 300)
+        page.insert_image(page.rect, stream=syntheticPage(width, height, boxes, seed=p))
+
+        for i, (x, y, w, h) in enumerate(boxes):
+            rows.append({'Index': index,
+                         'Page': p + 1,
+                         'Coordinates': str([x, y, float(w), float(h)]),
+                         'Color': ['red', 'green', 'blue'][i % 3],
+                         'Anchor': str([round(x + w / 2, 2), round(y + h, 2)]) if i % 2 else None,
+                         'Source': name + '.pdf',
+                         'Letter': LETTERS[i % len(LETTERS)],
+                         'Word': 'w' + str(i % 97)})
+            index += 1
+
+    pdf_file.save(os.path.join(folder, name + '.pdf'))
+    pd.DataFrame(rows).to_csv(os.path.join(folder, name + '.csv'), index=False)
+
+    return os.path.join(folder, name + '.pdf'), os.path.join(folder, name + '.csv')
+
+
+'''
+((2)) Timed operations
+'''
+# runs function once and returns the elapsed time in seconds (including all events the call has posted)
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    QApplication.processEvents()
+    return time.perf_counter() - start
+
+
+def summarize(samples):
+    return {'n': len(samples),
+            'min': min(samples),
+            'median': statistics.median(samples),
+            'mean': statistics.mean(samples),
+            'max': max(samples),
+            'total': sum(samples)}
+
+
+# runs all timed operations on one document; the window is reused between repeats like in a real session
+def runTier(window, pdf_path, csv_path, repeat, max_selections):
+    samples = {key: [] for key in ['pdfImport', 'csvImport', 'changePage', 'changeKey', 'indexNavigation',
+                                   'exportAnnotations', 'screenshotDocument']}
+
+    for r in range(repeat):
+        samples['pdfImport'].append(timed(window.loadPdf, pdf_path))
+        samples['csvImport'].append(timed(window.loadCsv, csv_path))
+
+        # page switching: forth and back through all pages
+        pages = window.view_tabs.count()
+        for i in list(range(1, pages)) + list(reversed(range(pages - 1))):
+            samples['changePage'].append(timed(window.view_tabs.setCurrentIndex, i))
+
+        # selecting items (every selection also deselects the previous item)
+        items = window.page_items[1][:max_selections]
+        for item in items:
+            window.scene.clearSelection()
+            samples['changeKey'].append(timed(item.setSelected, True))
+
+        # index navigation (Ctrl+Return) through the items of the first page
+        window.scene.clearSelection()
+        if len(items) > 0:
+            first = [key for key, val in window.item_index.items() if val == 1][0]
+            first.setSelected(True)
+            for i in range(len(items) - 1):
+                samples['indexNavigation'].append(timed(window.selectNextItem))
+        window.scene.clearSelection()
+
+        # export and rendering run as background jobs; the timings include waiting for them
+        samples['exportAnnotations'].append(timed(lambda: window.writeAnnotations('bench').wait()))
+        samples['screenshotDocument'].append(timed(lambda: window.screenshotDocument().wait()))
+
+    return {key: summarize(val) for key, val in samples.items() if len(val) > 0}
+
+
+'''
+((3)) Results
+'''
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+# prints a table of median timings of two result files and returns the number of regressions beyond threshold
+def compareResults(old_path, new_path, threshold):
+    with open(old_path) as file: old = json.load(file)
+    with open(new_path) as file: new = json.load(file)
+
+    print('%-10s %-20s %12s %12s %8s' % ('Tier', 'Operation', 'Old (ms)', 'New (ms)', 'Ratio'))
+    regressions = 0
+    for tier in new['tiers']:
+        if tier not in old['tiers']: continue
+        for op, result in new['tiers'][tier]['results'].items():
+            if op not in old['tiers'][tier]['results']: continue
+            old_median = old['tiers'][tier]['results'][op]['median']
+            ratio = result['median'] / old_median if old_median > 0 else float('inf')
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  <- slower'
+                regressions += 1
+            elif ratio < 1 - threshold:
+                flag = '  <- faster'
+            print('%-10s %-20s %12.2f %12.2f %8.2f%s' % (tier, op, old_median * 1000, result['median'] * 1000,
+                                                           ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the main HAnnoI actions on synthetic documents.')
+    parser.add_argument('--tiers', nargs='+', default=['test_file', 'small', 'medium'],
+                        help='tiers to run (%s or custom)' % ', '.join(TIERS))
+    parser.add_argument('--pages', type=int, default=20, help='page count of the custom tier')
+    parser.add_argument('--page-size', default='1748x2480', help='page size in pixels of the custom tier (WxH)')
+    parser.add_argument('--items', type=int, default=100, help='items per page of the custom tier')
+    parser.add_argument('--repeat', type=int, default=3, help='how often each tier is run')
+    parser.add_argument('--max-selections', type=int, default=100, help='items selected per run for changeKey')
+    parser.add_argument('--output', default=None, help='JSON result file (default: bench_results/<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative change reported by --compare')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compareResults(args.compare[0], args.compare[1], args.threshold) > 0 else 0)
+
+    repo = os.path.dirname(os.path.abspath(__file__))
+    commit = gitCommit()
+    output = os.path.abspath(args.output or os.path.join(repo, 'bench_results', commit + '.json'))
+
+    # HAnnoI writes to temp/ and Annotated/ relative to the working directory, so everything runs in a scratch folder
+    work_dir = tempfile.mkdtemp(prefix='hannoi_bench_')
+    os.chdir(work_dir)
+    sys.path.insert(0, repo)
+
+    app = QApplication(sys.argv)
+    from HAnnoI import MainWindow
+    window = MainWindow()
+    window.show()
+
+    results = {'meta': {'commit': commit,
+                        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'qt_platform': os.environ['QT_QPA_PLATFORM'],
+                        'repeat': args.repeat},
+               'tiers': dict()}
+
+    try:
+        for tier in args.tiers:
+            if tier == 'test_file':
+                shutil.copy(os.path.join(repo, 'test_file.pdf'), work_dir)
+                shutil.copy(os.path.join(repo, 'test_file.csv'), work_dir)
+                pdf_path, csv_path = os.path.join(work_dir, 'test_file.pdf'), os.path.join(work_dir, 'test_file.csv')
+                params = {'source': 'test_file.pdf'}
+            else:
+                if tier == 'custom':
+                    width, height = [int(v) for v in args.page_size.lower().split('x')]
+                    params = (args.pages, width, height, args.items)
+                elif tier in TIERS:
+                    params = TIERS[tier]
+                else:
+                    parser.error('unknown tier: ' + tier)
+                pdf_path, csv_path = makeDocument(work_dir, 'bench_' + tier, *params)
+                params = dict(zip(['pages', 'width', 'height', 'items_per_page'], params))
+
+            print('Running tier %s ...' % tier, flush=True)
+            results['tiers'][tier] = {'params': params,
+                                      'results': runTier(window, Path(pdf_path).as_posix(),
+                                                         Path(csv_path).as_posix(), args.repeat,
+                                                         args.max_selections)}
+            for op, result in results['tiers'][tier]['results'].items():
+                print('    %-20s median %10.2f ms (n = %d)' % (op, result['median'] * 1000, result['n']))
+    finally:
+        window.close()
+        os.chdir(repo)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print('Results written to ' + output)
+
+
+if __name__ == '__main__':
+    main()
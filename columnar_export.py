@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import shutil
+import argparse
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+from agreement import parseLists
+from corpus_index import csvFiles
+from project_store import ProjectStore, EXTENSION
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+'''
+((1)) Columns
+'''
+# The columnar dataset holds the items of any number of CSV files and projects in one folder, partitioned by document
+# and page (<folder>/Source=<document>/Page=<page>/part-<n>.parquet, the "hive" layout that pyarrow and other Parquet
+# readers understand), so that an analysis reads only the partitions and columns it needs. Coordinates and anchors are
+# typed numeric columns instead of '[x, y, w, h]' strings. Color and all annotation layers are stored as codes of
+# their levels (-1 or null for no value); the levels are the same in all partitions and listed in
+# <folder>/_dataset.json. Without pyarrow, every partition is a NumPy .npz file with one array per column instead.
+NUMERIC_COLUMNS = {'index': 'int64', 'x': 'float64', 'y': 'float64', 'width': 'float64', 'height': 'float64',
+                   'anchor_x': 'float64', 'anchor_y': 'float64'}
+
+# name of the file with the columns and levels of a dataset
+METADATA = '_dataset.json'
+
+
+# levels of the coded columns, collected while the dataset is written; levels are only ever appended, so the codes of
+# partitions that were already written stay valid
+class Levels:
+    def __init__(self):
+        self.levels = dict()  # <- column: list of levels
+        self.codes = dict()  # <- column: {level: code}
+
+    # returns the codes (int32, -1 for '') of an array of strings
+    def encode(self, column, values):
+        codes = self.codes.setdefault(column, dict())
+        levels = self.levels.setdefault(column, [])
+        uniques, inverse = np.unique(values, return_inverse=True)
+        for value in uniques:
+            if value != '' and value not in codes:
+                codes[value] = len(levels)
+                levels.append(value)
+        table = np.array([codes.get(value, -1) for value in uniques], dtype=np.int32)
+        return table[inverse.reshape(-1)] if len(values) > 0 else np.zeros(0, dtype=np.int32)
+
+
+# converts a data frame in the CSV export format (all columns strings) into typed columns, coded columns and the
+# partition keys; origin names the CSV file or project the items come from
+def typedColumns(df, levels, origin):
+    columns = {'index': df['Index'].astype(np.int64).to_numpy()}
+    box = parseLists(df['Coordinates'], 4)
+    anchor = parseLists(df['Anchor'], 2)
+    for position, name in enumerate(['x', 'y', 'width', 'height']):
+        columns[name] = box[:, position]
+    columns['anchor_x'], columns['anchor_y'] = anchor[:, 0], anchor[:, 1]
+
+    coded = ['color'] + list(df.columns[6:])
+    columns['color'] = levels.encode('color', df['Color'].to_numpy())
+    for layer in df.columns[6:]:
+        columns[layer] = levels.encode(layer, df[layer].to_numpy())
+    columns['origin'] = levels.encode('origin', np.full(len(df), origin))
+    coded.append('origin')
+
+    return columns, coded, df['Source'].to_numpy(), df['Page'].astype(np.int64).to_numpy()
+
+
+'''
+((2)) Writing
+'''
+def partitionFolder(folder, source, page):
+    return os.path.join(folder, 'Source=' + quote(source, safe=''), 'Page=%d' % page)
+
+
+# writes one partition; coded columns get the levels known so far as their dictionary (Parquet)
+def writePartition(path, columns, coded, levels, file_format):
+    if file_format == 'parquet':
+        arrays = dict()
+        for name, values in columns.items():
+            if name in coded:
+                arrays[name] = pyarrow.DictionaryArray.from_arrays(
+                    pyarrow.array(values, type=pyarrow.int32(), mask=values < 0),
+                    pyarrow.array(levels.levels.get(name, []), type=pyarrow.string()))
+            else: arrays[name] = pyarrow.array(values)
+        pyarrow.parquet.write_table(pyarrow.table(arrays), path + '.parquet')
+    else:
+        np.savez(path + '.npz', **{quote(name, safe=''): values for name, values in columns.items()})
+
+
+class DatasetWriter:
+    def __init__(self, folder, file_format=None):
+        if file_format is None: file_format = 'parquet' if pyarrow is not None else 'numpy'
+        if file_format == 'parquet' and pyarrow is None: raise ValueError('writing Parquet files needs pyarrow')
+
+        self.folder = folder
+        self.stage = os.path.normpath(folder) + '.partial'  # <- moved into place by close()
+        self.file_format = file_format
+        self.levels = Levels()
+        self.columns = dict(NUMERIC_COLUMNS)
+        self.parts = 0  # <- each data frame gets its own part number, so partitions of several inputs do not collide
+        self.partitions = set()
+        self.items = 0
+
+        if os.path.exists(self.stage): shutil.rmtree(self.stage)
+        os.makedirs(self.stage)
+
+    # adds the items of a data frame in the CSV export format (one document at a time keeps the memory flat)
+    def addFrame(self, df, origin):
+        if len(df) == 0: return
+        df = df.fillna('').astype(str)
+        columns, coded, sources, pages = typedColumns(df, self.levels, origin)
+        for name in coded:
+            self.columns.setdefault(name, 'category')
+
+        order = np.lexsort((columns['index'], pages, sources))
+        sources, pages = sources[order], pages[order]
+        columns = {name: values[order] for name, values in columns.items()}
+        starts = np.flatnonzero(np.r_[True, (sources[1:] != sources[:-1]) | (pages[1:] != pages[:-1])])
+        ends = np.r_[starts[1:], len(order)]
+
+        for start, end in zip(starts, ends):
+            folder = partitionFolder(self.stage, sources[start], pages[start])
+            if not os.path.exists(folder): os.makedirs(folder)
+            writePartition(os.path.join(folder, 'part-%d' % self.parts),
+                           {name: values[start:end] for name, values in columns.items()}, coded, self.levels,
+                           self.file_format)
+            self.partitions.add((sources[start], int(pages[start])))
+
+        self.parts += 1
+        self.items += len(order)
+
+    # writes the metadata and replaces the dataset folder with the finished dataset
+    def close(self):
+        with open(os.path.join(self.stage, METADATA), 'w') as file:
+            json.dump({'format': self.file_format,
+                       'partitioning': ['Source', 'Page'],
+                       'columns': self.columns,
+                       'levels': self.levels.levels,
+                       'items': self.items,
+                       'partitions': len(self.partitions)}, file, indent=2)
+        if os.path.exists(self.folder): shutil.rmtree(self.folder)
+        os.replace(self.stage, self.folder)
+
+    def abort(self):
+        shutil.rmtree(self.stage, ignore_errors=True)
+
+
+# writes the CSV files and projects in paths (folders are searched for CSV files) to a dataset in folder; progress is
+# called with the name of every input
+def exportDataset(paths, folder, file_format=None, progress=None):
+    writer = DatasetWriter(folder, file_format)
+    try:
+        for path in paths:
+            if path.endswith(EXTENSION):
+                store = ProjectStore(path)
+                try:
+                    for document, document_path, name in store.documents():
+                        if progress is not None: progress('%s: %s' % (path, name))
+                        writer.addFrame(store.frame(document), '%s:%s' % (os.path.basename(path), name))
+                finally: store.close()
+                continue
+
+            for csv_path in csvFiles(path) if os.path.isdir(path) else [path]:
+                if progress is not None: progress(csv_path)
+                writer.addFrame(pd.read_csv(csv_path, dtype=str, keep_default_na=False), os.path.basename(csv_path))
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    return writer
+
+
+'''
+((3)) Reading
+'''
+# reads a dataset into one data frame with the columns Source, Page and the given columns (default: all); sources and
+# pages restrict the partitions that are read; coded columns become pandas categoricals with the levels of the dataset
+def readDataset(folder, columns=None, sources=None, pages=None):
+    with open(os.path.join(folder, METADATA)) as file:
+        metadata = json.load(file)
+    if columns is None: columns = list(metadata['columns'])
+    extension = '.parquet' if metadata['format'] == 'parquet' else '.npz'
+
+    arrays = {name: [] for name in ['Source', 'Page'] + columns}
+    for source_folder in sorted(os.listdir(folder)):
+        if not source_folder.startswith('Source='): continue
+        source = unquote(source_folder[len('Source='):])
+        if sources is not None and source not in sources: continue
+
+        for page_folder in sorted(os.listdir(os.path.join(folder, source_folder)), key=lambda name: int(name[5:])):
+            page = int(page_folder[len('Page='):])
+            if pages is not None and page not in pages: continue
+
+            partition = os.path.join(folder, source_folder, page_folder)
+            for file_name in sorted(os.listdir(partition)):
+                if not file_name.endswith(extension): continue
+                path = os.path.join(partition, file_name)
+                if metadata['format'] == 'parquet':
+                    table = pyarrow.parquet.read_table(path, columns=columns)
+                    for name in columns:
+                        values = table.column(name).to_pandas()
+                        arrays[name].append(values.cat.codes.to_numpy() if metadata['columns'][name] == 'category'
+                                            else values.to_numpy())
+                    length = table.num_rows
+                else:
+                    with np.load(path) as partition_arrays:
+                        for name in columns:
+                            arrays[name].append(partition_arrays[quote(name, safe='')])
+                        length = len(arrays[columns[0]][-1]) if len(columns) > 0 else len(partition_arrays['index'])
+                arrays['Source'].append(np.full(length, source, dtype=object))
+                arrays['Page'].append(np.full(length, page, dtype=np.int64))
+
+    frame = dict()
+    for name, parts in arrays.items():
+        dtype = metadata['columns'].get(name, object if name == 'Source' else np.int64)
+        if dtype == 'category': dtype = np.int32
+        values = np.concatenate(parts) if len(parts) > 0 else np.zeros(0, dtype=dtype)
+        if dtype == np.int32: values = pd.Categorical.from_codes(values, metadata['levels'].get(name, []))
+        frame[name] = values
+    return pd.DataFrame(frame)
+
+
+'''
+((4)) Command line
+'''
+def main():
+    parser = argparse.ArgumentParser(description='Merge CSV files and projects into one columnar dataset, '
+                                                 'partitioned by document (Source) and page.')
+    parser.add_argument('input', nargs='+', help='CSV files, folders with CSV files (e.g. Annotated) or projects '
+                                                 '(%s)' % EXTENSION)
+    parser.add_argument('--output', default='Dataset', help='dataset folder (replaced if it exists)')
+    parser.add_argument('--format', choices=['parquet', 'numpy'], help='file format of the partitions (default: '
+                                                                        'parquet if pyarrow is installed)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try: writer = exportDataset(args.input, args.output, args.format, progress=lambda name: print('reading ' + name))
+    except ValueError as error: parser.error(str(error))
+    print('%d items in %d partitions (%s) written to %s (%.1f s)' % (
+        writer.items, len(writer.partitions), writer.file_format, args.output, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
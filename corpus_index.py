@@ -0,0 +1,316 @@
+import os
+import time
+import shlex
+import hashlib
+import sqlite3
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from agreement import parseLists
+from batch_render import cropName
+
+'''
+((1)) Schema
+'''
+# The corpus index is an inverted index of all exported CSV files (Annotated/<document>/*.csv): for every annotation
+# layer, value and file it stores the rows of the items that have this value (a posting list: sorted 32 bit integers in
+# a blob), so that a query like 'Letter=s Word=w*' reads a few hundred blobs and intersects them with numpy instead of
+# reading every file. Empty values are not indexed. Files are only read again when they changed (size and modification
+# time, then content hash), so updating the index after a few exports is quick.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    prefix TEXT NOT NULL,
+    source TEXT NOT NULL,
+    modified REAL NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    file INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    row INTEGER NOT NULL,
+    item_index INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    x REAL,
+    y REAL,
+    width REAL,
+    height REAL,
+    PRIMARY KEY (file, row)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    layer TEXT NOT NULL,
+    value TEXT NOT NULL,
+    file INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    rows BLOB NOT NULL,
+    PRIMARY KEY (layer, value, file)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_by_file ON postings (file);
+'''
+
+# default location of the index (next to the exported documents)
+INDEX_PATH = os.path.join('Annotated', 'corpus_index.db')
+
+# rows are stored as little endian 32 bit integers
+ROW_TYPE = np.dtype('<u4')
+
+
+# content hash of a file; decides whether a file whose modification time changed has to be read again
+def fileHash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# the exported CSV files below folder (any depth, so both 'Annotated' and 'Annotated/<document>' work)
+def csvFiles(folder):
+    paths = []
+    for root, folders, files in os.walk(folder):
+        folders[:] = sorted(name for name in folders if name != 'Screenshots')
+        paths += [os.path.join(root, name) for name in sorted(files) if name.endswith('.csv')]
+    return [os.path.abspath(path) for path in paths]
+
+
+'''
+((2)) Queries
+'''
+# A query is a list of conditions 'Layer=value' that all have to hold; 'Layer=value*' matches values that start with
+# value ('Layer=*' any value). Values with spaces are quoted: Word="in the".
+
+# returns a list of (layer, value, prefix) of a query string; raises ValueError for malformed conditions
+def parseQuery(text):
+    try: terms = shlex.split(text)
+    except ValueError as error: raise ValueError('malformed query: %s' % error)
+    if len(terms) == 0: raise ValueError('empty query')
+
+    conditions = []
+    for term in terms:
+        layer, equals, value = term.partition('=')
+        if equals == '' or layer == '': raise ValueError('condition "%s" is not of the form Layer=value' % term)
+        prefix = value.endswith('*')
+        if prefix: value = value[:-1]
+        elif value == '': raise ValueError('condition "%s" has no value (empty values are not indexed)' % term)
+        conditions.append((layer, value, prefix))
+    return conditions
+
+
+'''
+((3)) Corpus index
+'''
+class CorpusIndex:
+    def __init__(self, path=INDEX_PATH):
+        folder = os.path.dirname(path)
+        if folder != '' and not os.path.exists(folder): os.makedirs(folder)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute('PRAGMA journal_mode = WAL')  # <- the index can be searched while it is updated
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    # brings the index up to date with the CSV files below folder: new and changed files are (re)indexed, files that no
+    # longer exist are removed; each file is one transaction, so a cancelled update leaves a consistent index
+    # (progress is called with (done, total), cancelled is polled between files); returns the counts of indexed,
+    # unchanged, removed and failed files (failures maps paths to error messages)
+    def update(self, folder, progress=None, cancelled=None):
+        paths = csvFiles(folder)
+        known = {path: (file, modified, size, digest) for file, path, modified, size, digest in self.connection.execute(
+            'SELECT id, path, modified, size, hash FROM files')}
+        counts = {'indexed': 0, 'unchanged': 0, 'removed': 0, 'failed': dict()}
+
+        root = os.path.join(os.path.abspath(folder), '')
+        with self.connection:
+            for path, (file, modified, size, digest) in known.items():
+                if path.startswith(root) and not os.path.exists(path):
+                    self.connection.execute('DELETE FROM files WHERE id = ?', (file,))
+                    counts['removed'] += 1
+
+        for done, path in enumerate(paths):
+            if cancelled is not None and cancelled(): break
+            if progress is not None: progress(done, len(paths))
+
+            stat = os.stat(path)
+            entry = known.get(path)
+            if entry is not None and entry[1] == stat.st_mtime and entry[2] == stat.st_size:
+                counts['unchanged'] += 1
+                continue
+
+            digest = fileHash(path)
+            if entry is not None and entry[3] == digest:  # <- touched, but not changed
+                with self.connection:
+                    self.connection.execute('UPDATE files SET modified = ?, size = ? WHERE id = ?',
+                                            (stat.st_mtime, stat.st_size, entry[0]))
+                counts['unchanged'] += 1
+                continue
+
+            try:
+                self.addFile(path, stat, digest)
+                counts['indexed'] += 1
+            except Exception as error:
+                counts['failed'][path] = str(error)
+
+        if progress is not None: progress(len(paths), len(paths))
+        return counts
+
+    # (re)indexes one CSV file in the export format
+    def addFile(self, path, stat, digest):
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        rows = np.arange(len(df))
+        boxes = parseLists(df['Coordinates'], 4)
+        source = df['Source'].iloc[0] if len(df) > 0 else ''
+        prefix = os.path.basename(os.path.dirname(path))  # <- screenshots are Annotated/<prefix>/Screenshots/...
+
+        with self.connection:
+            self.connection.execute('DELETE FROM files WHERE path = ?', (path,))
+            file = self.connection.execute(
+                'INSERT INTO files (path, prefix, source, modified, size, hash) VALUES (?, ?, ?, ?, ?, ?)',
+                (path, prefix, source, stat.st_mtime, stat.st_size, digest)).lastrowid
+
+            boxes = [[None if np.isnan(value) else value for value in box] for box in boxes.tolist()]
+            self.connection.executemany(
+                'INSERT INTO items (file, row, item_index, page, x, y, width, height) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(file, row, index, page, *box) for row, index, page, box in zip(
+                    rows.tolist(), df['Index'].astype(np.int64).tolist(), df['Page'].astype(np.int64).tolist(),
+                    boxes)])
+
+            for layer in df.columns[6:]:
+                values = df[layer].to_numpy()
+                present = np.flatnonzero(values != '')
+                codes, levels = pd.factorize(values[present])
+                order = np.argsort(codes, kind='stable')  # <- the rows of each value stay sorted
+                ends = np.cumsum(np.bincount(codes, minlength=len(levels)))
+                lists = np.split(present[order].astype(ROW_TYPE), ends[:-1])
+                self.connection.executemany('INSERT INTO postings (layer, value, file, rows) VALUES (?, ?, ?, ?)',
+                                            [(layer, value, file, hits.tobytes()) for value, hits in zip(levels, lists)])
+
+    # returns a dictionary of files and the (sorted) rows of their items that match one condition (see ((2)))
+    def postingLists(self, layer, value, prefix):
+        if prefix:  # <- a range on the (layer, value) key, so prefixes use the primary key as well
+            cursor = self.connection.execute('SELECT file, rows FROM postings WHERE layer = ? AND value >= ? AND '
+                                             'value < ?', (layer, value, value + '\U0010ffff'))
+        else:
+            cursor = self.connection.execute('SELECT file, rows FROM postings WHERE layer = ? AND value = ?',
+                                             (layer, value))
+        lists = dict()
+        for file, rows in cursor:
+            lists.setdefault(file, []).append(np.frombuffer(rows, ROW_TYPE))
+        return {file: rows[0] if len(rows) == 1 else np.sort(np.concatenate(rows)) for file, rows in lists.items()}
+
+    # returns a dictionary of files and the rows of their items that match all conditions of query
+    def matches(self, query):
+        hits = None
+        for condition in parseQuery(query):
+            lists = self.postingLists(*condition)
+            if hits is not None:
+                lists = {file: np.intersect1d(hits[file], rows, assume_unique=True)
+                         for file, rows in lists.items() if file in hits}
+            hits = {file: rows for file, rows in lists.items() if len(rows) > 0}
+            if len(hits) == 0: break
+        return hits
+
+    # returns a list of (page, index, x, y, width, height) of some items (rows) of a file, ordered by page and index
+    def items(self, file, rows):
+        items = []
+        rows = rows.tolist()
+        for start in range(0, len(rows), 500):
+            chunk = rows[start:start + 500]
+            items += self.connection.execute(
+                'SELECT page, item_index, x, y, width, height FROM items WHERE file = ? AND row IN (%s)' %
+                ', '.join('?' * len(chunk)), [file] + chunk).fetchall()
+        return sorted(items)
+
+    # returns the items that match all conditions of query (see ((2))) and their number; the items are a list of
+    # dictionaries with the CSV file, document (source), page, item index, coordinates and screenshot path, ordered by
+    # file, page and index; limit caps the number of items listed (not the number counted)
+    def search(self, query, limit=None):
+        hits = self.matches(query)
+        total = sum(len(rows) for rows in hits.values())
+
+        results = []
+        for file, path, prefix, source in self.connection.execute('SELECT id, path, prefix, source FROM files '
+                                                                  'ORDER BY path').fetchall():
+            if file not in hits: continue
+            if limit is not None and len(results) >= limit: break
+            for page, index, x, y, width, height in self.items(file, hits[file]):
+                results.append({'csv': path,
+                                'source': source,
+                                'page': page,
+                                'index': index,
+                                'coordinates': [x, y, width, height],
+                                'crop': os.path.join(os.path.dirname(path), 'Screenshots', cropName(prefix, index))})
+        return results[:limit], total
+
+    # returns a list of (layer, distinct values, items with a value) over the whole corpus
+    def layers(self):
+        return self.connection.execute('SELECT layer, COUNT(DISTINCT value), SUM(LENGTH(rows)) / 4 FROM postings '
+                                       'GROUP BY layer ORDER BY layer').fetchall()
+
+    def fileCount(self):
+        return self.connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+
+'''
+((4)) Command line
+'''
+# python corpus_index.py update [Annotated]
+# python corpus_index.py query "Letter=s Word=w*" [--limit 100] [--csv hits.csv]
+# python corpus_index.py layers
+def main():
+    parser = argparse.ArgumentParser(description='Index the exported CSV files (Annotated/<document>/*.csv) by their '
+                                                 'annotation values and find items across all documents.')
+    parser.add_argument('--index', default=INDEX_PATH, help='index file (default: %s)' % INDEX_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser('update', help='index new and changed CSV files, drop deleted ones')
+    update.add_argument('folder', nargs='?', default='Annotated')
+
+    query = commands.add_parser('query', help='list the items that match all conditions, e.g. "Letter=s Word=w*"')
+    query.add_argument('query', nargs='+', help='conditions Layer=value (Layer=value* for values starting with value)')
+    query.add_argument('--limit', type=int, help='list at most this many items')
+    query.add_argument('--csv', help='write the matches to this CSV file instead of listing them')
+
+    commands.add_parser('layers', help='list the indexed layers with their number of values and items')
+
+    args = parser.parse_args()
+    index = CorpusIndex(args.index)
+
+    if args.command == 'update':
+        start = time.perf_counter()
+        counts = index.update(args.folder)
+        print('%d files indexed, %d unchanged, %d removed, %d failed (%.1f s)' % (
+            counts['indexed'], counts['unchanged'], counts['removed'], len(counts['failed']),
+            time.perf_counter() - start))
+        for path, error in counts['failed'].items():
+            print('failed: %s (%s)' % (path, error))
+
+    elif args.command == 'query':
+        start = time.perf_counter()
+        try: results, total = index.search(' '.join(args.query), args.limit)
+        except ValueError as error: parser.error(str(error))
+        elapsed = (time.perf_counter() - start) * 1000
+
+        if args.csv is not None:
+            pd.DataFrame(results, columns=['csv', 'source', 'page', 'index', 'coordinates', 'crop']).to_csv(
+                args.csv, index=False)
+        else:
+            for result in results:
+                print('%s  page %d  item %d  %s' % (result['source'], result['page'], result['index'], result['crop']))
+        print('%d items (%.1f ms)' % (total, elapsed))
+
+    elif args.command == 'layers':
+        for layer, values, items in index.layers():
+            print('%-20s %8d values %10d items' % (layer, values, items))
+        print('%d files indexed' % index.fileCount())
+
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import collections
+import multiprocessing
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from agreement import parseLists
+from batch_render import cropBox, findDocument, readInputs, openDocument, pageImage, runTask
+
+'''
+((1)) Categories
+'''
+# The values of one annotation layer (e.g. Letter) are the categories of the boxes. Categories are numbered in the order
+# they are met (document by document) unless they are given up front; boxes without a value, or with a value that is
+# not one of the given categories, are left out.
+class Categories:
+    def __init__(self, names=None):
+        self.fixed = names is not None
+        self.names = list(names) if names is not None else []
+        self.ids = {name: position for position, name in enumerate(self.names)}
+
+    # returns the category ids (-1 for boxes that are left out) of an array of values
+    def encode(self, values):
+        uniques, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        for value in uniques:
+            if value != '' and value not in self.ids and not self.fixed:
+                self.ids[value] = len(self.names)
+                self.names.append(value)
+        table = np.array([self.ids.get(value, -1) for value in uniques], dtype=np.int64)
+        return table[inverse.reshape(-1)] if len(values) > 0 else np.zeros(0, dtype=np.int64)
+
+
+# pixel box clipped to the page (boxes may reach over the edge of the page image)
+def clippedBox(x, y, width, height, page_width, page_height):
+    x0, y0, x1, y1 = cropBox(x, y, width, height)
+    return max(x0, 0), max(y0, 0), min(x1, page_width), min(y1, page_height)
+
+
+'''
+((2)) Writers
+'''
+# A writer gets one page at a time, addPage(image name, width, height, boxes) with boxes as a list of
+# (index, x, y, width, height, category id), and writes its files right away, so that memory does not grow with the
+# number of boxes; close() writes what needs all categories (names is the list of category names, which grows while
+# the pages are added). Images go to writer.image_folder.
+
+# COCO: one annotations.json; images and annotations are streamed to two part files that are joined at the end
+class CocoWriter:
+    image_folder = 'images'
+
+    def __init__(self, folder, names):
+        self.folder = folder
+        self.names = names
+        self.images = open(os.path.join(folder, 'images.part'), 'w', encoding='utf-8')
+        self.annotations = open(os.path.join(folder, 'annotations.part'), 'w', encoding='utf-8')
+        self.image_count = 0
+        self.annotation_count = 0
+
+    def addPage(self, name, width, height, boxes):
+        self.image_count += 1
+        self.images.write((',\n' if self.image_count > 1 else '') + json.dumps(
+            {'id': self.image_count, 'file_name': name, 'width': width, 'height': height}))
+        for index, x, y, box_width, box_height, category in boxes:
+            x0, y0, x1, y1 = clippedBox(x, y, box_width, box_height, width, height)
+            if x1 <= x0 or y1 <= y0: continue
+            self.annotation_count += 1
+            self.annotations.write((',\n' if self.annotation_count > 1 else '') + json.dumps(
+                {'id': self.annotation_count, 'image_id': self.image_count, 'category_id': category + 1,
+                 'bbox': [x0, y0, x1 - x0, y1 - y0], 'area': (x1 - x0) * (y1 - y0), 'iscrowd': 0,
+                 'attributes': {'index': index}}))
+
+    def close(self):
+        self.images.close()
+        self.annotations.close()
+        with open(os.path.join(self.folder, 'annotations.json'), 'w', encoding='utf-8') as file:
+            file.write('{"images": [\n')
+            for part in ['images.part', 'annotations.part']:
+                with open(os.path.join(self.folder, part), encoding='utf-8') as part_file:
+                    shutil.copyfileobj(part_file, file)
+                os.remove(os.path.join(self.folder, part))
+                file.write('\n],\n"annotations": [\n' if part == 'images.part' else '\n],\n')
+            file.write('"categories": %s}\n' % json.dumps(
+                [{'id': position + 1, 'name': name, 'supercategory': ''} for position, name in enumerate(self.names)]))
+
+
+# YOLO: one labels/<image>.txt per page (category, center and size relative to the page), classes.txt and data.yaml
+class YoloWriter:
+    image_folder = 'images'
+
+    def __init__(self, folder, names):
+        self.folder = folder
+        self.names = names
+        os.makedirs(os.path.join(folder, 'labels'))
+
+    def addPage(self, name, width, height, boxes):
+        lines = []
+        for index, x, y, box_width, box_height, category in boxes:
+            x0, y0, x1, y1 = clippedBox(x, y, box_width, box_height, width, height)
+            if x1 <= x0 or y1 <= y0: continue
+            lines.append('%d %.6f %.6f %.6f %.6f\n' % (category, (x0 + x1) / 2 / width, (y0 + y1) / 2 / height,
+                                                       (x1 - x0) / width, (y1 - y0) / height))
+        with open(os.path.join(self.folder, 'labels', os.path.splitext(name)[0] + '.txt'), 'w') as file:
+            file.writelines(lines)
+
+    def close(self):
+        with open(os.path.join(self.folder, 'classes.txt'), 'w', encoding='utf-8') as file:
+            file.writelines(name + '\n' for name in self.names)
+        with open(os.path.join(self.folder, 'data.yaml'), 'w', encoding='utf-8') as file:
+            file.write('path: .\ntrain: images\nval: images\nnames:\n')
+            file.writelines('  %d: %s\n' % (position, json.dumps(name)) for position, name in enumerate(self.names))
+
+
+# Pascal VOC: one Annotations/<image>.xml per page, the list of all images in ImageSets/Main/default.txt
+class VocWriter:
+    image_folder = 'JPEGImages'
+
+    def __init__(self, folder, names):
+        self.folder = folder
+        self.names = names
+        os.makedirs(os.path.join(folder, 'Annotations'))
+        os.makedirs(os.path.join(folder, 'ImageSets', 'Main'))
+        self.image_list = open(os.path.join(folder, 'ImageSets', 'Main', 'default.txt'), 'w', encoding='utf-8')
+
+    def addPage(self, name, width, height, boxes):
+        stem = os.path.splitext(name)[0]
+        objects = []
+        for index, x, y, box_width, box_height, category in boxes:
+            x0, y0, x1, y1 = clippedBox(x, y, box_width, box_height, width, height)
+            if x1 <= x0 or y1 <= y0: continue
+            objects.append('  <object>\n    <name>%s</name>\n    <pose>Unspecified</pose>\n'
+                           '    <truncated>0</truncated>\n    <difficult>0</difficult>\n'
+                           '    <bndbox><xmin>%d</xmin><ymin>%d</ymin><xmax>%d</xmax><ymax>%d</ymax></bndbox>\n'
+                           '  </object>\n' % (escape(self.names[category]), x0, y0, x1, y1))
+        with open(os.path.join(self.folder, 'Annotations', stem + '.xml'), 'w', encoding='utf-8') as file:
+            file.write('<annotation>\n  <folder>%s</folder>\n  <filename>%s</filename>\n  <size><width>%d</width>'
+                       '<height>%d</height><depth>3</depth></size>\n  <segmented>0</segmented>\n%s</annotation>\n' % (
+                           self.image_folder, escape(name), width, height, ''.join(objects)))
+        self.image_list.write(stem + '\n')
+
+    def close(self):
+        self.image_list.close()
+        with open(os.path.join(self.folder, 'labels.txt'), 'w', encoding='utf-8') as file:
+            file.writelines(name + '\n' for name in self.names)
+
+
+WRITERS = {'coco': CocoWriter, 'yolo': YoloWriter, 'voc': VocWriter}
+
+
+'''
+((3)) Page images
+'''
+# Page images are written as they are stored in the PDF (no decoding), crops go through the crop path of
+# batch_render.py; both run in a pool of worker processes while the annotations are written.
+
+# file extension of the first image of every page of a PDF by its filter, as PyMuPDF extracts it (other images are
+# extracted as PNG)
+IMAGE_EXTENSIONS = {'DCTDecode': '.jpg', 'JPXDecode': '.jpx'}
+
+
+# returns {page: (width, height, extension)} of the page images of a document (PDF or image), without decoding them
+def pageSizes(document):
+    if not document.lower().endswith('.pdf'):
+        with Image.open(document) as image:
+            return {1: (image.width, image.height, os.path.splitext(document)[1].lower())}
+    pdf_file = openDocument(document)
+    sizes = dict()
+    for number in range(len(pdf_file)):
+        xref, smask, width, height, bpc, colorspace, alternative, name, image_filter = \
+            pdf_file.load_page(number).get_images(full=True)[0][:9]
+        sizes[number + 1] = (width, height, IMAGE_EXTENSIONS.get(image_filter, '.png'))
+    return sizes
+
+
+# name of the image of a page in the exported dataset
+def pageName(prefix, page, extension):
+    return '%s_page%d%s' % (prefix, page, '.jpg' if extension == '.jpeg' else extension)
+
+
+# writes the images of a few pages of one document; task is {'id', 'document', 'pages': {page: path}}
+def writePages(task):
+    start = time.perf_counter()
+    result = {'id': task['id'], 'document': task['document'], 'pages': 0, 'error': None}
+    try:
+        for page, path in task['pages'].items():
+            if not task['document'].lower().endswith('.pdf'):
+                shutil.copyfile(task['document'], path)
+            else:
+                pdf_file = openDocument(task['document'])
+                xref = pdf_file.load_page(page - 1).get_images(full=True)[0][0]
+                extracted = pdf_file.extract_image(xref)
+                if '.' + extracted['ext'].replace('jpeg', 'jpg') == os.path.splitext(path)[1]:
+                    with open(path, 'wb') as file:
+                        file.write(extracted['image'])  # <- as stored in the PDF, no decoding
+                else:
+                    with pageImage(task['document'], page) as image:
+                        image.save(path)  # <- e.g. PNG for images PyMuPDF extracts in another format
+            result['pages'] += 1
+    except Exception as error:
+        result['error'] = '%s: %s' % (type(error).__name__, error)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+# runs image tasks in a pool without queueing more than a few tasks per worker, so that the tasks of a large corpus
+# are never all in memory
+class TaskQueue:
+    def __init__(self, pool, workers):
+        self.pool = pool
+        self.limit = 2 * workers
+        self.pending = collections.deque()
+        self.results = []
+
+    def submit(self, function, task):
+        if len(self.pending) >= self.limit: self.results.append(self.pending.popleft().get())
+        self.pending.append(self.pool.apply_async(function, (task,)))
+
+    def finish(self):
+        while len(self.pending) > 0:
+            self.results.append(self.pending.popleft().get())
+        return self.results
+
+
+'''
+((4)) Export
+'''
+# exports the boxes of the CSV files (pairs of CSV file and document, see batch_render.py) to folder in file_format;
+# layer gives the categories, images is 'pages', 'crops' or None; returns a summary
+def exportDetection(pairs, folder, file_format, layer, images=None, categories=None, workers=None,
+                    pages_per_task=10, progress=None):
+    stage = os.path.normpath(folder) + '.partial'
+    if os.path.exists(stage): shutil.rmtree(stage)
+    os.makedirs(stage)
+
+    categories = Categories(categories)
+    writer = WRITERS[file_format](stage, categories.names)
+    summary = {'documents': 0, 'pages': 0, 'boxes': 0, 'skipped': 0, 'failures': []}
+
+    image_folder = os.path.join(stage, writer.image_folder if images == 'pages' else 'crops')
+    if images is not None: os.makedirs(image_folder)
+    workers = workers or os.cpu_count()
+    try:
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            queue = TaskQueue(pool, workers)
+            for csv_path, document in pairs:
+                if progress is not None: progress(csv_path)
+                df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+                document = findDocument(csv_path, df, document)
+                prefix = os.path.basename(document)[0:-4]  # <- as in HAnnoI
+                sizes = pageSizes(document)
+
+                pages = df['Page'].astype(np.int64).to_numpy()
+                indices = df['Index'].astype(np.int64).to_numpy()
+                boxes = parseLists(df['Coordinates'], 4)
+                ids = categories.encode(df[layer].to_numpy()) if layer in df.columns else np.full(len(df), -1)
+                summary['skipped'] += int((ids < 0).sum())
+
+                order = np.lexsort((indices, pages))
+                order = order[ids[order] >= 0]
+                page_boxes = collections.defaultdict(list)
+                for row in order.tolist():
+                    page_boxes[int(pages[row])].append((int(indices[row]), *boxes[row].tolist(), int(ids[row])))
+
+                image_tasks = dict()
+                for page, (width, height, extension) in sorted(sizes.items()):
+                    name = pageName(prefix, page, extension)
+                    writer.addPage(name, width, height, page_boxes.get(page, []))
+                    summary['pages'] += 1
+                    summary['boxes'] += len(page_boxes.get(page, []))
+                    if images == 'pages': image_tasks[page] = os.path.join(image_folder, name)
+                    elif images == 'crops' and page in page_boxes:
+                        image_tasks[page] = [box[:5] for box in page_boxes[page]]
+
+                numbers = sorted(image_tasks)
+                for start in range(0, len(numbers), pages_per_task):
+                    chunk = numbers[start:start + pages_per_task]
+                    task = {'id': '%s:%d-%d' % (os.path.abspath(document), chunk[0], chunk[-1]),
+                            'document': document, 'folder': image_folder, 'prefix': prefix,
+                            'pages': {page: image_tasks[page] for page in chunk}}
+                    queue.submit(writePages if images == 'pages' else runTask, task)
+                summary['documents'] += 1
+
+            summary['failures'] += [{'id': result['id'], 'error': result['error']} for result in queue.finish()
+                                    if result['error'] is not None]
+
+        writer.close()
+        if os.path.exists(folder): shutil.rmtree(folder)
+        os.replace(stage, folder)
+    except BaseException:
+        shutil.rmtree(stage, ignore_errors=True)
+        raise
+
+    summary['categories'] = len(categories.names)
+    return summary
+
+
+'''
+((5)) Command line
+'''
+def main():
+    parser = argparse.ArgumentParser(description='Export the boxes of annotated documents as a COCO, YOLO or Pascal '
+                                                 'VOC dataset, with the values of one layer as categories.')
+    parser.add_argument('csv', nargs='*', help='CSV files, or CSV,PDF pairs if the PDF is not next to the CSV file')
+    parser.add_argument('--list', help='text file with one CSV file (or CSV,PDF pair) per line')
+    parser.add_argument('--format', choices=sorted(WRITERS), default='coco')
+    parser.add_argument('--layer', required=True, help='annotation layer whose values are the categories')
+    parser.add_argument('--categories', help='comma separated categories in the order of their ids (default: all '
+                                             'values, numbered as they are met)')
+    parser.add_argument('--images', choices=['pages', 'crops', 'none'], default='pages',
+                        help='write the page images, the crops of all boxes or no images')
+    parser.add_argument('--output', default='Detection', help='dataset folder (replaced if it exists)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes for the images')
+    args = parser.parse_args()
+
+    pairs = readInputs(args)
+    if len(pairs) == 0: parser.error('no CSV files given')
+    categories = [name.strip() for name in args.categories.split(',')] if args.categories is not None else None
+
+    start = time.perf_counter()
+    images = None if args.images == 'none' else args.images
+    summary = exportDetection(pairs, args.output, args.format, args.layer, images, categories, args.workers,
+                              progress=lambda path: print('reading ' + path, flush=True))
+    print('%d documents, %d pages, %d boxes (%d without category left out), %d categories written to %s (%.1f s)' % (
+        summary['documents'], summary['pages'], summary['boxes'], summary['skipped'], summary['categories'],
+        args.output, time.perf_counter() - start))
+    for failure in summary['failures']:
+        print('failed: %s (%s)' % (failure['id'], failure['error']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import bisect
+import cProfile
+import pstats
+import threading
+import functools
+import collections
+import logging
+import logging.handlers
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+'''
+((1)) Latency histograms
+'''
+# upper bounds (in milliseconds) of the histogram buckets; the last bucket takes everything slower
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf')]
+
+
+class Histogram:
+    def __init__(self, recent=512):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=recent)  # <- exact percentiles for the last calls (overlay)
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.recent.append(ms)
+
+    # percentile of the recent calls, e.g. percentile(95)
+    def percentile(self, p):
+        if len(self.recent) == 0: return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    def summary(self):
+        return {'count': self.count,
+                'mean_ms': round(self.total / self.count, 3) if self.count > 0 else 0.0,
+                'p50_ms': round(self.percentile(50), 3),
+                'p95_ms': round(self.percentile(95), 3),
+                'max_ms': round(self.max, 3),
+                'buckets': {('<=' + str(b) if b != float('inf') else '>' + str(BUCKETS[-2])): c
+                            for b, c in zip(BUCKETS, self.counts) if c > 0}}
+
+
+# resident memory of this process in bytes (None if it cannot be determined)
+def residentMemory():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # <- peak, not current; kB on Linux, bytes on macOS
+        return rss if sys.platform == 'darwin' else rss * 1024
+    except ImportError:
+        return None
+
+
+'''
+((2)) Profilers
+'''
+# minimal sampling profiler: a background thread records the stack of the thread that created the profiler every
+# interval seconds, but only while enabled; the result is written in the "collapsed stacks" format of flame graph tools
+class SamplingProfiler:
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.thread_id = threading.get_ident()
+        self.active = False
+        self.running = True
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    def enable(self):
+        self.active = True
+
+    def disable(self):
+        self.active = False
+
+    def stop(self):
+        self.running = False
+        self.sampler.join()
+
+    def sample(self):
+        while self.running:
+            if self.active:
+                frame = sys._current_frames().get(self.thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append('%s (%s:%d)' % (frame.f_code.co_name, os.path.basename(frame.f_code.co_filename),
+                                                 frame.f_lineno))
+                    frame = frame.f_back
+                if len(stack) > 0:
+                    self.samples[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def dump(self, path):
+        with open(path, 'w') as file:
+            for stack, count in self.samples.most_common():
+                file.write('%s %d\n' % (stack, count))
+
+
+'''
+((3)) Instrumentation
+'''
+class Instrumentation:
+    def __init__(self, folder='Diagnostics', item_count=None, slow_ms=50, max_bytes=1000000, backups=5):
+        self.folder = folder
+        self.item_count = item_count  # <- callable returning the number of items in the current document
+        self.slow_ms = slow_ms  # <- calls slower than this are logged individually
+        self.histograms = collections.defaultdict(Histogram)
+        self.started = time.time()
+
+        # profiling of a chosen action (see startProfiling)
+        self.profile_action = None
+        self.profile_mode = None
+        self.profiler = None
+        self.profile_depth = 0  # <- nested calls of the profiled action must not enable the profiler twice
+
+        self.logger = logging.getLogger('HAnnoI.latency')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.log_settings = (max_bytes, backups)
+
+    # the log file is only created once something is logged, so that the app does not write files unasked
+    def log(self, record):
+        if len(self.logger.handlers) == 0:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+            handler = logging.handlers.RotatingFileHandler(os.path.join(self.folder, 'latency.log'),
+                                                           maxBytes=self.log_settings[0],
+                                                           backupCount=self.log_settings[1])
+            self.logger.addHandler(handler)
+        record['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.logger.info(json.dumps(record))
+
+    def record(self, action, ms):
+        self.histograms[action].add(ms)
+        if ms > self.slow_ms:
+            self.log({'event': 'slow', 'action': action, 'ms': round(ms, 3)})
+
+    # runs function and records its latency under action; used by the instrumented decorator below
+    def call(self, action, function, *args):
+        profiling = self.profiler is not None and self.profile_action == action and self.profile_depth == 0
+        if profiling:
+            self.profile_depth += 1
+            self.profiler.enable()
+
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.record(action, (time.perf_counter() - start) * 1000)
+            if profiling:
+                self.profiler.disable()
+                self.profile_depth -= 1
+
+    def summary(self):
+        return {'uptime_s': round(time.time() - self.started, 1),
+                'items': self.item_count() if self.item_count is not None else None,
+                'rss_bytes': residentMemory(),
+                'actions': {action: hist.summary() for action, hist in sorted(self.histograms.items())}}
+
+    def logSummary(self):
+        record = self.summary()
+        record['event'] = 'summary'
+        self.log(record)
+
+    # one line for the status bar overlay
+    def overlayText(self, actions):
+        parts = []
+        for action in actions:
+            if action in self.histograms:
+                hist = self.histograms[action]
+                parts.append('%s %.0f/%.0f ms' % (action, hist.percentile(50), hist.percentile(95)))
+        if self.item_count is not None:
+            parts.append('items %d' % self.item_count())
+        rss = residentMemory()
+        if rss is not None:
+            parts.append('RSS %.0f MB' % (rss / 1024 ** 2))
+        return '  |  '.join(parts)
+
+    # all later calls of action are profiled until stopProfiling is called; mode is 'cProfile' or 'sampling'
+    def startProfiling(self, action, mode='cProfile'):
+        self.stopProfiling()
+        self.profile_action = action
+        self.profile_mode = mode
+        self.profiler = cProfile.Profile() if mode == 'cProfile' else SamplingProfiler()
+
+    # stops profiling and writes the results; returns the path of the written file (None if nothing was profiled)
+    def stopProfiling(self):
+        if self.profiler is None: return None
+
+        profiler, action, mode = self.profiler, self.profile_action, self.profile_mode
+        self.profiler = None
+        self.profile_action = None
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+
+        if mode == 'cProfile':
+            if len(profiler.getstats()) == 0: return None
+            path = os.path.join(self.folder, 'profile_%s_%s.prof' % (action, stamp))
+            profiler.dump_stats(path)
+            with open(path[:-5] + '.txt', 'w') as file:
+                pstats.Stats(path, stream=file).sort_stats('cumulative').print_stats(40)
+        else:
+            profiler.stop()
+            if len(profiler.samples) == 0: return None
+            path = os.path.join(self.folder, 'profile_%s_%s.collapsed' % (action, stamp))
+            profiler.dump(path)
+
+        self.log({'event': 'profile', 'action': action, 'mode': mode, 'path': path})
+        return path
+
+
+# decorator for methods of objects with an "instrumentation" attribute; records the latency of each call under action
+# Qt passes all arguments of a signal to its slot, so surplus arguments are dropped like Qt does for plain methods
+def instrumented(action):
+    def decorator(function):
+        argcount = function.__code__.co_argcount - 1
+
+        @functools.wraps(function)
+        def wrapper(self, *args):
+            instrumentation = getattr(self, 'instrumentation', None)
+            if instrumentation is None:
+                return function(self, *args[:argcount])
+            return instrumentation.call(action, function, self, *args[:argcount])
+        return wrapper
+    return decorator
@@ -0,0 +1,373 @@
+import os
+import csv
+import time
+import shutil
+import tempfile
+import itertools
+import multiprocessing
+import concurrent.futures
+
+from PyQt6.QtCore import QThread, pyqtSignal
+from PIL import Image
+
+from batch_render import cropBox, cropName
+from page_analysis import proposePage, pageDescriptors, matchPage, filterPage
+from corpus_index import CorpusIndex
+from detection_export import WRITERS, Categories, pageName
+
+'''
+((1)) Background jobs
+'''
+# A job runs in its own thread on a snapshot of the model (plain Python data taken on the GUI thread), so that the
+# annotator can keep working while it runs. Results are written to a staging file/folder first and only moved into
+# place once the job has finished; a cancelled or failed job leaves nothing behind.
+class Job(QThread):
+    progress = pyqtSignal(int, int)  # <- done, total
+    failed = pyqtSignal(str)
+
+    uses_pages = False  # <- jobs that read the page images are cancelled when another document is loaded
+
+    def __init__(self, action):
+        super().__init__()
+        self.action = action  # <- name under which the duration is recorded (see instrumentation.py)
+        self.cancelled = False
+        self.error = None
+        self.elapsed = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.work()
+            if self.cancelled: self.cleanUp()
+            else: self.commit()
+        except Exception as error:
+            self.cleanUp()
+            self.error = str(error)
+            self.failed.emit(self.error)
+        self.elapsed = (time.perf_counter() - start) * 1000
+
+    # subclasses implement these three
+    def work(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def cleanUp(self):
+        pass
+
+
+'''
+((2)) Streaming CSV export
+'''
+# The export does not build a data frame: HAnnoI takes a snapshot with one tuple (index, page, coordinates, color,
+# anchor, values) per item (the coordinates and anchors are shared with the model, which replaces but never changes
+# them), and the rows are written chunk by chunk by the csv module, in the same format as pandas' to_csv (None, e.g.
+# an item without anchor, is written as an empty field). Values of categorical layers are codes in the snapshot;
+# levels holds the levels of each layer (None for other layers).
+
+# writes the snapshot rows (in the order given) with header to an open file, chunk_size rows at a time; progress is
+# called with the rows written so far, cancelled is polled between chunks (returns False if the export was cancelled)
+def writeRows(file, header, rows, levels, source, chunk_size=10000, progress=None, cancelled=None):
+    categorical = [(position, layer_levels + ['']) for position, layer_levels in enumerate(levels)
+                   if layer_levels is not None]  # <- code -1 (no value) picks the '' at the end
+
+    writer = csv.writer(file, lineterminator=os.linesep)
+    writer.writerow(header)
+    for start in range(0, len(rows), chunk_size):
+        if cancelled is not None and cancelled(): return False
+        chunk = []
+        for index, page, coordinates, color, anchor, values in rows[start:start + chunk_size]:
+            row = [index, page, coordinates, color, anchor, source]
+            row += values
+            for position, layer_levels in categorical:
+                row[6 + position] = layer_levels[row[6 + position]]
+            chunk.append(row)
+        writer.writerows(chunk)
+        if progress is not None: progress(start + len(chunk))
+    return True
+
+
+def writeCsv(path, header, rows, levels, source, chunk_size=10000, progress=None, cancelled=None):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        return writeRows(file, header, rows, levels, source, chunk_size, progress, cancelled)
+
+
+'''
+((3)) Jobs
+'''
+# writes a snapshot of all annotations (see ((2))) to a CSV file, or to one CSV file per page if pages (the page
+# numbers of the document) are given and path contains '%d' for the page number
+class ExportJob(Job):
+    def __init__(self, header, rows, levels, source, path, pages=None, chunk_size=10000):
+        super().__init__('exportJob')
+        self.header = header
+        self.rows = rows
+        self.levels = levels
+        self.source = source
+        self.path = path
+        self.pages = pages
+        self.chunk_size = chunk_size
+        self.written = []  # <- (partial file, final file)
+
+    def work(self):
+        if self.pages is None: files = [(self.path, self.rows)]
+        else:
+            page_rows = {page: [] for page in self.pages}
+            for row in self.rows:
+                page_rows.setdefault(row[1], []).append(row)
+            files = [(self.path % page, rows) for page, rows in sorted(page_rows.items())]
+
+        done = 0
+        self.progress.emit(done, len(self.rows))
+        for path, rows in files:
+            self.written.append((path + '.partial', path))
+            if not writeCsv(path + '.partial', self.header, rows, self.levels, self.source, self.chunk_size,
+                            lambda written: self.progress.emit(done + written, len(self.rows)),
+                            lambda: self.cancelled): return
+            done += len(rows)
+
+    def commit(self):
+        for temp_path, path in self.written:
+            os.replace(temp_path, path)
+
+    def cleanUp(self):
+        for temp_path, path in self.written:
+            if os.path.exists(temp_path): os.remove(temp_path)
+
+
+# cuts items out of page images and saves them as <prefix>_<index>.png to folder; crops is a list of
+# (page image path, item index, x, y, width, height), grouped by page
+class RenderJob(Job):
+    uses_pages = True
+
+    def __init__(self, crops, folder, prefix):
+        super().__init__('renderJob')
+        self.crops = crops
+        self.folder = folder
+        self.prefix = prefix
+        self.stage = None
+
+    def work(self):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self.stage = tempfile.mkdtemp(dir=os.path.dirname(os.path.normpath(self.folder)), prefix='.render_')
+
+        done = 0
+        self.progress.emit(done, len(self.crops))
+        for image_path, crops in itertools.groupby(self.crops, key=lambda crop: crop[0]):
+            with Image.open(image_path) as page:
+                if page.mode not in ('RGB', 'RGBA', 'L'): page = page.convert('RGB')  # <- e.g. CMYK JPEGs
+                for image_path, index, x, y, width, height in crops:
+                    if self.cancelled: return
+                    path = os.path.join(self.stage, cropName(self.prefix, index))
+                    page.crop(cropBox(x, y, width, height)).save(path)
+                    done += 1
+                    self.progress.emit(done, len(self.crops))
+
+    def commit(self):
+        for file_name in os.listdir(self.stage):
+            os.replace(os.path.join(self.stage, file_name), os.path.join(self.folder, file_name))
+        os.rmdir(self.stage)
+
+    def cleanUp(self):
+        if self.stage is not None: shutil.rmtree(self.stage, ignore_errors=True)
+
+
+# proposes letter boxes (see page_analysis.py) for pages, a dictionary of page numbers and page images, in a pool of
+# worker processes; the result maps page numbers to lists of boxes
+class ProposalJob(Job):
+    uses_pages = True
+
+    def __init__(self, pages, workers=None):
+        super().__init__('proposalJob')
+        self.pages = pages
+        self.workers = workers
+        self.result = dict()
+
+    def work(self):
+        context = multiprocessing.get_context('spawn')  # <- forking a process that runs Qt is not safe
+        with concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context) as pool:
+            futures = {pool.submit(proposePage, path): page for page, path in self.pages.items()}
+
+            self.progress.emit(0, len(futures))
+            for future in concurrent.futures.as_completed(futures):
+                if self.cancelled:
+                    for remaining in futures: remaining.cancel()
+                    return
+                self.result[futures[future]] = future.result()
+                self.progress.emit(len(self.result), len(futures))
+
+
+# computes glyph descriptors (see page_analysis.py) in a pool of worker processes; pages maps page numbers to
+# (page image, list of boxes), the result maps page numbers to descriptor arrays
+class DescriptorJob(Job):
+    uses_pages = True
+
+    def __init__(self, pages, workers=None):
+        super().__init__('descriptorJob')
+        self.pages = pages
+        self.workers = workers
+        self.result = dict()
+
+    def work(self):
+        context = multiprocessing.get_context('spawn')  # <- forking a process that runs Qt is not safe
+        with concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context) as pool:
+            futures = {pool.submit(pageDescriptors, path, boxes): page for page, (path, boxes) in self.pages.items()}
+
+            self.progress.emit(0, len(futures))
+            for future in concurrent.futures.as_completed(futures):
+                if self.cancelled:
+                    for remaining in futures: remaining.cancel()
+                    return
+                self.result[futures[future]] = future.result()
+                self.progress.emit(len(self.result), len(futures))
+
+
+# searches pages, a dictionary of page numbers and page images, for template (a grayscale array, see
+# page_analysis.py) in a pool of worker processes; the result maps page numbers to lists of (box, score)
+class MatchJob(Job):
+    uses_pages = True
+
+    def __init__(self, pages, template, threshold, workers=None):
+        super().__init__('matchJob')
+        self.pages = pages
+        self.template = template
+        self.threshold = threshold
+        self.workers = workers
+        self.result = dict()
+
+    def work(self):
+        context = multiprocessing.get_context('spawn')  # <- forking a process that runs Qt is not safe
+        with concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context) as pool:
+            futures = {pool.submit(matchPage, path, self.template, self.threshold): page
+                       for page, path in self.pages.items()}
+
+            self.progress.emit(0, len(futures))
+            for future in concurrent.futures.as_completed(futures):
+                if self.cancelled:
+                    for remaining in futures: remaining.cancel()
+                    return
+                self.result[futures[future]] = future.result()
+                self.progress.emit(len(self.result), len(futures))
+
+
+# computes the display filters (see page_analysis.py) of pages in a pool of worker processes; pages maps page numbers
+# to (page image, {filter name: path of the cached image}); the images are written next to their final paths and
+# renamed on commit, so the cache never holds a half-written image
+class FilterJob(Job):
+    uses_pages = True
+
+    def __init__(self, pages, workers=None):
+        super().__init__('filterJob')
+        self.pages = pages
+        self.workers = workers
+        self.written = []  # <- (partial, final)
+
+    def work(self):
+        context = multiprocessing.get_context('spawn')  # <- forking a process that runs Qt is not safe
+        with concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context) as pool:
+            futures = dict()
+            for page, (path, paths) in self.pages.items():
+                partials = {name: out_path + '.partial' for name, out_path in paths.items()}
+                futures[pool.submit(filterPage, path, partials)] = page
+                self.written += [(partials[name], out_path) for name, out_path in paths.items()]
+
+            done = 0
+            self.progress.emit(done, len(futures))
+            for future in concurrent.futures.as_completed(futures):
+                if self.cancelled:
+                    for remaining in futures: remaining.cancel()
+                    return
+                future.result()
+                done += 1
+                self.progress.emit(done, len(futures))
+
+    def commit(self):
+        for partial, final in self.written:
+            os.replace(partial, final)
+
+    def cleanUp(self):
+        for partial, final in self.written:
+            if os.path.exists(partial): os.remove(partial)
+
+
+# brings the corpus index (see corpus_index.py) up to date with the CSV files below folder; the index has its own
+# connection in the job thread, and each file is indexed in its own transaction, so a cancelled update keeps the files
+# indexed so far; the result holds the counts of indexed, unchanged, removed and failed files
+class IndexJob(Job):
+    def __init__(self, index_path, folder):
+        super().__init__('indexJob')
+        self.index_path = index_path
+        self.folder = folder
+        self.result = None
+
+    def work(self):
+        index = CorpusIndex(self.index_path)
+        try: self.result = index.update(self.folder, self.progress.emit, lambda: self.cancelled)
+        finally: index.close()
+
+
+# exports a snapshot of all annotations (see ((2))) as a COCO, YOLO or Pascal VOC dataset (see detection_export.py) to
+# folder; pages maps page numbers to page images, position is the layer whose values are the categories, images is
+# 'pages' (copies of the page images), 'crops' or None
+class DetectionJob(Job):
+    uses_pages = True
+
+    def __init__(self, rows, levels, position, pages, prefix, folder, file_format, images):
+        super().__init__('detectionJob')
+        self.rows = rows
+        self.levels = levels
+        self.position = position
+        self.pages = pages
+        self.prefix = prefix
+        self.folder = folder
+        self.file_format = file_format
+        self.images = images
+        self.stage = os.path.normpath(folder) + '.partial'
+        self.categories = Categories()
+
+    def work(self):
+        if os.path.exists(self.stage): shutil.rmtree(self.stage)
+        os.makedirs(self.stage)
+        writer = WRITERS[self.file_format](self.stage, self.categories.names)
+        image_folder = os.path.join(self.stage, writer.image_folder if self.images == 'pages' else 'crops')
+        if self.images is not None: os.makedirs(image_folder)
+
+        levels = self.levels[self.position]
+        values = [row[5][self.position] for row in self.rows]
+        if levels is not None: values = [levels[value] if value >= 0 else '' for value in values]
+        ids = self.categories.encode(values)
+
+        page_boxes = dict()
+        for row, category in zip(self.rows, ids.tolist()):
+            if category >= 0: page_boxes.setdefault(row[1], []).append((row[0], *row[2], category))
+
+        done = 0
+        self.progress.emit(done, len(self.pages))
+        for page, image_path in sorted(self.pages.items()):
+            if self.cancelled: return
+            boxes = page_boxes.get(page, [])
+            name = pageName(self.prefix, page, os.path.splitext(image_path)[1].lower())
+            with Image.open(image_path) as image:
+                writer.addPage(name, image.width, image.height, boxes)
+                if self.images == 'pages':
+                    shutil.copyfile(image_path, os.path.join(image_folder, name))
+                elif self.images == 'crops' and len(boxes) > 0:
+                    if image.mode not in ('RGB', 'RGBA', 'L'): image = image.convert('RGB')
+                    for index, x, y, width, height, category in boxes:
+                        image.crop(cropBox(x, y, width, height)).save(
+                            os.path.join(image_folder, cropName(self.prefix, index)))
+            done += 1
+            self.progress.emit(done, len(self.pages))
+        writer.close()
+
+    def commit(self):
+        if os.path.exists(self.folder): shutil.rmtree(self.folder)
+        os.replace(self.stage, self.folder)
+
+    def cleanUp(self):
+        shutil.rmtree(self.stage, ignore_errors=True)
@@ -0,0 +1,96 @@
+import os
+import json
+
+'''
+((1)) Append-only edit journal
+'''
+# Every edit of the current document is appended to <folder>/<document>.journal as one JSON line, so that saving an
+# edit costs O(edit) instead of re-exporting the whole project. The first line (header) names the document and the CSV
+# the edits are based on; recovery loads that CSV (or only the document if there is none) and replays all edits.
+# From time to time, the journal is compacted: the full state is written to <document>.snapshot.csv and the journal
+# starts over with the snapshot as its base.
+class Journal:
+    def __init__(self, folder, name, sync_every=50):
+        self.folder = folder
+        self.path = os.path.join(folder, name + '.journal')
+        self.snapshot_path = os.path.join(folder, name + '.snapshot.csv')
+        self.sync_every = sync_every  # <- edits are flushed right away, but only synced to disk every n edits
+        self.file = None
+        self.header = None
+        self.count = 0  # <- edits since the last start/compaction
+
+    # starts a new journal for document; base is the CSV file the current state was loaded from (or None)
+    def start(self, document, base):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self.close()
+
+        self.header = {'op': 'header', 'document': os.path.abspath(document),
+                       'base': os.path.abspath(base) if base is not None else None}
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self.write(self.header)
+        self.sync()
+        self.count = 0
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.file.flush()
+
+    def append(self, record):
+        self.write(record)
+        self.count += 1
+        if self.count % self.sync_every == 0:
+            self.sync()
+
+    def sync(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    # write_snapshot(path) must write the full state as CSV (in the export format) to path; the snapshot then replaces
+    # the edits in the journal
+    def compact(self, write_snapshot):
+        temp_path = self.snapshot_path + '.tmp'
+        write_snapshot(temp_path)
+        os.replace(temp_path, self.snapshot_path)
+        self.start(self.header['document'], self.snapshot_path)
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    # removes journal and snapshot (e.g. when the user does not want to recover them)
+    def discard(self):
+        self.close()
+        for path in [self.path, self.snapshot_path]:
+            if os.path.exists(path): os.remove(path)
+
+
+'''
+((2)) Recovery
+'''
+# returns header and edits of a journal file; a last line that was only partly written (crash) is ignored
+def readJournal(path):
+    header, edits = None, []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            try: record = json.loads(line)
+            except ValueError: break
+            if record.get('op') == 'header': header = record
+            else: edits.append(record)
+    return header, edits
+
+
+# returns the journal files in folder that contain at least one edit
+def pendingJournals(folder):
+    pending = []
+    if not os.path.exists(folder): return pending
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.endswith('.journal'):
+            path = os.path.join(folder, file_name)
+            header, edits = readJournal(path)
+            if header is not None and len(edits) > 0:
+                pending.append(path)
+    return pending
@@ -0,0 +1,148 @@
+import sys
+import os
+import gc
+import json
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+# the leak check never opens a window on screen; this has to be set before Qt is imported
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6.QtCore import Qt, QEvent, QObject, QCoreApplication
+from PyQt6.QtGui import QKeyEvent
+from PyQt6.QtWidgets import QApplication
+
+from benchmark import makeDocument
+from instrumentation import residentMemory
+
+'''
+((1)) Session simulation
+'''
+# processes all pending events including deferred deletes (deleteLater), like the event loop of the app would
+def settle():
+    QApplication.processEvents()
+    QCoreApplication.sendPostedEvents(None, QEvent.Type.DeferredDelete.value)
+    QApplication.processEvents()
+
+
+def pressAlt(window, dx, dy):
+    window.keyPressEvent(QKeyEvent(QEvent.Type.KeyPress, Qt.Key.Key_Alt, Qt.KeyboardModifier.AltModifier))
+    if window.sizer is not None:
+        window.sizer.setPos(window.sizer.x() + dx, window.sizer.y() + dy)
+    window.keyReleaseEvent(QKeyEvent(QEvent.Type.KeyRelease, Qt.Key.Key_Alt, Qt.KeyboardModifier.NoModifier))
+
+
+# one cycle of a typical annotation session: switch page, select some items, set their anchors and resize them,
+# add and delete an item
+def cycle(window, number, selections):
+    pages = window.view_tabs.count()
+    window.view_tabs.setCurrentIndex(number % pages)
+
+    items = window.page_items[window.view_tabs.currentIndex() + 1][:selections]
+    for i, item in enumerate(items):
+        window.scene.clearSelection()
+        item.setSelected(True)
+        window.setAnchor()
+        pressAlt(window, 1 if i % 2 else -1, 0)
+
+    window.scene.clearSelection()
+    window.addItem()
+    window.deleteItem()
+    window.scene.clearSelection()
+
+
+def sample(window, number):
+    gc.collect()
+    return {'cycle': number,
+            'rss_mb': round(residentMemory() / 1024 ** 2, 1) if residentMemory() is not None else None,
+            'scene_items': len(window.scene.items()),
+            'qobjects': len(window.findChildren(QObject)),
+            'python_objects': len(gc.get_objects())}
+
+
+'''
+((2)) Checks
+'''
+# compares the last sample with the baseline (taken after warm-up) and returns a list of failures
+def check(baseline, last, args):
+    failures = []
+    if last['scene_items'] - baseline['scene_items'] > args.max_item_growth:
+        failures.append('scene items grew from %d to %d' % (baseline['scene_items'], last['scene_items']))
+    if last['qobjects'] - baseline['qobjects'] > args.max_qobject_growth:
+        failures.append('QObjects grew from %d to %d' % (baseline['qobjects'], last['qobjects']))
+    if last['python_objects'] - baseline['python_objects'] > args.max_pyobject_growth:
+        failures.append('Python objects grew from %d to %d' % (baseline['python_objects'], last['python_objects']))
+    if last['rss_mb'] is not None and last['rss_mb'] - baseline['rss_mb'] > args.max_rss_growth:
+        failures.append('RSS grew from %.1f MB to %.1f MB' % (baseline['rss_mb'], last['rss_mb']))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive a long HAnnoI session offscreen and check that object counts '
+                                                 'and memory stay bounded.')
+    parser.add_argument('--cycles', type=int, default=2000, help='page switches (each with selections and edits)')
+    parser.add_argument('--selections', type=int, default=5, help='items selected, anchored and resized per cycle')
+    parser.add_argument('--reload-every', type=int, default=500, help='reload the CSV every n cycles (0: never)')
+    parser.add_argument('--sample-every', type=int, default=100, help='take a sample every n cycles')
+    parser.add_argument('--warmup', type=int, default=100, help='cycles before the baseline sample is taken')
+    parser.add_argument('--pages', type=int, default=5, help='pages of the synthetic document')
+    parser.add_argument('--items', type=int, default=40, help='items per page of the synthetic document')
+    parser.add_argument('--max-item-growth', type=int, default=2,
+                        help='tolerated growth of scene items (anchor line and sizer are created on demand)')
+    parser.add_argument('--max-qobject-growth', type=int, default=20, help='tolerated growth of QObjects')
+    parser.add_argument('--max-pyobject-growth', type=int, default=5000, help='tolerated growth of Python objects')
+    parser.add_argument('--max-rss-growth', type=float, default=30, help='tolerated growth of RSS in MB')
+    parser.add_argument('--output', default=None, help='write all samples to this JSON file')
+    args = parser.parse_args()
+
+    repo = os.path.dirname(os.path.abspath(__file__))
+    output = os.path.abspath(args.output) if args.output else None
+
+    # HAnnoI writes to temp/ relative to the working directory, so everything runs in a scratch folder
+    work_dir = tempfile.mkdtemp(prefix='hannoi_leak_')
+    os.chdir(work_dir)
+
+    app = QApplication(sys.argv)
+    from HAnnoI import MainWindow
+    window = MainWindow()
+    window.show()
+
+    samples = []
+    try:
+        pdf_path, csv_path = makeDocument(work_dir, 'leak_check', args.pages, 1748, 2480, args.items)
+        csv_path = Path(csv_path).as_posix()
+        window.loadCsv(csv_path)
+        settle()
+
+        for number in range(1, args.cycles + 1):
+            cycle(window, number, args.selections)
+            if args.reload_every > 0 and number % args.reload_every == 0:
+                window.loadCsv(csv_path)
+            settle()
+
+            if number == args.warmup or (number > args.warmup and number % args.sample_every == 0):
+                samples.append(sample(window, number))
+                print('cycle %6d   RSS %8s MB   scene items %6d   QObjects %6d   Python objects %8d' % (
+                    number, samples[-1]['rss_mb'], samples[-1]['scene_items'], samples[-1]['qobjects'],
+                    samples[-1]['python_objects']), flush=True)
+    finally:
+        window.close()
+        os.chdir(repo)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    failures = check(samples[0], samples[-1], args) if len(samples) > 1 else ['not enough samples']
+
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump({'args': vars(args), 'samples': samples, 'failures': failures}, file, indent=2)
+
+    if len(failures) > 0:
+        print('LEAK CHECK FAILED:\n    ' + '\n    '.join(failures))
+        sys.exit(1)
+    print('Leak check passed.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+import numpy as np
+from scipy import ndimage, signal
+from PIL import Image
+
+'''
+((1)) Page images
+'''
+# page images are analysed as 2D uint8 arrays (grayscale; dark ink on light paper)
+def loadGray(path):
+    with Image.open(path) as image:
+        return np.asarray(image.convert('L'))
+
+
+# global threshold after Otsu, computed from the histogram (so it costs one pass over the page); returns True for ink
+def binarize(gray):
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+
+    weight_dark = np.cumsum(histogram)
+    weight_light = weight_dark[-1] - weight_dark
+    sum_dark = np.cumsum(histogram * levels)
+    mean_dark = sum_dark / np.maximum(weight_dark, 1)
+    mean_light = (sum_dark[-1] - sum_dark) / np.maximum(weight_light, 1)
+
+    between = weight_dark * weight_light * (mean_dark - mean_light) ** 2
+    return gray <= np.argmax(between)
+
+
+'''
+((2)) Letter box proposals
+'''
+# returns one [x, y, width, height] per connected ink component (tight bounds, in page pixels); components smaller than
+# min_area pixels (noise) or larger than max_fraction of the page in either direction (rules, borders) are dropped
+def proposeBoxes(gray, min_area=20, max_fraction=0.2, connectivity=2):
+    ink = binarize(gray)
+    structure = ndimage.generate_binary_structure(2, connectivity)
+    labels, count = ndimage.label(ink, structure=structure)
+    if count == 0: return []
+
+    areas = np.bincount(labels.ravel(), minlength=count + 1)
+    max_height, max_width = gray.shape[0] * max_fraction, gray.shape[1] * max_fraction
+
+    boxes = []
+    for label, slices in enumerate(ndimage.find_objects(labels), start=1):
+        if slices is None or areas[label] < min_area: continue
+        height, width = slices[0].stop - slices[0].start, slices[1].stop - slices[1].start
+        if height > max_height or width > max_width: continue
+        boxes.append([slices[1].start, slices[0].start, width, height])
+    return boxes
+
+
+# proposals of one page image; top-level function, so that it can be run in worker processes
+def proposePage(path):
+    return proposeBoxes(loadGray(path))
+
+
+# intersection over union of each box in a with each box in b (both lists of [x, y, width, height])
+def overlaps(a, b):
+    a, b = np.asarray(a, dtype=np.float64).reshape(-1, 4), np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    left = np.maximum(a[:, None, 0], b[None, :, 0])
+    top = np.maximum(a[:, None, 1], b[None, :, 1])
+    right = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+    bottom = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    union = (a[:, None, 2] * a[:, None, 3]) + (b[None, :, 2] * b[None, :, 3]) - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+
+# returns all pairs (i, j, IoU) with i < j of boxes (array of [x, y, width, height]) that overlap by at least threshold;
+# sort and sweep: after sorting by left edge, only the boxes that start before a box ends can overlap it
+def overlappingPairs(boxes, threshold=0.5):
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    n = len(boxes)
+    if n < 2: return np.empty((0, 2), dtype=np.int64), np.empty(0)
+
+    order = np.argsort(boxes[:, 0], kind='stable')
+    left = boxes[order, 0]
+    ends = np.searchsorted(left, left + boxes[order, 2], side='left')
+
+    # candidate pairs (a, b) in sorted positions: every b after a that starts before a ends
+    counts = np.maximum(ends - np.arange(n) - 1, 0)
+    a = np.repeat(np.arange(n), counts)
+    b = a + 1 + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    a, b = order[a], order[b]
+
+    top = np.maximum(boxes[a, 1], boxes[b, 1])
+    bottom = np.minimum(boxes[a, 1] + boxes[a, 3], boxes[b, 1] + boxes[b, 3])
+    right = np.minimum(boxes[a, 0] + boxes[a, 2], boxes[b, 0] + boxes[b, 2])
+    intersection = np.clip(right - np.maximum(boxes[a, 0], boxes[b, 0]), 0, None) * np.clip(bottom - top, 0, None)
+    union = boxes[a, 2] * boxes[a, 3] + boxes[b, 2] * boxes[b, 3] - intersection
+    iou = intersection / np.maximum(union, 1e-9)
+
+    keep = iou >= threshold
+    pairs = np.column_stack((np.minimum(a, b), np.maximum(a, b)))[keep]
+    return pairs, iou[keep]
+
+
+# drops proposals that overlap an existing item by more than threshold (IoU)
+def newBoxes(boxes, existing, threshold=0.3):
+    if len(boxes) == 0 or len(existing) == 0: return boxes
+    keep = overlaps(boxes, existing).max(axis=1) <= threshold
+    return [box for box, k in zip(boxes, keep) if k]
+
+
+'''
+((3)) Text lines and baselines
+'''
+# returns the text lines of a page as an array of rows (top, bottom, baseline); lines are found in the horizontal ink
+# projection profile (ink pixels per row), the baseline of each line is the row below which the ink drops the most
+def textLines(gray, min_height=5, smooth=3):
+    ink = binarize(gray)
+    profile = ink.sum(axis=1).astype(np.float64)
+    if smooth > 1: profile = np.convolve(profile, np.ones(smooth) / smooth, mode='same')
+
+    # rows with more ink than a fraction of the mean ink row belong to a line
+    inked = profile > 0.1 * profile[profile > 0].mean() if profile.any() else profile > 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], inked.astype(np.int8), [0]))))
+    tops, bottoms = edges[0::2], edges[1::2]  # <- bottoms are exclusive
+    keep = bottoms - tops >= min_height
+    tops, bottoms = tops[keep], bottoms[keep]
+
+    lines = np.empty((len(tops), 3), dtype=np.float64)
+    for i, (top, bottom) in enumerate(zip(tops, bottoms)):
+        band = profile[top:bottom]
+        # descenders are sparse, so the strongest drop of the profile marks the bottom of the main body (baseline)
+        drops = band[:-1] - band[1:]
+        lower = len(drops) // 3  # <- the baseline is in the lower two thirds of the line
+        lines[i] = top, bottom, top + lower + np.argmax(drops[lower:]) + 1 if len(drops) > lower else bottom
+    return lines
+
+
+# returns the baseline under each box (array of [x, y, width, height]) as anchor points [[x, y], ...]: the horizontal
+# centre of the box on the baseline of the line that contains the box centre (or the nearest line)
+def snapAnchors(boxes, lines):
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    centres_x = boxes[:, 0] + boxes[:, 2] / 2
+    centres_y = boxes[:, 1] + boxes[:, 3] / 2
+
+    if len(lines) == 0:  # <- no lines found: bottom centre of the box (like setAnchor)
+        return np.column_stack((centres_x, boxes[:, 1] + boxes[:, 3]))
+
+    # distance of each box centre to each line (0 if it lies within the line)
+    distance = np.maximum(lines[None, :, 0] - centres_y[:, None], 0) + \
+               np.maximum(centres_y[:, None] - lines[None, :, 1], 0)
+    nearest = np.argmin(distance, axis=1)
+    return np.column_stack((centres_x, lines[nearest, 2]))
+
+
+'''
+((4)) Reading order
+'''
+# returns the positions of boxes (array of [x, y, width, height]) in reading order: line by line from top to bottom,
+# each line from left to right; a box belongs to the line of its baseline (its anchor if there is one, otherwise its
+# bottom edge), and a new line starts where the baselines jump by more than line_gap times the median box height
+def readingOrder(boxes, anchors=None, line_gap=0.5):
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0: return np.empty(0, dtype=np.int64)
+
+    baselines = boxes[:, 1] + boxes[:, 3]
+    if anchors is not None:
+        anchor_y = np.array([anchor[1] if anchor is not None else np.nan for anchor in anchors], dtype=np.float64)
+        baselines = np.where(np.isnan(anchor_y), baselines, anchor_y)
+
+    by_baseline = np.argsort(baselines, kind='stable')
+    jumps = np.diff(baselines[by_baseline]) > line_gap * np.median(boxes[:, 3])
+    lines = np.empty(len(boxes), dtype=np.int64)
+    lines[by_baseline] = np.concatenate(([0], np.cumsum(jumps)))
+
+    return np.lexsort((boxes[:, 0] + boxes[:, 2] / 2, lines))
+
+
+'''
+((5)) Glyph descriptors and similarity search
+'''
+# returns one descriptor per box (rows of a float32 array): the ink of the box resampled to size x size pixels plus its
+# row and column profiles, centred and scaled to unit length, so that the dot product of two descriptors is their
+# similarity (1 for identical glyphs); all boxes of a page are resampled at once by indexing a sampling grid
+def glyphDescriptors(gray, boxes, size=16):
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0: return np.empty((0, size * size + 2 * size), dtype=np.float32)
+
+    # 2 x 2 samples per descriptor pixel, averaged below (less aliasing than one sample)
+    steps = (np.arange(2 * size) + 0.5) / (2 * size)
+    xs = np.clip((boxes[:, 0, None] + steps[None, :] * boxes[:, 2, None]).astype(np.int64), 0, gray.shape[1] - 1)
+    ys = np.clip((boxes[:, 1, None] + steps[None, :] * boxes[:, 3, None]).astype(np.int64), 0, gray.shape[0] - 1)
+    samples = gray[ys[:, :, None], xs[:, None, :]].astype(np.float32)
+
+    ink = 255 - samples.reshape(len(boxes), size, 2, size, 2).mean(axis=(2, 4))
+    features = np.concatenate((ink.reshape(len(boxes), -1), ink.mean(axis=2), ink.mean(axis=1)), axis=1)
+    features -= features.mean(axis=1, keepdims=True)
+    features /= np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-6)
+    return features
+
+
+# descriptors of the boxes of one page image; top-level function, so that it can be run in worker processes
+def pageDescriptors(path, boxes):
+    return glyphDescriptors(loadGray(path), boxes)
+
+
+# returns the positions and similarities of the k rows of descriptors that are most similar to query (best first)
+def nearest(descriptors, query, k):
+    scores = descriptors @ query
+    k = min(k, len(scores))
+    if k == 0: return np.empty(0, dtype=np.int64), scores[:0]
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return top, scores[top]
+
+
+'''
+((6)) Template matching
+'''
+# returns the normalized cross-correlation (-1 to 1) of template with every position of gray (top left corners; the
+# result is smaller than gray by the template size); the correlation is computed with FFTs, the normalization with
+# cumulative sums (integral images), so that the cost hardly depends on the template size
+def crossCorrelation(gray, template):
+    image = gray.astype(np.float32)
+    template = template.astype(np.float32)
+    template = template - template.mean()
+    template_norm = np.sqrt((template ** 2).sum())
+    height, width = template.shape
+
+    correlation = signal.fftconvolve(image, template[::-1, ::-1], mode='valid')
+
+    # sum and sum of squares of the image under every template position
+    def windowSums(values):
+        integral = np.pad(values.astype(np.float64).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+        return integral[height:, width:] - integral[:-height, width:] - integral[height:, :-width] + \
+               integral[:-height, :-width]
+
+    sums, squares = windowSums(image), windowSums(image ** 2)
+    variance = np.clip(squares - sums ** 2 / (height * width), 0, None)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ncc = correlation / (np.sqrt(variance) * template_norm)
+    return np.nan_to_num(ncc, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+# returns ([x, y, width, height], score) of all matches of template with a score of at least threshold, best first;
+# matches closer than half the template size to a better match are dropped
+def matchTemplate(gray, template, threshold=0.8, max_hits=1000):
+    height, width = template.shape
+    if gray.shape[0] < height or gray.shape[1] < width: return []
+
+    ncc = crossCorrelation(gray, template)
+    peaks = (ncc >= threshold) & (ncc == ndimage.maximum_filter(ncc, size=(max(1, height // 2) * 2 + 1,
+                                                                             max(1, width // 2) * 2 + 1)))
+    ys, xs = np.nonzero(peaks)
+    order = np.argsort(-ncc[ys, xs])[:max_hits]
+    return [([int(xs[i]), int(ys[i]), width, height], float(ncc[ys[i], xs[i]])) for i in order]
+
+
+# matches of template on one page image; top-level function, so that it can be run in worker processes
+def matchPage(path, template, threshold=0.8):
+    return matchTemplate(loadGray(path), template, threshold)
+
+
+'''
+((7)) Display filters
+'''
+# Faint pages (e.g. pencil on yellowed paper) are easier to box on a filtered image. Every filter maps a grayscale page
+# to a grayscale page of the same size, so boxes drawn on the filtered image fit the original one.
+
+# stretches the gray levels between the low and high percentile to the full range (one lookup table for the page)
+def contrastStretch(gray, low=1, high=99):
+    cumulative = np.cumsum(np.bincount(gray.ravel(), minlength=256)) / gray.size
+    darkest, lightest = np.searchsorted(cumulative, low / 100), np.searchsorted(cumulative, high / 100)
+    if lightest <= darkest: return gray.copy()
+    table = np.clip((np.arange(256) - darkest) * 255.0 / (lightest - darkest), 0, 255).astype(np.uint8)
+    return table[gray]
+
+
+# gray level of the paper around every pixel: the lightest level within size pixels (which removes the ink), smoothed;
+# the background changes slowly, so it is estimated on the page scaled down by step
+def paperBackground(gray, size=64, step=4):
+    small = gray[::step, ::step]
+    window = max(1, size // step)
+    background = ndimage.uniform_filter(ndimage.maximum_filter(small, size=window).astype(np.float32), size=window)
+    background = np.repeat(np.repeat(background, step, axis=0), step, axis=1)
+    return background[:gray.shape[0], :gray.shape[1]]
+
+
+# divides the page by its paper background, so that stains, shadows and uneven lighting become white
+def flattenBackground(gray, size=64):
+    flat = gray.astype(np.float32) * 255 / np.maximum(paperBackground(gray, size), 1)
+    return np.clip(flat, 0, 255).astype(np.uint8)
+
+
+# ink (black) where a pixel is darker than the mean of its neighbourhood by more than offset, paper (white) elsewhere;
+# unlike the global threshold of binarize, this also finds faint strokes next to dark ones
+def adaptiveBinarize(gray, size=31, offset=8):
+    mean = ndimage.uniform_filter(gray.astype(np.float32), size=size)
+    return np.where(gray < mean - offset, 0, 255).astype(np.uint8)
+
+
+# the ink of the flattened page with its contrast stretched, everything else white
+def inkOnly(gray, size=64):
+    flat = flattenBackground(gray, size)
+    return np.where(binarize(flat), contrastStretch(flat), 255).astype(np.uint8)
+
+
+# filters by the name their images are cached under
+FILTERS = {'contrast': contrastStretch, 'binary': adaptiveBinarize, 'flat': flattenBackground, 'ink': inkOnly}
+
+
+# name of the cached image of a page image with a filter
+def filteredName(image_name, name):
+    return '%s.%s.png' % (image_name, name)
+
+
+# writes the image of every filter to paths (a dictionary of filter names and paths); the page is loaded only once;
+# top-level function, so that it can be run in worker processes
+def filterPage(path, paths):
+    gray = loadGray(path)
+    for name, out_path in paths.items():
+        Image.fromarray(FILTERS[name](gray)).save(out_path, format='PNG')
+    return paths
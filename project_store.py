@@ -0,0 +1,326 @@
+import os
+import sqlite3
+import argparse
+
+import pandas as pd
+
+'''
+((1)) Schema
+'''
+# A project is a single SQLite file that holds any number of documents (PDFs or images) with their pages, annotation
+# layers, items and annotation values. Values are stored sparsely (empty annotations have no row), and only the
+# documents/pages that are asked for are read, so that large multi-document projects never have to be loaded at once.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    document INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    number INTEGER NOT NULL,
+    UNIQUE (document, number)
+);
+CREATE TABLE IF NOT EXISTS layers (
+    id INTEGER PRIMARY KEY,
+    document INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (document, position)
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    document INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    page INTEGER NOT NULL,
+    item_index INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    width REAL NOT NULL,
+    height REAL NOT NULL,
+    color TEXT NOT NULL,
+    anchor_x REAL,
+    anchor_y REAL
+);
+CREATE TABLE IF NOT EXISTS item_values (
+    item INTEGER NOT NULL REFERENCES items(id) ON DELETE CASCADE,
+    layer INTEGER NOT NULL REFERENCES layers(id) ON DELETE CASCADE,
+    value TEXT NOT NULL,
+    PRIMARY KEY (item, layer)
+);
+CREATE INDEX IF NOT EXISTS items_by_page ON items (document, page);
+CREATE INDEX IF NOT EXISTS items_by_index ON items (document, item_index);
+CREATE INDEX IF NOT EXISTS values_by_layer ON item_values (layer, value);
+'''
+
+# file extension of project files
+EXTENSION = '.hannoi'
+
+
+# coordinates and anchors are lists in the app, but strings like '[12.5, 30.0]' once written to CSV
+def parseList(value):
+    if value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)): return None
+    if isinstance(value, str): value = value[1:-1].split(', ')
+    return [float(v) for v in value]
+
+
+'''
+((2)) Project store
+'''
+class ProjectStore:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute('PRAGMA journal_mode = WAL')  # <- small transactions do not rewrite the whole file
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    # returns a list of (id, path, name) of all documents in the project
+    def documents(self):
+        return self.connection.execute('SELECT id, path, name FROM documents ORDER BY id').fetchall()
+
+    # returns the id of the document at path (None if it is not part of the project)
+    def document(self, path):
+        row = self.connection.execute('SELECT id FROM documents WHERE path = ?', (os.path.abspath(path),)).fetchone()
+        return row[0] if row is not None else None
+
+    def pageCount(self, document):
+        return self.connection.execute('SELECT COUNT(*) FROM pages WHERE document = ?', (document,)).fetchone()[0]
+
+    def layers(self, document):
+        return [row[0] for row in self.connection.execute(
+            'SELECT name FROM layers WHERE document = ? ORDER BY position', (document,))]
+
+    def itemCount(self, document, page=None):
+        if page is None:
+            return self.connection.execute('SELECT COUNT(*) FROM items WHERE document = ?', (document,)).fetchone()[0]
+        return self.connection.execute('SELECT COUNT(*) FROM items WHERE document = ? AND page = ?',
+                                       (document, page)).fetchone()[0]
+
+    # returns the items of a document (or of one of its pages) as a data frame in the CSV export format
+    def frame(self, document, page=None):
+        name = self.connection.execute('SELECT name FROM documents WHERE id = ?', (document,)).fetchone()[0]
+        layers = self.layers(document)
+
+        query = 'SELECT id, item_index, page, x, y, width, height, color, anchor_x, anchor_y FROM items ' \
+                'WHERE document = ?'
+        params = [document]
+        if page is not None:
+            query += ' AND page = ?'
+            params.append(page)
+        rows = self.connection.execute(query + ' ORDER BY item_index', params).fetchall()
+
+        values = dict()
+        value_query = 'SELECT v.item, l.position, v.value FROM item_values v JOIN layers l ON v.layer = l.id ' \
+                      'JOIN items i ON v.item = i.id WHERE i.document = ?'
+        if page is not None: value_query += ' AND i.page = ?'
+        for item, position, value in self.connection.execute(value_query, params):
+            values.setdefault(item, [''] * len(layers))[position] = value
+
+        records = []
+        for item, index, page_number, x, y, width, height, color, anchor_x, anchor_y in rows:
+            record = {'Index': index,
+                      'Page': page_number,
+                      'Coordinates': str([x, y, width, height]),
+                      'Color': color,
+                      'Anchor': str([anchor_x, anchor_y]) if anchor_x is not None else None,
+                      'Source': name}
+            record.update(zip(layers, values.get(item, [''] * len(layers))))
+            records.append(record)
+
+        return pd.DataFrame(records, columns=['Index', 'Page', 'Coordinates', 'Color', 'Anchor', 'Source'] + layers)
+
+    # returns (index, page) of all items of a document whose annotation in layer equals value
+    def find(self, document, layer, value):
+        return self.connection.execute(
+            'SELECT i.item_index, i.page FROM item_values v JOIN layers l ON v.layer = l.id JOIN items i '
+            'ON v.item = i.id WHERE l.document = ? AND l.name = ? AND v.value = ? ORDER BY i.item_index',
+            (document, layer, value)).fetchall()
+
+    '''
+    ((2.1)) Saving whole documents (CSV import, "Save to Project")
+    '''
+    # replaces everything stored for the document at path with the data frame (CSV export format) in one transaction;
+    # returns the id of the document
+    def saveFrame(self, path, pages, df):
+        path = os.path.abspath(path)
+        with self.connection:
+            self.connection.execute('DELETE FROM documents WHERE path = ?', (path,))
+            document = self.connection.execute('INSERT INTO documents (path, name) VALUES (?, ?)',
+                                               (path, os.path.basename(path))).lastrowid
+            self.connection.executemany('INSERT INTO pages (document, number) VALUES (?, ?)',
+                                        [(document, number) for number in range(1, pages + 1)])
+
+            layer_ids = []
+            for position, name in enumerate(df.columns[6:]):
+                layer_ids.append(self.connection.execute(
+                    'INSERT INTO layers (document, position, name) VALUES (?, ?, ?)',
+                    (document, position, name)).lastrowid)
+
+            for row in df.itertuples(index=False):
+                x, y, width, height = parseList(row[2])
+                anchor_x, anchor_y = parseList(row[4]) or (None, None)
+
+                item = self.connection.execute(
+                    'INSERT INTO items (document, page, item_index, x, y, width, height, color, anchor_x, anchor_y) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (document, int(row[1]), int(row[0]), x, y, width, height, row[3], anchor_x, anchor_y)).lastrowid
+
+                self.connection.executemany(
+                    'INSERT INTO item_values (item, layer, value) VALUES (?, ?, ?)',
+                    [(item, layer, str(value)) for layer, value in zip(layer_ids, row[6:])
+                     if not pd.isna(value) and str(value) != ''])
+        return document
+
+    # imports a CSV file (export format); document is the PDF/image the CSV belongs to (default: next to the CSV)
+    def importCsv(self, csv_path, document=None):
+        df = pd.read_csv(csv_path)
+        if document is None:
+            document = os.path.join(os.path.dirname(os.path.abspath(csv_path)), df['Source'][0])
+        pages = int(df['Page'].max()) if len(df) > 0 else 1
+        if document.lower().endswith('.pdf') and os.path.exists(document):
+            import fitz
+            pages = len(fitz.open(document))
+        return self.saveFrame(document, pages, df)
+
+    def exportCsv(self, document, csv_path):
+        self.frame(document).to_csv(csv_path, index=False)
+
+    '''
+    ((2.2)) Saving single edits (see the edit journal of HAnnoI)
+    '''
+    # writes one edit of the edit journal (same records as in journal.py) to the document in one small transaction
+    def applyEdit(self, document, record):
+        self.applyEdits(document, [record])
+
+    # writes several edits (e.g. one edit of many selected items in HAnnoI) in one transaction
+    def applyEdits(self, document, records):
+        with self.connection:
+            for record in records:
+                self.writeEdit(document, record)
+
+    def writeEdit(self, document, record):
+        op = record['op']
+        if op == 'add':
+            x, y, width, height = record['coords']
+            self.connection.execute(
+                'INSERT INTO items (document, page, item_index, x, y, width, height, color) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (document, record['page'], record['index'], x, y, width, height, record['color']))
+
+        elif op == 'delete':
+            self.connection.execute('DELETE FROM items WHERE document = ? AND item_index = ?',
+                                    (document, record['index']))
+            self.connection.execute('UPDATE items SET item_index = item_index - 1 '
+                                    'WHERE document = ? AND item_index > ?', (document, record['index']))
+
+        elif op == 'reindex':
+            old, new = record['index'], record['new']
+            item = self.itemId(document, old)
+            if old > new:
+                self.connection.execute('UPDATE items SET item_index = item_index + 1 WHERE document = ? '
+                                        'AND item_index >= ? AND item_index < ?', (document, new, old))
+            elif old < new:
+                self.connection.execute('UPDATE items SET item_index = item_index - 1 WHERE document = ? '
+                                        'AND item_index <= ? AND item_index > ?', (document, new, old))
+            self.connection.execute('UPDATE items SET item_index = ? WHERE id = ?', (new, item))
+
+        elif op == 'renumber':
+            # two steps, as the new indices are the old indices of other items
+            self.connection.executemany('UPDATE items SET item_index = ? WHERE document = ? AND item_index = ?',
+                                        [(-new, document, old) for old, new in record['pairs']])
+            self.connection.execute('UPDATE items SET item_index = -item_index WHERE document = ? '
+                                    'AND item_index < 0', (document,))
+
+        elif op == 'coords':
+            x, y, width, height = record['coords']
+            self.connection.execute('UPDATE items SET x = ?, y = ?, width = ?, height = ? '
+                                    'WHERE document = ? AND item_index = ?',
+                                    (x, y, width, height, document, record['index']))
+
+        elif op == 'annotate':
+            item = self.itemId(document, record['index'])
+            layer = self.connection.execute('SELECT id FROM layers WHERE document = ? AND position = ?',
+                                            (document, record['layer'])).fetchone()[0]
+            if record['value'] == '':
+                self.connection.execute('DELETE FROM item_values WHERE item = ? AND layer = ?', (item, layer))
+            else:
+                self.connection.execute('INSERT OR REPLACE INTO item_values (item, layer, value) VALUES (?, ?, ?)',
+                                        (item, layer, record['value']))
+
+        elif op == 'anchor':
+            anchor_x, anchor_y = record['anchor']
+            self.connection.execute('UPDATE items SET anchor_x = ?, anchor_y = ? '
+                                    'WHERE document = ? AND item_index = ?',
+                                    (anchor_x, anchor_y, document, record['index']))
+
+        elif op == 'color':
+            self.connection.execute('UPDATE items SET color = ? WHERE document = ? AND item_index = ?',
+                                    (record['color'], document, record['index']))
+
+        elif op == 'layer':
+            position = self.connection.execute('SELECT COUNT(*) FROM layers WHERE document = ?',
+                                               (document,)).fetchone()[0]
+            self.connection.execute('INSERT INTO layers (document, position, name) VALUES (?, ?, ?)',
+                                    (document, position, record['name']))
+
+    def itemId(self, document, index):
+        return self.connection.execute('SELECT id FROM items WHERE document = ? AND item_index = ?',
+                                       (document, index)).fetchone()[0]
+
+
+'''
+((3)) Command line (CSV import/export for compatibility)
+'''
+def main():
+    parser = argparse.ArgumentParser(description='Import CSV files into a HAnnoI project or export them again.')
+    parser.add_argument('project', help='project file (%s)' % EXTENSION)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help='import CSV files (one per document)')
+    import_parser.add_argument('csv', nargs='+')
+    import_parser.add_argument('--document', help='PDF/image of the CSV file (default: the "Source" next to it)')
+
+    export_parser = commands.add_parser('export', help='export all documents as CSV files')
+    export_parser.add_argument('folder')
+
+    commands.add_parser('list', help='list all documents')
+
+    find_parser = commands.add_parser('find', help='list all items with the given annotation')
+    find_parser.add_argument('layer')
+    find_parser.add_argument('value')
+    args = parser.parse_args()
+
+    store = ProjectStore(args.project)
+    try:
+        if args.command == 'import':
+            for csv_path in args.csv:
+                document = store.importCsv(csv_path, args.document)
+                print('%s: %d items' % (csv_path, store.itemCount(document)))
+
+        elif args.command == 'export':
+            os.makedirs(args.folder, exist_ok=True)
+            for document, path, name in store.documents():
+                csv_path = os.path.join(args.folder, os.path.splitext(name)[0] + '.csv')
+                store.exportCsv(document, csv_path)
+                print('%s: %d items' % (csv_path, store.itemCount(document)))
+
+        elif args.command == 'list':
+            for document, path, name in store.documents():
+                print('%-40s %5d pages %8d items   %s' % (name, store.pageCount(document), store.itemCount(document),
+                                                          path))
+
+        elif args.command == 'find':
+            for document, path, name in store.documents():
+                for index, page in store.find(document, args.layer, args.value):
+                    print('%s\tpage %d\titem %d' % (name, page, index))
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()